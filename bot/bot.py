@@ -1,39 +1,81 @@
 import logging
+from typing import Optional
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from bot.fsm_storage import KVStorage
+from bot.readiness import Readiness
 from bot.handlers import router
+from bot.webhook import InFlightTracker, WebhookSettings, serve_webhook
 from database.db_handlers import DatabaseOperations
+from database.kv_store import KVStore, MemoryKVStore
+from database.live_ingest import INGEST_PORT, start_ingest_server
+from nlp.query_parser import question_cache, set_shared_store
+from monitoring.metrics import handlers_in_flight, db_connections_in_use
+from monitoring.server import METRICS_PORT, start_metrics_server
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+def create_bot(token: str, api_url: Optional[str] = None) -> Bot:
+    """Создает Bot; api_url — адрес собственного (или тестового) сервера Bot API"""
+    if api_url:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(api_url))
+        return Bot(token=token, session=session)
+    return Bot(token=token)
+
+
 class VideoAnalyticsBot:
-    def __init__(self, token: str, db_operations: DatabaseOperations):
-        # Используем MemoryStorage для хранения состояний FSM
-        storage = MemoryStorage()
+    def __init__(self, token: str, db_operations: DatabaseOperations, api_url: Optional[str] = None,
+                 store: Optional[KVStore] = None, metrics_port: int = METRICS_PORT,
+                 readiness: Optional[Readiness] = None, ingest_port: int = INGEST_PORT):
+        # Состояния FSM и кэш вопросов — в общем хранилище (STATE_BACKEND),
+        # по умолчанию в памяти процесса
+        self.store = store or MemoryKVStore()
+        storage = KVStorage(self.store)
+        set_shared_store(self.store)
         
-        self.bot = Bot(token=token)
-        self.dp = Dispatcher(storage=storage)
+        self.bot = create_bot(token, api_url)
+        # db_operations и readiness (импорт при запуске) доступны обработчикам как аргументы
+        self.dp = Dispatcher(storage=storage, db_operations=db_operations, readiness=readiness)
         self.db_operations = db_operations
 
-        self.dp.include_router(router)
+        # Учет обработчиков в работе — для корректной остановки
+        self.in_flight = InFlightTracker()
+        self.dp.update.outer_middleware(self.in_flight)
 
-        # Передаем db_operations в handlers
-        from bot.handlers import set_db_operations
+        self.dp.include_router(router)
 
-        set_db_operations(db_operations)
+        # Метрики Prometheus (METRICS_PORT; 0 — без HTTP-сервера)
+        self.metrics_port = metrics_port
+        self.metrics_runner = None
+        # Прием снимков счетчиков (INGEST_PORT; 0 — без HTTP-сервера)
+        self.ingest_port = ingest_port
+        self.ingest_runner = None
+        handlers_in_flight.set_function(lambda: self.in_flight.active)
+        db_connections_in_use.set_function(lambda: self.db_operations.pool_stats()['checked_out'])
             
     async def on_startup(self):
         """Действия при запуске бота"""
         logger.info("Бот запущен")
+        self.metrics_runner = await start_metrics_server(self.metrics_port)
+        self.ingest_runner = await start_ingest_server(self.db_operations.engine, self.ingest_port)
         
     
     async def on_shutdown(self):
         """Действия при остановке бота"""
         logger.info("Бот остановлен")
-        await self.bot.close()
-        # Очищаем хранилище состояний
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        if self.ingest_runner is not None:
+            await self.ingest_runner.cleanup()
+        # Закрываем HTTP-сессию (метод Bot API close здесь не нужен:
+        # он выводит бота с сервера и мешает воркерам webhook)
+        await self.bot.session.close()
+        # Сохраняем накопленные записи хранилища состояний и кэша вопросов
         await self.dp.storage.close()
+        await question_cache.flush()
     
     async def run(self):
         """Запуск бота"""
@@ -41,4 +83,12 @@ class VideoAnalyticsBot:
         try:
             await self.dp.start_polling(self.bot)
         finally:
-            await self.on_shutdown()
\ No newline at end of file
+            await self.on_shutdown()
+
+    async def run_webhook(self, settings: WebhookSettings, register_webhook: bool = True):
+        """Запуск бота в режиме webhook"""
+        await self.on_startup()
+        try:
+            await serve_webhook(self, settings, register_webhook=register_webhook)
+        finally:
+            await self.on_shutdown()
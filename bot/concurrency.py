@@ -0,0 +1,121 @@
+from contextlib import asynccontextmanager
+import asyncio
+import time
+
+
+class Overloaded(Exception):
+    """Очередь на обработку заполнена"""
+
+
+class SingleFlight:
+    """Объединение одновременных одинаковых запросов
+
+    Пока выполняется запрос с ключом key, остальные вызовы с тем же ключом
+    не запускают работу заново, а ждут общий результат.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._inflight)
+
+    async def do(self, key, factory):
+        """Возвращает результат factory() — общий для всех одновременных вызовов с key"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        # shield: отмена одного ожидающего не отменяет общую работу
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Ошибку уже получили ожидающие; без этого asyncio предупредит о непрочитанном исключении
+        if not task.cancelled():
+            task.exception()
+
+
+class ConcurrencyLimiter:
+    """Ограничение числа одновременно обрабатываемых запросов с ограниченной очередью"""
+
+    def __init__(self, max_concurrent: int, max_queue: int):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        """Занимает место обработки; при переполненной очереди выбрасывает Overloaded"""
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded()
+
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            'active': self.active,
+            'waiting': self.waiting,
+            'rejected': self.rejected,
+        }
+
+
+class RateLimiter:
+    """Ограничение частоты запросов пользователя (token bucket)"""
+
+    def __init__(self, per_minute: float, burst: int, max_users: int = 10000):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_users = max_users
+        # user_id -> (доступные токены, время последнего пересчета)
+        self._buckets = {}
+        self.limited = 0
+
+    def allow(self, user_id) -> bool:
+        """Расходует токен пользователя; False, если лимит исчерпан"""
+        if self.rate <= 0:
+            return True
+
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self._buckets[user_id] = (tokens, now)
+            self.limited += 1
+            return False
+
+        self._buckets[user_id] = (tokens - 1, now)
+        if len(self._buckets) > self.max_users:
+            self._prune(now)
+        return True
+
+    def _prune(self, now: float):
+        """Удаляет пользователей, чьи корзины уже полностью восстановились"""
+        full_after = self.burst / self.rate
+        self._buckets = {
+            user_id: (tokens, updated)
+            for user_id, (tokens, updated) in self._buckets.items()
+            if now - updated < full_after
+        }
@@ -0,0 +1,53 @@
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from decouple import config
+
+from database.kv_store import KVStore
+
+
+# Пространство имен состояний FSM в хранилище
+FSM_NAMESPACE = 'fsm'
+
+# Время жизни состояния: зависшее состояние (например, после падения процесса)
+# не блокирует пользователя дольше этого срока
+FSM_STATE_TTL = config('FSM_STATE_TTL', default=3600, cast=float)
+
+
+class KVStorage(BaseStorage):
+    """Хранилище состояний FSM aiogram поверх KVStore
+
+    С PostgresKVStore состояния видны всем экземплярам бота, поэтому
+    следующее обновление пользователя может обработать любой из них.
+    """
+
+    def __init__(self, store: KVStore, ttl: float = FSM_STATE_TTL, key_builder: Optional[KeyBuilder] = None):
+        self.store = store
+        self.ttl = ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        name = self.key_builder.build(key, 'state')
+        state = state.state if isinstance(state, State) else state
+        if state is None:
+            await self.store.delete(FSM_NAMESPACE, name)
+        else:
+            await self.store.set(FSM_NAMESPACE, name, state, ttl=self.ttl)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self.store.get(FSM_NAMESPACE, self.key_builder.build(key, 'state'))
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        name = self.key_builder.build(key, 'data')
+        if not data:
+            await self.store.delete(FSM_NAMESPACE, name)
+        else:
+            await self.store.set(FSM_NAMESPACE, name, data, ttl=self.ttl)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        data = await self.store.get(FSM_NAMESPACE, self.key_builder.build(key, 'data'))
+        return dict(data) if data else {}
+
+    async def close(self) -> None:
+        await self.store.close()
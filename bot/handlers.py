@@ -4,8 +4,15 @@ from aiogram.types import Message
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 import logging
-from nlp.query_parser import parse_with_openai
+import time
+from decimal import Decimal
+from nlp.query_parser import parse_question
+from nlp.normalize import normalize_question
 from database.db_handlers import DatabaseOperations
+from database.query_policy import QueryRejected
+from bot.concurrency import SingleFlight, ConcurrencyLimiter, RateLimiter, Overloaded
+from bot.readiness import Readiness
+from monitoring.metrics import handler_seconds, errors_total
 from decouple import config
 
 logging.basicConfig(level=logging.INFO)
@@ -13,19 +20,25 @@ logger = logging.getLogger(__name__)
 
 router = Router()
 
-# Глобальная переменная для DatabaseOperations
-db_operations = None
+# Одновременные одинаковые вопросы разделяют один вызов модели и один запрос к БД
+single_flight = SingleFlight()
+
+# Не больше BOT_MAX_CONCURRENT вопросов в работе и BOT_MAX_QUEUE в очереди
+limiter = ConcurrencyLimiter(
+    max_concurrent=config('BOT_MAX_CONCURRENT', default=8, cast=int),
+    max_queue=config('BOT_MAX_QUEUE', default=32, cast=int),
+)
+
+# Частота вопросов от одного пользователя
+rate_limiter = RateLimiter(
+    per_minute=config('USER_RATE_PER_MINUTE', default=10, cast=float),
+    burst=config('USER_RATE_BURST', default=3, cast=int),
+)
 
 # Состояния для вопроса от пользователя
 class Gen(StatesGroup):
     wait = State()
 
-# Функция для установки DatabaseOperations
-def set_db_operations(db_ops):
-    global db_operations
-    db_operations = db_ops
-    logger.info("DatabaseOperations установлен в handlers")
-
 @router.message(CommandStart())
 async def cmd_start(message: Message):
     """Обработчик команды /start"""
@@ -60,86 +73,123 @@ async def cmd_help(message: Message):
         """
     await message.answer(help_text)
 
-# @router.message(Gen.wait)
-# async def stop_flood(message: Message):
-#     await message.answer('Подождите, ваш запрос генерируется.')
+@router.message(Gen.wait)
+async def stop_flood(message: Message):
+    await message.answer('Подождите, ваш запрос генерируется.')
+
+
+def format_result(result) -> str:
+    """Преобразует результат запроса в текст ответа"""
+    if result is None:
+        return "Не удалось получить данные"
+
+    # Извлекаем числовое значение
+    if isinstance(result, (list, tuple)) and len(result) > 0:
+        if isinstance(result[0], (list, tuple)) and len(result[0]) > 0:
+            value = result[0][0]
+        else:
+            value = result[0]
+    else:
+        value = result
+    
+    # Преобразуем Decimal в строку
+    if isinstance(value, Decimal):
+        # Преобразуем Decimal в int или float для форматирования
+        if value % 1 == 0:
+            value = int(value)
+        else:
+            value = float(value)
+    
+    # Форматирование числа
+    try:
+        if isinstance(value, (int, float)):
+            # Форматируем без разделителей тысяч
+            return f"{value:,}".replace(',', '')
+        # Просто преобразуем в строку
+        return str(value)
+    except Exception as e:
+        logger.error(f"Ошибка форматирования: {e}")
+        return str(value)
+
+
+async def answer_question(text: str, db_operations: DatabaseOperations) -> str:
+    """Полный цикл ответа на вопрос: SQL, выполнение и форматирование"""
+    parsed = await parse_question(text)
+
+    if not parsed:
+        errors_total.inc(kind='no_sql')
+        return "Не удалось сгенерировать SQL запрос"
+
+    logger.info(f"Сгенерирован SQL ({parsed.path}): {parsed.sql}")
+
+    # Выполняем запрос через экземпляр класса
+    result = await db_operations.execute_query(parsed.sql, parsed.params)
+
+    return format_result(result)
+
 
+async def answer_limited(text: str, db_operations: DatabaseOperations) -> str:
+    """Ответ на вопрос с ограничением числа одновременных обработок"""
+    async with limiter.slot():
+        return await answer_question(text, db_operations)
+
+
+# db_operations и readiness передаются из данных диспетчера (VideoAnalyticsBot)
 @router.message()
-async def generating(message: Message, state: FSMContext):
+async def generating(message: Message, state: FSMContext, db_operations: DatabaseOperations = None,
+                     readiness: Readiness = None):
     if db_operations is None:
         await message.answer("База данных не инициализирована. Проверьте настройки подключения.")
         return
 
+    # Импорт при запуске еще идет, а отвечать не по чему
+    notice = readiness.notice() if readiness is not None else None
+    if notice:
+        errors_total.inc(kind='not_ready')
+        await message.answer(notice)
+        return
+
     # # Сразу отправляем сообщение о том, что запрос обрабатывается
     # wait_msg = await message.answer('Подождите, ваш запрос генерируется...')
 
-    await state.set_state(Gen.wait)
-    
     if not message.text:
         await message.answer("Пожалуйста, задайте вопрос")
-        await state.clear()
         return
-        
-    try:
-        sql_query = await parse_with_openai(message.text)
-        logger.info(f"Сгенерирован SQL: {sql_query}")
-
-        if not sql_query:
-            await message.answer("Не удалось сгенерировать SQL запрос")
-            await state.clear()
-            return
 
-        # Выполняем запрос через экземпляр класса
-        result = await db_operations.execute_query(sql_query)
+    user_id = message.from_user.id if message.from_user else message.chat.id
+    if not rate_limiter.allow(user_id):
+        errors_total.inc(kind='rate_limited')
+        await message.answer("Слишком много вопросов подряд. Подождите немного и спросите снова.")
+        return
 
-        # Форматируем ответ
-        if result is None:
-            response = "Не удалось получить данные"
-        else:
-            # Извлекаем числовое значение
-            if isinstance(result, (list, tuple)) and len(result) > 0:
-                if isinstance(result[0], (list, tuple)) and len(result[0]) > 0:
-                    value = result[0][0]
-                else:
-                    value = result[0]
-            else:
-                value = result
-            
-            # Преобразуем Decimal в строку
-            from decimal import Decimal
-            if isinstance(value, Decimal):
-                # Преобразуем Decimal в int или float для форматирования
-                if value % 1 == 0:
-                    value = int(value)
-                else:
-                    value = float(value)
-            
-            # Форматирование числа
-            try:
-                if isinstance(value, (int, float)):
-                    # Форматируем без разделителей тысяч
-                    formatted = f"{value:,}".replace(',', '')
-                    response = formatted
-                else:
-                    # Просто преобразуем в строку
-                    response = str(value)
-            except Exception as e:
-                logger.error(f"Ошибка форматирования: {e}")
-                response = str(value)
+    await state.set_state(Gen.wait)
+    started = time.perf_counter()
+    outcome = 'ok'
         
-        # Убедимся, что response - строка
-        if not isinstance(response, str):
-            response = str(response)
-                
+    try:
+        # Одинаковые вопросы, заданные одновременно, обрабатываются один раз
+        key = normalize_question(message.text)
+        response = await single_flight.do(key, lambda: answer_limited(message.text, db_operations))
         await message.answer(response)
 
+    except QueryRejected as e:
+        outcome = 'rejected'
+        errors_total.inc(kind=f'rejected_{e.reason}')
+        await message.answer(e.user_message)
+
+    except Overloaded:
+        outcome = 'overloaded'
+        errors_total.inc(kind='overloaded')
+        logger.warning(f"Очередь вопросов переполнена: {limiter.stats()}")
+        await message.answer("Бот сейчас перегружен, попробуйте через минуту.")
+
     except Exception as e:
+        outcome = 'error'
+        errors_total.inc(kind='exception')
         logger.error(f"Ошибка: {e}")
         await message.answer(f"Произошла ошибка: {str(e)}")
     
     finally:
         # await wait_msg.delete()
         await state.clear()
-
-
-
+        handler_seconds.observe(time.perf_counter() - started, outcome=outcome)
@@ -0,0 +1,54 @@
+from typing import Optional
+import logging
+
+from decouple import config
+from sqlalchemy import text
+
+from database.progress import ImportProgress, import_progress
+
+
+logger = logging.getLogger(__name__)
+
+# Отвечать по уже загруженным данным, пока идет импорт при запуске
+STARTUP_SERVE_STALE = config('STARTUP_SERVE_STALE', default=True, cast=bool)
+
+HAS_DATA_SQL = "SELECT EXISTS (SELECT 1 FROM videos)"
+
+
+class Readiness:
+    """Можно ли отвечать на вопросы, пока идет импорт при запуске
+
+    Если в базе уже есть данные прошлых импортов, бот отвечает по ним
+    (последнее закоммиченное состояние); если данных нет, вместо ответа
+    сообщает, что данные загружаются, и сколько загружено.
+    """
+
+    def __init__(self, progress: ImportProgress = import_progress, serve_stale: bool = STARTUP_SERVE_STALE):
+        self.progress = progress
+        self.serve_stale = serve_stale
+        self.has_data = False
+
+    async def check_data(self, engine) -> bool:
+        """Есть ли в базе данные на момент запуска"""
+        try:
+            async with engine.connect() as conn:
+                self.has_data = bool(await conn.scalar(text(HAS_DATA_SQL)))
+        except Exception as e:
+            # Например, таблиц еще нет: их создаст импорт
+            logger.warning(f"Не удалось проверить наличие данных: {e}")
+            self.has_data = False
+        return self.has_data
+
+    def import_finished(self):
+        if self.progress.processed:
+            self.has_data = True
+
+    def notice(self) -> Optional[str]:
+        """Текст для пользователя вместо ответа или None, если можно отвечать"""
+        if self.progress.running:
+            if self.has_data and self.serve_stale:
+                return None
+            return f"Данные загружаются: {self.progress.describe()}. Попробуйте чуть позже."
+        if self.progress.state == ImportProgress.FAILED and not self.has_data:
+            return "Данные не загружены: импорт завершился ошибкой. Попробуйте позже."
+        return None
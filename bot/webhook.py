@@ -0,0 +1,206 @@
+from dataclasses import dataclass
+from typing import Optional
+import asyncio
+import logging
+import multiprocessing
+import signal
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+from decouple import config
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class WebhookSettings:
+    """Настройки режима webhook"""
+    url: str
+    path: str = '/webhook'
+    host: str = '0.0.0.0'
+    port: int = 8080
+    secret: str = ''
+    workers: int = 1
+    drain_timeout: float = 30.0
+    api_url: str = ''
+
+    @property
+    def webhook_url(self) -> str:
+        return self.url.rstrip('/') + self.path
+
+    @classmethod
+    def from_config(cls) -> 'WebhookSettings':
+        return cls(
+            url=config('WEBHOOK_URL', default=''),
+            path=config('WEBHOOK_PATH', default='/webhook'),
+            host=config('WEBHOOK_HOST', default='0.0.0.0'),
+            port=config('WEBHOOK_PORT', default=8080, cast=int),
+            secret=config('WEBHOOK_SECRET', default=''),
+            workers=config('WEBHOOK_WORKERS', default=1, cast=int),
+            drain_timeout=config('SHUTDOWN_DRAIN_TIMEOUT', default=30, cast=float),
+            api_url=config('TELEGRAM_API_URL', default=''),
+        )
+
+
+class InFlightTracker(BaseMiddleware):
+    """Считает обновления в обработке, чтобы при остановке дождаться их завершения"""
+
+    def __init__(self):
+        self.active = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(self, handler, event, data):
+        self.active += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.active -= 1
+            if self.active == 0:
+                self._idle.set()
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """Ждет завершения всех обработчиков; False, если не дождались за timeout"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+async def serve_webhook(app_bot, settings: WebhookSettings, register_webhook: bool = True):
+    """Принимает обновления по webhook до сигнала остановки, затем дожидается обработчиков
+
+    app_bot — VideoAnalyticsBot. При нескольких воркерах порт открывается
+    с SO_REUSEPORT, и ядро распределяет соединения между процессами.
+    """
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=app_bot.dp,
+        bot=app_bot.bot,
+        secret_token=settings.secret or None,
+    ).register(app, path=settings.path)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, settings.host, settings.port, reuse_port=settings.workers > 1)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await app_bot.dp.emit_startup(bot=app_bot.bot)
+    await site.start()
+    logger.info(f"Webhook слушает {settings.host}:{settings.port}{settings.path}")
+
+    if register_webhook:
+        await app_bot.bot.set_webhook(settings.webhook_url, secret_token=settings.secret or None)
+        logger.info(f"Webhook зарегистрирован: {settings.webhook_url}")
+
+    try:
+        await stop.wait()
+    finally:
+        # Перестаем принимать новые обновления и дожидаемся начатых
+        logger.info(f"Остановка: ожидание {app_bot.in_flight.active} обработчиков...")
+        await site.stop()
+        if not await app_bot.in_flight.wait_idle(settings.drain_timeout):
+            logger.warning(f"Не дождались {app_bot.in_flight.active} обработчиков за {settings.drain_timeout} с")
+        await runner.cleanup()
+        await app_bot.dp.emit_shutdown(bot=app_bot.bot)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+
+
+async def _run_worker(token: str, settings: WebhookSettings, index: int = 0):
+    """Воркер: собственные пул соединений, бот и HTTP-сервер на общем порту
+
+    Метрики у каждого воркера свои, поэтому воркер index отдает их
+    на METRICS_PORT + index. Прием снимков (INGEST_PORT) запускается только в первом воркере.
+    """
+    from bot.bot import VideoAnalyticsBot
+    from database.db_handlers import DatabaseOperations
+    from database.engine import get_engine, warm_up
+    from database.kv_store import create_store
+    from database.live_ingest import INGEST_PORT
+    from monitoring.server import METRICS_PORT
+
+    engine = get_engine()
+    store = create_store(engine)
+    db_operations = DatabaseOperations(engine=engine, store=store)
+    await warm_up(engine)
+    # Колонки для простых агрегатов загружаются в фоне (COLUMNAR_ENABLED)
+    await db_operations.warm_up_columnar()
+
+    app_bot = VideoAnalyticsBot(
+        token, db_operations, api_url=settings.api_url or None, store=store,
+        metrics_port=METRICS_PORT + index if METRICS_PORT else 0,
+        ingest_port=INGEST_PORT if index == 0 else 0,
+    )
+    try:
+        await app_bot.run_webhook(settings, register_webhook=False)
+    finally:
+        await db_operations.close()
+
+
+def worker_entry(token: str, settings: WebhookSettings, index: int = 0):
+    """Точка входа процесса-воркера"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    asyncio.run(_run_worker(token, settings, index))
+
+
+async def register_webhook(token: str, settings: WebhookSettings):
+    """Регистрирует webhook один раз для всех воркеров"""
+    from bot.bot import create_bot
+
+    bot = create_bot(token, settings.api_url or None)
+    try:
+        await bot.set_webhook(settings.webhook_url, secret_token=settings.secret or None)
+        logger.info(f"Webhook зарегистрирован: {settings.webhook_url}")
+    finally:
+        await bot.session.close()
+
+
+def run_workers(token: str, settings: WebhookSettings):
+    """Запускает settings.workers процессов на одном порту и ждет их завершения
+
+    SIGTERM/SIGINT пересылаются воркерам, каждый из них дожидается
+    своих обработчиков перед выходом.
+    """
+    # spawn: воркеры не наследуют цикл событий и соединения родителя
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=worker_entry, args=(token, settings, idx), name=f'webhook-worker-{idx}')
+        for idx in range(settings.workers)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"Запущено воркеров: {len(processes)}")
+
+    def forward(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    previous = {sig: signal.signal(sig, forward) for sig in (signal.SIGINT, signal.SIGTERM)}
+    try:
+        deadline: Optional[float] = None
+        for process in processes:
+            while process.is_alive():
+                process.join(timeout=1)
+                if deadline is None and not all(p.is_alive() for p in processes):
+                    # Один воркер упал или остановлен — останавливаем остальных
+                    deadline = time.monotonic() + settings.drain_timeout + 5
+                    forward(None, None)
+                if deadline is not None and time.monotonic() > deadline:
+                    process.kill()
+    finally:
+        for sig, handler in previous.items():
+            signal.signal(sig, handler)
@@ -0,0 +1,212 @@
+from sqlalchemy.ext.asyncio import AsyncConnection
+from typing import Optional
+import logging
+
+from database.transform import VIDEO_COLUMNS, SNAPSHOT_COLUMNS
+from database.generation import bump_generation, notify_generation
+from database.rollups import AFFECTED_FROM_DAYS, refresh_rollups
+from database.partitions import snapshot_partitions
+from database.timing import import_phases
+
+
+logger = logging.getLogger(__name__)
+
+# Временные таблицы для COPY: живут в рамках соединения, очищаются при коммите
+CREATE_STAGING_SQL = (
+    """
+    CREATE TEMP TABLE IF NOT EXISTS stage_videos (
+        seq integer NOT NULL,
+        id varchar NOT NULL,
+        creator_id varchar NOT NULL,
+        video_created_at timestamp NOT NULL,
+        views_count bigint,
+        likes_count bigint,
+        comments_count bigint,
+        reports_count bigint,
+        created_at timestamp,
+        updated_at timestamp,
+        fingerprint varchar NOT NULL
+    ) ON COMMIT DELETE ROWS
+    """,
+    """
+    CREATE TEMP TABLE IF NOT EXISTS stage_snapshots (
+        id varchar NOT NULL,
+        video_id varchar NOT NULL,
+        views_count bigint,
+        likes_count bigint,
+        comments_count bigint,
+        reports_count bigint,
+        delta_views_count bigint,
+        delta_likes_count bigint,
+        delta_reports_count bigint,
+        created_at timestamp NOT NULL,
+        updated_at timestamp
+    ) ON COMMIT DELETE ROWS
+    """,
+)
+
+_VIDEO_COLUMNS_SQL = ', '.join(VIDEO_COLUMNS)
+_SNAPSHOT_COLUMNS_SQL = ', '.join(SNAPSHOT_COLUMNS)
+_SNAPSHOT_CREATED_AT = SNAPSHOT_COLUMNS.index('created_at')
+_SNAPSHOT_VIDEO_ID = SNAPSHOT_COLUMNS.index('video_id')
+
+# Пары (video_id, day) для отложенного пересчета агрегатов
+CREATE_ROLLUP_DAYS_SQL = """
+    CREATE TEMP TABLE stage_rollup_days (
+        video_id varchar NOT NULL,
+        day date NOT NULL
+    ) ON COMMIT DROP
+"""
+
+# Повторы одного видео внутри пачки схлопываем: побеждает последняя запись
+MERGE_VIDEOS_SQL = f"""
+    INSERT INTO videos ({_VIDEO_COLUMNS_SQL})
+    SELECT DISTINCT ON (id) {_VIDEO_COLUMNS_SQL}
+    FROM stage_videos
+    ORDER BY id, seq DESC
+    ON CONFLICT (id) DO UPDATE SET
+        views_count = EXCLUDED.views_count,
+        likes_count = EXCLUDED.likes_count,
+        comments_count = EXCLUDED.comments_count,
+        reports_count = EXCLUDED.reports_count,
+        updated_at = EXCLUDED.updated_at
+    RETURNING (xmax = 0) AS inserted
+"""
+
+# Снимки добавляются только новые: по естественному ключу (video_id, created_at),
+# а в инкрементальном режиме — только позже последнего загруженного замера
+MERGE_SNAPSHOTS_SQL = f"""
+    INSERT INTO video_snapshots ({_SNAPSHOT_COLUMNS_SQL})
+    SELECT {', '.join('s.' + column for column in SNAPSHOT_COLUMNS)}
+    FROM stage_snapshots s
+    LEFT JOIN video_import_state st ON st.video_id = s.video_id
+    WHERE NOT $1 OR st.last_snapshot_at IS NULL OR s.created_at > st.last_snapshot_at
+    ON CONFLICT (video_id, created_at) DO NOTHING
+"""
+
+MERGE_IMPORT_STATE_SQL = """
+    INSERT INTO video_import_state (video_id, fingerprint, last_snapshot_at, imported_at)
+    SELECT DISTINCT ON (v.id) v.id, v.fingerprint, snap.last_at, timezone('utc', now())
+    FROM stage_videos v
+    LEFT JOIN (
+        SELECT video_id, MAX(created_at) AS last_at
+        FROM stage_snapshots
+        GROUP BY video_id
+    ) snap ON snap.video_id = v.id
+    ORDER BY v.id, v.seq DESC
+    ON CONFLICT (video_id) DO UPDATE SET
+        fingerprint = EXCLUDED.fingerprint,
+        last_snapshot_at = GREATEST(video_import_state.last_snapshot_at, EXCLUDED.last_snapshot_at),
+        imported_at = EXCLUDED.imported_at
+"""
+
+SELECT_FINGERPRINTS_SQL = """
+    SELECT video_id, fingerprint
+    FROM video_import_state
+    WHERE video_id = ANY($1::varchar[])
+"""
+
+
+async def get_driver_connection(conn: AsyncConnection):
+    """Возвращает соединение asyncpg, скрытое за соединением SQLAlchemy"""
+    raw = await conn.get_raw_connection()
+    return raw.driver_connection
+
+
+async def copy_batch(conn: AsyncConnection, records: list, incremental: bool = True,
+                     affected: Optional[set] = None):
+    """Загружает пачку записей через COPY во временные таблицы и сливает их в основные
+
+    records — список VideoRecord. В инкрементальном режиме записи, отпечаток
+    которых совпадает с сохраненным, пропускаются целиком.
+    Если передан affected, дневные агрегаты не пересчитываются: затронутые пары
+    (video_id, day) добавляются в него для refresh_affected. Пересчет берет
+    общую блокировку агрегатов до коммита, и параллельные писатели иначе
+    выполнялись бы по очереди.
+    Выполняется в одной транзакции. Возвращает кортеж (inserted, updated, skipped, snapshots).
+    """
+    driver = await get_driver_connection(conn)
+
+    # Недостающие секции video_snapshots создаются до транзакции пачки
+    with import_phases.measure('partitions'):
+        await snapshot_partitions.ensure(
+            driver, (row[_SNAPSHOT_CREATED_AT] for record in records for row in record.snapshot_rows)
+        )
+
+    async with driver.transaction():
+        skipped = 0
+        if incremental:
+            with import_phases.measure('fingerprints'):
+                stored = await driver.fetch(SELECT_FINGERPRINTS_SQL, [record.video_row[0] for record in records])
+            fingerprints = {row['video_id']: row['fingerprint'] for row in stored}
+            changed = [
+                record for record in records
+                if fingerprints.get(record.video_row[0]) != record.fingerprint
+            ]
+            skipped = len(records) - len(changed)
+            records = changed
+
+        if not records:
+            return 0, 0, skipped, 0
+
+        with import_phases.measure('copy'):
+            for statement in CREATE_STAGING_SQL:
+                await driver.execute(statement)
+
+            await driver.copy_records_to_table(
+                'stage_videos',
+                records=[(seq, *record.video_row, record.fingerprint) for seq, record in enumerate(records)],
+                columns=('seq', *VIDEO_COLUMNS, 'fingerprint'),
+            )
+            snapshot_rows = [row for record in records for row in record.snapshot_rows]
+            if snapshot_rows:
+                await driver.copy_records_to_table(
+                    'stage_snapshots',
+                    records=snapshot_rows,
+                    columns=SNAPSHOT_COLUMNS,
+                )
+
+        with import_phases.measure('merge_videos'):
+            merged = await driver.fetch(MERGE_VIDEOS_SQL)
+        inserted = sum(1 for row in merged if row['inserted'])
+        # Повторы внутри пачки считаются обновлениями, как и раньше
+        updated = len(records) - inserted
+
+        with import_phases.measure('merge_snapshots'):
+            status = await driver.execute(MERGE_SNAPSHOTS_SQL, incremental)
+        snapshots = int(status.split()[-1])
+
+        # Дневные агрегаты по затронутым видео и дням
+        if snapshots and affected is None:
+            with import_phases.measure('rollups'):
+                await refresh_rollups(driver)
+
+        # Состояние обновляем после снимков: слияние снимков опирается на прежний last_snapshot_at
+        with import_phases.measure('import_state'):
+            await driver.execute(MERGE_IMPORT_STATE_SQL)
+
+        # Кэши результатов в других процессах сбросятся после коммита
+        if affected is None:
+            await notify_generation(driver)
+
+    if affected is None:
+        bump_generation()
+    elif snapshots:
+        affected.update(
+            (row[_SNAPSHOT_VIDEO_ID], row[_SNAPSHOT_CREATED_AT].date()) for row in snapshot_rows
+        )
+    return inserted, updated, skipped, snapshots
+
+
+async def refresh_affected(conn: AsyncConnection, affected: set):
+    """Пересчитывает дневные агрегаты по парам, накопленным copy_batch, одной транзакцией"""
+    if not affected:
+        return
+    driver = await get_driver_connection(conn)
+    async with driver.transaction():
+        await driver.execute(CREATE_ROLLUP_DAYS_SQL)
+        await driver.copy_records_to_table('stage_rollup_days', records=sorted(affected), columns=('video_id', 'day'))
+        with import_phases.measure('rollups'):
+            await refresh_rollups(driver, source=AFFECTED_FROM_DAYS)
+        await notify_generation(driver)
+    bump_generation()
@@ -0,0 +1,617 @@
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+from typing import NamedTuple, Optional
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import time
+
+from decouple import config
+from sqlalchemy import text
+
+from database.generation import SELECT_SHARED_GENERATION_SQL
+from database.result_cache import canonicalize_sql
+
+try:
+    import numpy as np
+except ImportError:  # локальный движок необязателен
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: каталог колонок не делится между процессами
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+# Отвечать на простые агрегаты по videos и video_snapshots из колонок в памяти (нужен numpy)
+COLUMNAR_ENABLED = config('COLUMNAR_ENABLED', default=False, cast=bool)
+# Каталог с колонками (.npy), которые открываются через mmap при перезапуске
+COLUMNAR_PATH = config('COLUMNAR_PATH', default='data/columnar')
+# Сколько строк читается из Postgres за раз при загрузке
+COLUMNAR_FETCH_SIZE = config('COLUMNAR_FETCH_SIZE', default=50000, cast=int)
+# Сколько секунд после загрузки колонки отвечают, даже если данные с тех пор изменились:
+# для потоковой загрузки снимков, которая меняет их на каждой пачке. 0 — только актуальные
+COLUMNAR_MAX_STALENESS = config('COLUMNAR_MAX_STALENESS', default=0, cast=float)
+
+# Признак того, что запрос не поддерживается и должен уйти в Postgres
+NOT_HANDLED = object()
+
+META_FILE = 'meta.json'
+FORMAT_VERSION = 2
+
+# Колонки таблиц: идентификаторы кодируются словарем, время — datetime64[us].
+# Для счетчиков с NULL хранится маска заполненных значений (column.valid.npy)
+TABLES = {
+    'videos': {
+        'sql': """
+            SELECT id, creator_id, video_created_at,
+                   views_count, likes_count, comments_count, reports_count
+            FROM videos
+        """,
+        'ids': ('id', 'creator_id'),
+        'time': 'video_created_at',
+        'numbers': ('views_count', 'likes_count', 'comments_count', 'reports_count'),
+    },
+    'video_snapshots': {
+        'sql': """
+            SELECT video_id, created_at, delta_views_count, delta_likes_count, delta_reports_count
+            FROM video_snapshots
+        """,
+        'ids': ('video_id',),
+        'time': 'created_at',
+        'numbers': ('delta_views_count', 'delta_likes_count', 'delta_reports_count'),
+    },
+}
+
+# Словари идентификаторов: колонка -> имя общего словаря
+DICTIONARIES = {'id': 'video', 'video_id': 'video', 'creator_id': 'creator'}
+
+# Разбор канонической формы SQL (canonicalize_sql): нижний регистр,
+# без пробелов вокруг скобок и операторов («count(*)from videos»)
+_SELECT_RE = re.compile(
+    r'^select (?P<agg>count\(\*\)|count\(distinct (?P<distinct>\w+)\)'
+    r'|(?P<coalesce>coalesce\()?(?P<func>sum|max|min|avg)\((?P<column>\w+)\)(?(coalesce),0\)))'
+    r' ?from (?P<table>\w+)(?: where (?P<where>.+))?$'
+)
+_VALUE = r":\w+|'(?:[^']|'')*'|-?\d+"
+_CONDITION_RE = re.compile(
+    rf'(?:date\((?P<date_column>\w+)\)|(?P<column>\w+))'
+    rf'(?:(?P<op>>=|<=|<>|!=|=|>|<)(?P<value>{_VALUE})| ?between (?P<low>{_VALUE}) and (?P<high>{_VALUE}))'
+)
+_AND = ' and '
+
+
+class Condition(NamedTuple):
+    column: str
+    op: str
+    values: tuple
+    # Сравнение по DATE(column), а не по самому времени
+    by_date: bool = False
+
+
+class Plan(NamedTuple):
+    """Агрегат по одной таблице с условиями, соединенными AND"""
+    table: str
+    aggregate: str
+    column: Optional[str]
+    coalesce: bool
+    conditions: tuple
+
+
+def _literal(token: str, params: dict):
+    if token.startswith(':'):
+        return params[token[1:]]
+    if token.startswith("'"):
+        return token[1:-1].replace("''", "'")
+    return int(token)
+
+
+def parse_plan(sql_query: str, params: Optional[dict] = None) -> Optional[Plan]:
+    """План для поддерживаемого запроса или None"""
+    params = params or {}
+    match = _SELECT_RE.match(canonicalize_sql(sql_query))
+    if not match or match['table'] not in TABLES:
+        return None
+
+    if match['distinct']:
+        aggregate, column = 'count_distinct', match['distinct']
+    elif match['func']:
+        aggregate, column = match['func'], match['column']
+    else:
+        aggregate, column = 'count', None
+
+    conditions = []
+    where = match['where'] or ''
+    position = 0
+    while position < len(where):
+        condition = _CONDITION_RE.match(where, position)
+        if condition is None:
+            return None
+        try:
+            if condition['op']:
+                op = '!=' if condition['op'] == '<>' else condition['op']
+                values = (_literal(condition['value'], params),)
+            else:
+                op = 'between'
+                values = (_literal(condition['low'], params), _literal(condition['high'], params))
+        except (KeyError, ValueError):
+            return None
+        conditions.append(Condition(
+            condition['date_column'] or condition['column'], op, values, bool(condition['date_column'])
+        ))
+        position = condition.end()
+        if where.startswith(_AND, position):
+            position += len(_AND)
+        elif position != len(where):
+            return None
+
+    return Plan(match['table'], aggregate, column, bool(match['coalesce']), tuple(conditions))
+
+
+def _to_datetime64(value, by_date: bool):
+    """Граница времени: date, datetime или строка ISO"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value) if not by_date and len(value) > 10 else date.fromisoformat(value[:10])
+    if isinstance(value, datetime):
+        if by_date:
+            value = value.date()
+        elif value.tzinfo is not None:
+            # Колонки без часового пояса: сравниваем по локальному времени значения
+            value = value.replace(tzinfo=None)
+    elif not isinstance(value, date):
+        raise ValueError(f"Не дата: {value!r}")
+    return np.datetime64(value, 'us')
+
+
+class Dictionary:
+    """Значения идентификаторов по коду; обратный индекс строится при первом поиске"""
+
+    def __init__(self, values):
+        self.values = values
+        self._codes = None
+
+    def code(self, value) -> int:
+        if self._codes is None:
+            self._codes = {str(item): idx for idx, item in enumerate(self.values.tolist())}
+        return self._codes.get(str(value), -1)
+
+    def __len__(self):
+        return len(self.values)
+
+
+class ColumnTable:
+    """Колонки одной таблицы, отсортированные по времени (time)
+
+    valid — маски заполненных значений счетчиков, в которых есть NULL:
+    такие строки не участвуют в агрегатах и сравнениях, как в Postgres.
+    """
+
+    def __init__(self, name: str, columns: dict, valid: Optional[dict] = None):
+        self.name = name
+        self.spec = TABLES[name]
+        self.columns = columns
+        self.valid = valid or {}
+        self.rows = len(columns[self.spec['time']])
+
+    def time_range(self, conditions: list):
+        """Границы [start, stop) строк по условиям на колонку времени (бинарный поиск)
+
+        NOT_HANDLED, если условие нельзя выразить диапазоном.
+        """
+        times = self.columns[self.spec['time']]
+        start, stop = 0, self.rows
+        for condition in conditions:
+            bounds = _time_bounds(condition)
+            if bounds is None:
+                return NOT_HANDLED
+            lower, lower_inclusive, upper, upper_inclusive = bounds
+            if lower is not None:
+                start = max(start, int(np.searchsorted(times, lower, side='left' if lower_inclusive else 'right')))
+            if upper is not None:
+                stop = min(stop, int(np.searchsorted(times, upper, side='right' if upper_inclusive else 'left')))
+        return start, max(start, stop)
+
+
+def _time_bounds(condition: Condition):
+    """(нижняя граница, включительно, верхняя граница, включительно) для условия на время
+
+    Для DATE(column) день d — это [d, d + 1 день).
+    """
+    values = [_to_datetime64(value, condition.by_date) for value in condition.values]
+    op = condition.op
+    if condition.by_date:
+        day = np.timedelta64(1, 'D')
+        if op == '=':
+            return values[0], True, values[0] + day, False
+        if op == 'between':
+            return values[0], True, values[1] + day, False
+        if op == '>':
+            return values[0] + day, True, None, False
+        if op == '>=':
+            return values[0], True, None, False
+        if op == '<':
+            return None, False, values[0], False
+        if op == '<=':
+            return None, False, values[0] + day, False
+        return None
+    if op == '=':
+        return values[0], True, values[0], True
+    if op == 'between':
+        return values[0], True, values[1], True
+    if op in ('>', '>='):
+        return values[0], op == '>=', None, False
+    if op in ('<', '<='):
+        return None, False, values[0], op == '<='
+    return None
+
+
+_COMPARE = {
+    '=': lambda column, value: column == value,
+    '!=': lambda column, value: column != value,
+    '>': lambda column, value: column > value,
+    '>=': lambda column, value: column >= value,
+    '<': lambda column, value: column < value,
+    '<=': lambda column, value: column <= value,
+}
+
+
+class ColumnarEngine:
+    """Агрегаты по videos и video_snapshots на колонках numpy
+
+    Данные загружаются из Postgres одним снимком (REPEATABLE READ) вместе
+    с общим поколением данных и сохраняются в COLUMNAR_PATH; при перезапуске
+    колонки открываются через mmap. Ответ дается, если поколение совпадает
+    с текущим или колонки загружены не раньше max_staleness секунд назад;
+    иначе запрос уходит в Postgres, а колонки перезагружаются в фоне.
+    """
+
+    def __init__(self, path: str = COLUMNAR_PATH, fetch_size: int = COLUMNAR_FETCH_SIZE,
+                 max_staleness: float = COLUMNAR_MAX_STALENESS):
+        self.path = path
+        self.fetch_size = fetch_size
+        self.max_staleness = max_staleness
+        self.tables = {}
+        self.dictionaries = {}
+        self.generation = None
+        self.loaded_at = None
+        self.counters = Counter()
+        self._refresh_task = None
+        self._plans = {}
+
+    @staticmethod
+    def available() -> bool:
+        return np is not None
+
+    def is_fresh(self, generation: int) -> bool:
+        return bool(self.tables) and self.generation == generation
+
+    def within_staleness(self) -> bool:
+        """Колонки устарели, но загружены недавно и еще могут отвечать"""
+        return bool(self.tables) and time.monotonic() - self.loaded_at < self.max_staleness
+
+    # Выполнение
+
+    def execute(self, sql_query: str, params: Optional[dict] = None):
+        """Результат запроса или NOT_HANDLED, если запрос не поддерживается"""
+        started = time.perf_counter()
+        plan = self._plan(sql_query, params)
+        if plan is None:
+            self.counters['unsupported'] += 1
+            return NOT_HANDLED
+        try:
+            value = self._run(plan)
+        except (KeyError, ValueError, TypeError) as e:
+            logger.debug(f"Колоночный движок не выполнил запрос ({e}): {sql_query}")
+            value = NOT_HANDLED
+        if value is NOT_HANDLED:
+            self.counters['unsupported'] += 1
+            return NOT_HANDLED
+        self.counters['answered'] += 1
+        logger.info(f"Ответ из колонок за {(time.perf_counter() - started) * 1000:.3f} мс: {sql_query}")
+        return value
+
+    def _plan(self, sql_query: str, params: Optional[dict]) -> Optional[Plan]:
+        # Форма запроса без параметров кэшируется: параметры подставляются при разборе,
+        # поэтому кэшируются только запросы без них
+        if params:
+            return parse_plan(sql_query, params)
+        if sql_query not in self._plans:
+            if len(self._plans) > 1024:
+                self._plans.clear()
+            self._plans[sql_query] = parse_plan(sql_query)
+        return self._plans[sql_query]
+
+    def _run(self, plan: Plan):
+        table = self.tables.get(plan.table)
+        if table is None:
+            return NOT_HANDLED
+        spec = table.spec
+        time_column = spec['time']
+
+        # Условия на время сужают диапазон строк, остальные дают маску
+        time_conditions = [condition for condition in plan.conditions if condition.column == time_column]
+        time_range = table.time_range(time_conditions)
+        if time_range is NOT_HANDLED:
+            return NOT_HANDLED
+        start, stop = time_range
+        mask = None
+        for condition in plan.conditions:
+            if condition.column == time_column:
+                continue
+            if condition.by_date:
+                return NOT_HANDLED
+            selected = self._condition_mask(table, condition, start, stop)
+            if selected is NOT_HANDLED:
+                return NOT_HANDLED
+            mask = selected if mask is None else mask & selected
+
+        if plan.aggregate == 'count':
+            return (stop - start) if mask is None else int(np.count_nonzero(mask))
+
+        if plan.aggregate == 'count_distinct':
+            if DICTIONARIES.get(plan.column) != 'video' or plan.column not in table.columns:
+                return NOT_HANDLED
+            codes = table.columns[plan.column][start:stop]
+            if mask is not None:
+                codes = codes[mask]
+            seen = np.zeros(len(self.dictionaries['video']), dtype=bool)
+            seen[codes] = True
+            return int(np.count_nonzero(seen))
+
+        if plan.column not in spec['numbers']:
+            return NOT_HANDLED
+        values = table.columns[plan.column][start:stop]
+        valid = table.valid.get(plan.column)
+        if valid is not None:
+            valid = valid[start:stop]
+            mask = valid if mask is None else mask & valid
+        if mask is not None:
+            values = values[mask]
+        if not len(values):
+            # Агрегат по пустому набору — NULL, как в Postgres
+            return 0 if plan.coalesce else None
+        if plan.aggregate == 'sum':
+            return int(values.sum())
+        if plan.aggregate == 'max':
+            return int(values.max())
+        if plan.aggregate == 'min':
+            return int(values.min())
+        return Decimal(int(values.sum())) / Decimal(len(values))
+
+    def _condition_mask(self, table: ColumnTable, condition: Condition, start: int, stop: int):
+        if condition.op == 'between' or condition.column not in table.columns:
+            return NOT_HANDLED
+        column = table.columns[condition.column][start:stop]
+        value = condition.values[0]
+        dictionary = DICTIONARIES.get(condition.column)
+        if dictionary is not None:
+            if condition.op not in ('=', '!='):
+                return NOT_HANDLED
+            value = self.dictionaries[dictionary].code(value)
+        elif not isinstance(value, int) or isinstance(value, bool):
+            return NOT_HANDLED
+        selected = _COMPARE[condition.op](column, value)
+        valid = table.valid.get(condition.column)
+        # Сравнение с NULL не выполняется ни для какого значения
+        return selected if valid is None else selected & valid[start:stop]
+
+    # Загрузка и сохранение
+
+    def refresh_in_background(self, engine, generation: int):
+        """Запускает перезагрузку колонок, если она еще не идет"""
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+        self._refresh_task = asyncio.ensure_future(self.refresh(engine, generation))
+
+    async def refresh(self, engine, generation: int):
+        """Открывает сохраненные колонки нужного поколения или загружает их из Postgres"""
+        try:
+            if self.open(generation):
+                return
+            await self.load(engine)
+            await asyncio.to_thread(self.save)
+        except Exception as e:
+            self.counters['refresh_failed'] += 1
+            logger.error(f"Не удалось загрузить колонки: {e}")
+
+    @contextmanager
+    def _path_lock(self, exclusive: bool):
+        """Блокировка COLUMNAR_PATH между процессами (воркерами вебхука)
+
+        Замена каталога берет ее монопольно, открытие — совместно: открывающий
+        процесс видит файлы одного сохранения целиком.
+        """
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(f'{self.path}.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _saved_meta(self) -> Optional[dict]:
+        try:
+            with open(os.path.join(self.path, META_FILE), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def open(self, generation: Optional[int] = None) -> bool:
+        """Открывает сохраненные колонки через mmap; False, если их нет или поколение другое"""
+        with self._path_lock(exclusive=False):
+            return self._open(generation)
+
+    def _open(self, generation: Optional[int]) -> bool:
+        meta = self._saved_meta()
+        if meta is None:
+            return False
+        if meta.get('version') != FORMAT_VERSION or (generation is not None and meta.get('generation') != generation):
+            return False
+
+        started = time.perf_counter()
+        try:
+            dictionaries = {
+                name: Dictionary(np.load(os.path.join(self.path, f'dict_{name}.npy'), mmap_mode='r'))
+                for name in ('video', 'creator')
+            }
+            tables = {}
+            for name, spec in TABLES.items():
+                columns = {
+                    column: np.load(os.path.join(self.path, f'{name}.{column}.npy'), mmap_mode='r')
+                    for column in (*spec['ids'], spec['time'], *spec['numbers'])
+                }
+                valid = {
+                    column: np.load(os.path.join(self.path, f'{name}.{column}.valid.npy'), mmap_mode='r')
+                    for column in meta.get('nullable', {}).get(name, ())
+                }
+                tables[name] = ColumnTable(name, columns, valid)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Сохраненные колонки повреждены ({e}), загрузка из базы")
+            return False
+
+        self._swap(tables, dictionaries, meta['generation'])
+        logger.info(
+            f"Колонки открыты из {self.path} за {(time.perf_counter() - started) * 1000:.1f} мс: "
+            f"{self._sizes()}, поколение {self.generation}"
+        )
+        return True
+
+    async def load(self, engine):
+        """Загружает таблицы из Postgres одним согласованным снимком"""
+        started = time.perf_counter()
+        codes = {'video': {}, 'creator': {}}
+        tables = {}
+        async with engine.connect() as conn:
+            # Поколение и данные — из одного снимка
+            await conn.execute(text('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY'))
+            generation = int(await conn.scalar(text(SELECT_SHARED_GENERATION_SQL)) or 0)
+            for name, spec in TABLES.items():
+                tables[name] = await self._load_table(conn, name, spec, codes)
+            await conn.rollback()
+
+        dictionaries = {
+            name: Dictionary(np.array(list(values), dtype=str)) for name, values in codes.items()
+        }
+        self._swap(tables, dictionaries, generation)
+        logger.info(
+            f"Колонки загружены из базы за {time.perf_counter() - started:.2f} с: "
+            f"{self._sizes()}, поколение {generation}"
+        )
+
+    async def _load_table(self, conn, name: str, spec: dict, codes: dict) -> ColumnTable:
+        names = (*spec['ids'], spec['time'], *spec['numbers'])
+        chunks = {column: [] for column in names}
+        valid_chunks = {column: [] for column in spec['numbers']}
+        result = await conn.stream(text(spec['sql']))
+        async for rows in result.partitions(self.fetch_size):
+            values = list(zip(*rows))
+            for idx, column in enumerate(names):
+                if column in spec['ids']:
+                    mapping = codes[DICTIONARIES[column]]
+                    encoded = [mapping.setdefault(item, len(mapping)) for item in values[idx]]
+                    chunks[column].append(np.array(encoded, dtype=np.int32))
+                elif column == spec['time']:
+                    chunks[column].append(np.array(values[idx], dtype='datetime64[us]'))
+                else:
+                    # NULL хранится нулем и отмечается в маске заполненных значений
+                    chunks[column].append(np.array([item or 0 for item in values[idx]], dtype=np.int64))
+                    valid_chunks[column].append(np.array([item is not None for item in values[idx]], dtype=bool))
+
+        empty = {column: np.array([], dtype=np.int32 if column in spec['ids'] else np.int64) for column in names}
+        empty[spec['time']] = np.array([], dtype='datetime64[us]')
+        columns = {
+            column: np.concatenate(parts) if parts else empty[column]
+            for column, parts in chunks.items()
+        }
+        # Сортировка по времени: условия на дату — бинарный поиск по диапазону
+        order = np.argsort(columns[spec['time']], kind='stable')
+        # Маски нужны только колонкам, в которых есть NULL
+        valid = {}
+        for column, parts in valid_chunks.items():
+            mask = np.concatenate(parts) if parts else np.array([], dtype=bool)
+            if not mask.all():
+                valid[column] = mask[order]
+        return ColumnTable(name, {column: values[order] for column, values in columns.items()}, valid)
+
+    def save(self):
+        """Сохраняет колонки во временный каталог и заменяет им COLUMNAR_PATH
+
+        Временный каталог у каждого процесса свой, замена идет под блокировкой;
+        сохранение не заменяет колонки более нового поколения из другого процесса.
+        """
+        if not self.tables:
+            return
+        temp_path = f'{self.path}.tmp.{os.getpid()}'
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+        for name, dictionary in self.dictionaries.items():
+            np.save(os.path.join(temp_path, f'dict_{name}.npy'), np.asarray(dictionary.values))
+        for name, table in self.tables.items():
+            for column, values in table.columns.items():
+                np.save(os.path.join(temp_path, f'{name}.{column}.npy'), np.asarray(values))
+            for column, mask in table.valid.items():
+                np.save(os.path.join(temp_path, f'{name}.{column}.valid.npy'), np.asarray(mask))
+        nullable = {name: sorted(table.valid) for name, table in self.tables.items() if table.valid}
+        with open(os.path.join(temp_path, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': FORMAT_VERSION, 'generation': self.generation, 'nullable': nullable, **self._sizes(),
+            }, f)
+
+        old_path = f'{self.path}.old.{os.getpid()}'
+        with self._path_lock(exclusive=True):
+            saved = self._saved_meta()
+            if saved is not None and saved.get('version') == FORMAT_VERSION \
+                    and saved.get('generation', -1) > self.generation:
+                shutil.rmtree(temp_path, ignore_errors=True)
+                logger.info(f"В {self.path} уже сохранены колонки поколения {saved['generation']}")
+                return
+            if os.path.exists(self.path):
+                os.replace(self.path, old_path)
+            os.replace(temp_path, self.path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        logger.info(f"Колонки сохранены в {self.path}")
+
+    async def close(self):
+        """Останавливает фоновую загрузку"""
+        if self._refresh_task is not None and not self._refresh_task.done():
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+
+    def _swap(self, tables: dict, dictionaries: dict, generation: int):
+        # Замена целиком: выполняемые запросы видят либо старый, либо новый набор
+        self.tables, self.dictionaries, self.generation = tables, dictionaries, generation
+        self.loaded_at = time.monotonic()
+        self.counters['loads'] += 1
+
+    def _sizes(self) -> dict:
+        return {name: table.rows for name, table in self.tables.items()}
+
+    def stats(self) -> dict:
+        return {
+            'generation': self.generation,
+            'rows': self._sizes(),
+            **dict(self.counters),
+        }
+
+
+def create_columnar_engine(enabled: bool = COLUMNAR_ENABLED) -> Optional[ColumnarEngine]:
+    """Колоночный движок, если он включен и numpy установлен"""
+    if not enabled:
+        return None
+    if not ColumnarEngine.available():
+        logger.warning("COLUMNAR_ENABLED=True, но numpy не установлен: колоночный движок выключен")
+        return None
+    return ColumnarEngine()
@@ -1,43 +1,254 @@
-from sqlalchemy import text
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+from decouple import config
 import logging
+import time
 from typing import Any, Optional
 
+from database.bulk_load import get_driver_connection
+from database.engine import PoolMonitor, create_engine, get_engine
+from database.generation import GenerationListener, current_generation, shared_generation
+from database.result_cache import ResultCache, MISS
+from database.rollups import rewrite_for_rollups
+from database.partitions import rewrite_for_pruning
+from database.plan_advisor import PlanAdvisor, explain
+from database.query_policy import QueryPolicy, QueryRejected
+from database.columnar import ColumnarEngine, NOT_HANDLED, create_columnar_engine
+from database.sql_canonical import QueryStats, bind_untyped, canonicalize
+from monitoring.metrics import (
+    columnar_queries_total, db_execute_seconds, db_rows_fetched, errors_total, slow_queries_total,
+)
+
 
 logger = logging.getLogger(__name__)
+# Отдельный логгер, чтобы медленные запросы можно было направить в свой файл
+slow_query_logger = logging.getLogger('slow_queries')
+
+# Размер кэша результатов запросов (0 — кэш выключен)
+RESULT_CACHE_SIZE = config('RESULT_CACHE_SIZE', default=1024, cast=int)
+# Время жизни результата в общем хранилище (STATE_BACKEND=postgres)
+RESULT_CACHE_TTL = config('RESULT_CACHE_TTL', default=3600, cast=float)
+
+# Запросы дольше этого времени (в секундах) пишутся в лог slow_queries (0 — выключено)
+SLOW_QUERY_SECONDS = config('SLOW_QUERY_SECONDS', default=0, cast=float)
+
+# Переписывать подходящие запросы на дневные агрегаты
+ROLLUPS_ENABLED = config('ROLLUPS_ENABLED', default=True, cast=bool)
+
+# Сбор планов EXPLAIN для рекомендаций индексов (python -m database.plan_advisor)
+PLAN_ADVISOR_ENABLED = config('PLAN_ADVISOR_ENABLED', default=False, cast=bool)
+PLAN_ADVISOR_PATH = config('PLAN_ADVISOR_PATH', default='data/plan_advisor.json')
+# Как часто сохранять статистику планов (в запросах)
+PLAN_ADVISOR_SAVE_EVERY = 20
 
 class DatabaseOperations:
-    def __init__(self, db_url: str):
-        self.engine = create_async_engine(db_url)
+    def __init__(self, db_url: Optional[str] = None, result_cache_size: int = RESULT_CACHE_SIZE,
+                 use_rollups: bool = ROLLUPS_ENABLED, engine: Optional[AsyncEngine] = None,
+                 store=None, policy: Optional[QueryPolicy] = None,
+                 columnar: Optional[ColumnarEngine] = None):
+        # По умолчанию используется общий движок приложения
+        if engine is None:
+            engine = create_engine(db_url) if db_url else get_engine()
+        self.engine = engine
+        self.pool_monitor = PoolMonitor(self.engine)
+        self.use_rollups = use_rollups
         self.Session = async_sessionmaker(bind=self.engine)
-    
-            
-    async def execute_query(self, sql_query: str) -> Optional[Any]:
-        """Выполнение SQL запроса и возврат результата"""
+        # Общее хранилище подключается к кэшу, только если его видят другие процессы
+        shared_store = store if store is not None and store.shared else None
+        self.result_cache = (
+            ResultCache(result_cache_size, store=shared_store, ttl=RESULT_CACHE_TTL)
+            if result_cache_size > 0 else None
+        )
+        # Уведомления об импорте из других процессов
+        self.generation_listener = GenerationListener(self.engine)
+        self.plan_advisor = PlanAdvisor(path=PLAN_ADVISOR_PATH) if PLAN_ADVISOR_ENABLED else None
+        # Только чтение, statement_timeout, порог стоимости и ограничение числа строк
+        self.policy = policy or QueryPolicy()
+        # Простые агрегаты из колонок в памяти (COLUMNAR_ENABLED), остальное — в Postgres
+        self.columnar = columnar if columnar is not None else create_columnar_engine()
+        # Задержки выполнения по формам запросов (отпечаткам канонического SQL)
+        self.query_stats = QueryStats()
+        self._plans_recorded = 0
+
+    async def _cache_enabled(self) -> bool:
+        """Кэш используется, только пока есть подписка на изменения данных"""
+        if self.result_cache is None:
+            return False
+        return await self.generation_listener.start()
+
+    async def _execute_columnar(self, sql_query: str, params: Optional[dict]):
+        """Ответ колоночного движка или NOT_HANDLED
+
+        Колонки используются, только пока есть подписка на изменения данных
+        и их поколение совпадает с общим; иначе они перезагружаются в фоне.
+        С COLUMNAR_MAX_STALENESS (для потоковой загрузки, которая меняет поколение
+        на каждой пачке) устаревшие колонки отвечают, пока идет перезагрузка,
+        но не дольше этого времени после своей загрузки.
+        """
+        if self.columnar is None or not await self.generation_listener.start():
+            return NOT_HANDLED
+        generation = shared_generation()
+        fresh = self.columnar.is_fresh(generation)
+        if not fresh:
+            self.columnar.refresh_in_background(self.engine, generation)
+            if not self.columnar.within_staleness():
+                columnar_queries_total.inc(result='stale')
+                return NOT_HANDLED
+        value = self.columnar.execute(sql_query, params)
+        if value is NOT_HANDLED:
+            columnar_queries_total.inc(result='unsupported')
+        else:
+            columnar_queries_total.inc(result='answered' if fresh else 'answered_stale')
+        return value
+
+    async def warm_up_columnar(self):
+        """Начинает загрузку колонок при запуске, не дожидаясь первого вопроса"""
+        if self.columnar is not None and await self.generation_listener.start():
+            self.columnar.refresh_in_background(self.engine, shared_generation())
+
+    async def _inspect_plan(self, conn, sql_query: str, params: Optional[dict]):
+        """Проверяет стоимость плана и записывает его для рекомендаций индексов
+
+        Один EXPLAIN на запрос; ошибка EXPLAIN означает, что запрос не выполнится.
+        """
+        if not self.policy.needs_plan and self.plan_advisor is None:
+            return
+        plan = await explain(conn, sql_query, params)
+        self.policy.check_plan(sql_query, plan)
+        if self.plan_advisor is None:
+            return
+        self.plan_advisor.record(sql_query, plan)
+        logger.info(f"План запроса: {plan.get('Node Type')}, стоимость {plan.get('Total Cost')}")
+        self._plans_recorded += 1
+        if self._plans_recorded % PLAN_ADVISOR_SAVE_EVERY == 0:
+            self.plan_advisor.save()
+
+    async def execute_query(self, sql_query: str, params: Optional[dict] = None) -> Optional[Any]:
+        """Выполнение SQL запроса и возврат результата
+
+        Нарушение политики выполнения (QueryPolicy) или обращение к таблицам и
+        колонкам вне списка разрешенных (database/sql_canonical.py) выбрасывает QueryRejected
+        с сообщением для пользователя; прочие ошибки возвращают None.
+        """
+        # Убираем возможные символы конца запроса
+        sql_query = sql_query.strip().rstrip(';')
+
+        # Исходный запрос, до переписывания на агрегаты: его форму понимает колоночный движок
+        value = await self._execute_columnar(sql_query, params)
+        if value is not NOT_HANDLED:
+            return value
+
+        # Дневные агрегаты вместо сканирования снимков
+        if self.use_rollups:
+            rewritten = rewrite_for_rollups(sql_query)
+            if rewritten:
+                logger.info(f"Запрос переписан на дневные агрегаты: {rewritten}")
+                sql_query = rewritten
+
+        # Условия на день по created_at — диапазоном, чтобы отсекались секции снимков
+        pruned = rewrite_for_pruning(sql_query, params)
+        if pruned:
+            sql_query, params = pruned
+            logger.info(f"Условия по дате переписаны на диапазон: {sql_query}")
+
+        # Проверка таблиц и колонок по моделям и вынос литералов в параметры:
+        # запросы одной формы получают один текст, подготовленный запрос и ключ кэша
+        try:
+            canonical = canonicalize(sql_query, params)
+        except QueryRejected as e:
+            self.policy.violations[e.reason] += 1
+            raise
+        sql_query, params = canonical.sql, canonical.params
+
+        use_cache = await self._cache_enabled()
+        if use_cache:
+            cache_key = ResultCache.make_key(sql_query, params)
+            generation = current_generation()
+            shared = shared_generation()
+            cached = await self.result_cache.lookup(cache_key, shared)
+            if cached is not MISS:
+                logger.info(f"Результат взят из кэша: {sql_query}")
+                return cached
+
+        started = time.perf_counter()
         try:
-            async with self.engine.connect() as conn:
-                # Убираем возможные символы конца запроса
-                sql_query = sql_query.strip().rstrip(';')
-                
+            async with self.pool_monitor.connect() as conn:
+                connected = time.perf_counter()
+                # Строки без типа приводятся к типам, выведенным Postgres;
+                # до начала транзакции, которую прервала бы ошибка PREPARE
+                sql_query, params = await bind_untyped(await get_driver_connection(conn), canonical)
+                # Транзакция только для чтения, откатывается при выходе
+                await self.policy.begin(conn)
+                await self._inspect_plan(conn, sql_query, params)
+
                 logger.info(f"Выполняем запрос: {sql_query}")
-                result = await conn.execute(text(sql_query))
-                
-                # Получаем результаты
-                rows = result.fetchall()
-                
+                # Получаем результаты (не больше QUERY_MAX_ROWS строк)
+                rows = await self.policy.fetch(conn, sql_query, params)
+                executed = time.perf_counter() - connected
+                db_execute_seconds.observe(executed)
+                db_rows_fetched.observe(len(rows))
+                self.query_stats.record(canonical, executed)
+                self._log_if_slow(canonical, params, connected - started, executed, len(rows))
+
                 if rows:
                     # Если одна строка и один столбец
                     if len(rows) == 1 and len(rows[0]) == 1:
-                        
-                        return rows[0][0]
-                    return rows
+                        value = rows[0][0]
+                    else:
+                        value = rows
                 else:
                     # Для агрегатных функций возвращаем 0 если нет данных
                     if any(keyword in sql_query.upper() for keyword in ['COUNT', 'SUM', 'AVG', 'MAX', 'MIN']):
-                        return 0
-                    return None
-                    
+                        value = 0
+                    else:
+                        value = None
+
+        except QueryRejected:
+            raise
+
         except Exception as e:
+            rejected = self.policy.classify(e, sql_query)
+            if rejected is not None:
+                raise rejected from e
+            errors_total.inc(kind='execute_failed')
             logger.error(f"Ошибка выполнения SQL запроса: {e}")
             logger.error(f"Запрос: {sql_query}")
-            return None
\ No newline at end of file
+            return None
+
+        if use_cache:
+            await self.result_cache.remember(cache_key, value, generation, shared)
+        return value
+
+    def _log_if_slow(self, canonical, params: Optional[dict], checkout: float, executed: float, rows: int):
+        if not SLOW_QUERY_SECONDS or checkout + executed < SLOW_QUERY_SECONDS:
+            return
+        slow_queries_total.inc()
+        slow_query_logger.warning(
+            f"Медленный запрос {canonical.fingerprint}: {checkout + executed:.3f} с (ожидание соединения "
+            f"{checkout:.3f} с, выполнение {executed:.3f} с), строк: {rows}, параметры: {params or {}}, "
+            f"SQL: {canonical.sql}"
+        )
+
+    def pool_stats(self) -> dict:
+        """Загрузка пула и время ожидания соединения"""
+        return self.pool_monitor.stats()
+
+    def policy_stats(self) -> dict:
+        """Выполненные и отклоненные политикой запросы"""
+        return self.policy.stats()
+
+    def fingerprint_stats(self, limit: int = 10) -> list:
+        """Формы запросов с наибольшим суммарным временем выполнения"""
+        return self.query_stats.top(limit)
+
+    def columnar_stats(self) -> Optional[dict]:
+        """Ответы колоночного движка (None, если он выключен)"""
+        return self.columnar.stats() if self.columnar is not None else None
+
+    async def close(self):
+        """Закрывает подписку и соединения"""
+        if self.plan_advisor is not None:
+            self.plan_advisor.save()
+        if self.columnar is not None:
+            await self.columnar.close()
+        await self.generation_listener.stop()
+        await self.engine.dispose()
@@ -0,0 +1,131 @@
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional
+import asyncio
+import logging
+import time
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from decouple import config
+
+from monitoring.metrics import db_checkout_seconds
+
+
+logger = logging.getLogger(__name__)
+
+# Настройки пула соединений
+DB_POOL_SIZE = config('DB_POOL_SIZE', default=10, cast=int)
+DB_MAX_OVERFLOW = config('DB_MAX_OVERFLOW', default=10, cast=int)
+DB_POOL_TIMEOUT = config('DB_POOL_TIMEOUT', default=30, cast=float)
+DB_POOL_RECYCLE = config('DB_POOL_RECYCLE', default=1800, cast=int)
+DB_POOL_PRE_PING = config('DB_POOL_PRE_PING', default=True, cast=bool)
+# Размер кэша подготовленных выражений на соединение (asyncpg и SQLAlchemy)
+DB_STATEMENT_CACHE_SIZE = config('DB_STATEMENT_CACHE_SIZE', default=500, cast=int)
+# Сколько соединений открыть заранее при запуске (по умолчанию — весь пул)
+DB_WARMUP_CONNECTIONS = config('DB_WARMUP_CONNECTIONS', default=DB_POOL_SIZE, cast=int)
+
+# Общий движок приложения
+_engine: Optional[AsyncEngine] = None
+
+
+def database_url() -> str:
+    """URL базы данных из переменных окружения"""
+    LOGIN = config('LOGIN')
+    PASSWORD = config('PASSWORD')
+    HOST = config('HOST')
+    DB = config('DB')
+    return f'postgresql+asyncpg://{LOGIN}:{PASSWORD}@{HOST}:5432/{DB}'
+
+
+def create_engine(url: Optional[str] = None) -> AsyncEngine:
+    """Создает движок с настроенным пулом и кэшем подготовленных выражений"""
+    return create_async_engine(
+        url or database_url(),
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args={
+            'statement_cache_size': DB_STATEMENT_CACHE_SIZE,
+            'prepared_statement_cache_size': DB_STATEMENT_CACHE_SIZE,
+        },
+    )
+
+
+def get_engine() -> AsyncEngine:
+    """Общий для приложения движок (создается при первом обращении)"""
+    global _engine
+    if _engine is None:
+        _engine = create_engine()
+    return _engine
+
+
+async def warm_up(engine: AsyncEngine, connections: int = DB_WARMUP_CONNECTIONS):
+    """Открывает соединения пула заранее, чтобы первые запросы не ждали подключения"""
+    connections = min(connections, DB_POOL_SIZE)
+    if connections <= 0:
+        return
+
+    async def touch():
+        async with engine.connect() as conn:
+            await conn.execute(text('SELECT 1'))
+
+    started = time.perf_counter()
+    # Все соединения берутся одновременно, иначе пул отдал бы одно и то же
+    results = await asyncio.gather(*(touch() for _ in range(connections)), return_exceptions=True)
+    failed = [result for result in results if isinstance(result, Exception)]
+    if failed:
+        logger.warning(f"Прогрев пула: не удалось открыть {len(failed)} соединений: {failed[0]}")
+    logger.info(
+        f"Пул соединений прогрет: {connections - len(failed)} соединений "
+        f"за {time.perf_counter() - started:.2f} с"
+    )
+
+
+class PoolMonitor:
+    """Время ожидания соединения из пула и загрузка пула"""
+
+    def __init__(self, engine: AsyncEngine, window: int = 1000):
+        self.engine = engine
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        # Последние значения ожидания — для перцентилей
+        self._recent = deque(maxlen=window)
+
+    @asynccontextmanager
+    async def connect(self):
+        """engine.connect() с замером времени ожидания соединения"""
+        started = time.perf_counter()
+        async with self.engine.connect() as conn:
+            wait = time.perf_counter() - started
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self._recent.append(wait)
+            db_checkout_seconds.observe(wait)
+            yield conn
+
+    def _percentile(self, share: float) -> float:
+        if not self._recent:
+            return 0.0
+        values = sorted(self._recent)
+        return values[min(len(values) - 1, int(share * len(values)))]
+
+    def stats(self) -> dict:
+        """Состояние пула и статистика ожидания (в секундах)"""
+        pool = self.engine.pool
+        capacity = DB_POOL_SIZE + DB_MAX_OVERFLOW
+        checked_out = pool.checkedout() if hasattr(pool, 'checkedout') else 0
+        return {
+            'pool_size': pool.size() if hasattr(pool, 'size') else DB_POOL_SIZE,
+            'checked_out': checked_out,
+            'overflow': pool.overflow() if hasattr(pool, 'overflow') else 0,
+            'utilization': checked_out / capacity if capacity else 0.0,
+            'checkouts': self.checkouts,
+            'wait_avg': self.total_wait / self.checkouts if self.checkouts else 0.0,
+            'wait_p95': self._percentile(0.95),
+            'wait_max': self.max_wait,
+        }
@@ -0,0 +1,147 @@
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Канал Postgres, в который импорт сообщает об изменении данных.
+# Уведомление отправляется внутри транзакции и доставляется после коммита,
+# поэтому другие процессы узнают о новых данных сразу, как они стали видны.
+GENERATION_CHANNEL = 'data_generation'
+
+# Общий для всех процессов номер поколения хранится в kv_store и
+# увеличивается в той же транзакции, что и данные; он же передается в уведомлении
+NOTIFY_SQL = f"""
+    WITH bumped AS (
+        INSERT INTO kv_store (namespace, key, value)
+        VALUES ('meta', 'generation', '1')
+        ON CONFLICT (namespace, key) DO UPDATE
+        SET value = to_jsonb((kv_store.value #>> '{{}}')::bigint + 1)
+        RETURNING value #>> '{{}}' AS generation
+    )
+    SELECT pg_notify('{GENERATION_CHANNEL}', generation) FROM bumped
+"""
+
+SELECT_SHARED_GENERATION_SQL = """
+    SELECT value #>> '{}' FROM kv_store WHERE namespace = 'meta' AND key = 'generation'
+"""
+
+# Пауза между попытками подписаться, если соединение не удалось открыть (в секундах)
+LISTEN_RETRY_SECONDS = 30.0
+
+# Номер поколения данных в этом процессе
+_generation = 0
+
+# Последнее известное общее поколение (из kv_store и уведомлений)
+_shared_generation = 0
+
+
+def current_generation() -> int:
+    """Текущее поколение данных"""
+    return _generation
+
+
+def shared_generation() -> int:
+    """Общее для всех процессов поколение данных — часть ключей общего кэша"""
+    return _shared_generation
+
+
+def bump_generation() -> int:
+    """Отмечает, что данные изменились: все закэшированные результаты устаревают"""
+    global _generation
+    _generation += 1
+    logger.debug(f"Поколение данных: {_generation}")
+    return _generation
+
+
+def _set_shared_generation(value) -> bool:
+    global _shared_generation
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return False
+    _shared_generation = max(_shared_generation, value)
+    return True
+
+
+async def notify_generation(driver):
+    """Сообщает другим процессам об изменении данных (внутри текущей транзакции asyncpg)"""
+    generation = await driver.fetchval(NOTIFY_SQL)
+    _set_shared_generation(generation)
+
+
+class GenerationListener:
+    """Подписка на уведомления об изменении данных от других процессов
+
+    Держит отдельное соединение с LISTEN. При потере соединения подписка
+    считается неактивной, и поколение сдвигается, чтобы не отдать устаревшие данные.
+    После неудачной попытки подписаться следующая делается не раньше чем
+    через retry_seconds; до тех пор start() сразу возвращает False.
+    """
+
+    def __init__(self, engine, retry_seconds: float = LISTEN_RETRY_SECONDS):
+        self.engine = engine
+        self.retry_seconds = retry_seconds
+        self._conn = None
+        self._driver = None
+        self._next_attempt = 0.0
+
+    @property
+    def active(self) -> bool:
+        return self._driver is not None and not self._driver.is_closed()
+
+    def _on_notify(self, connection, pid, channel, payload):
+        _set_shared_generation(payload)
+        bump_generation()
+
+    def _on_terminate(self, connection):
+        logger.warning("Соединение подписки на изменения данных потеряно")
+        self._driver = None
+        bump_generation()
+
+    async def start(self) -> bool:
+        """Открывает соединение и подписывается на канал; возвращает успех"""
+        if self.active:
+            return True
+        if time.monotonic() < self._next_attempt:
+            return False
+        # Соединение, оборвавшееся с прошлой подписки, освобождает место в пуле
+        await self.stop()
+        try:
+            self._conn = await self.engine.connect()
+            raw = await self._conn.get_raw_connection()
+            self._driver = raw.driver_connection
+            await self._driver.add_listener(GENERATION_CHANNEL, self._on_notify)
+            self._driver.add_termination_listener(self._on_terminate)
+            # Общее поколение читаем после подписки, чтобы не пропустить уведомление
+            _set_shared_generation(await self._driver.fetchval(SELECT_SHARED_GENERATION_SQL) or 0)
+        except Exception as e:
+            self._next_attempt = time.monotonic() + self.retry_seconds
+            logger.error(
+                f"Не удалось подписаться на изменения данных: {e}; "
+                f"следующая попытка через {self.retry_seconds:.0f} с"
+            )
+            await self.stop()
+            return False
+        # Все, что было до подписки, считаем устаревшим
+        bump_generation()
+        logger.info("Подписка на изменения данных активна")
+        return True
+
+    async def stop(self):
+        conn, self._conn = self._conn, None
+        driver, self._driver = self._driver, None
+        if driver is not None and not driver.is_closed():
+            try:
+                await driver.remove_listener(GENERATION_CHANNEL, self._on_notify)
+            except Exception:
+                pass
+        if conn is None:
+            return
+        try:
+            if driver is None or driver.is_closed():
+                # Оборванное соединение не возвращается в пул, а отбрасывается
+                await conn.invalidate()
+            await conn.close()
+        except Exception as e:
+            logger.warning(f"Не удалось закрыть соединение подписки: {e}")
@@ -1,269 +1,284 @@
+import argparse
 import asyncio
 import json
 import os
-from datetime import datetime, timezone
-from uuid import uuid4
-from sqlalchemy import select, func
-from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import select, func, text
+from decouple import config
 import logging
 import sys
+import time
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from database.models import async_session, Video, VideoSnapshot
+from database.models import (
+    engine, async_session, Video, VideoSnapshot, VideoImportState,
+    DailyVideoStats, DailyCreatorStats, DailyTotals,
+)
+from database.migrations import ensure_schema
+from database.generation import bump_generation, NOTIFY_SQL
+from database.transform import build_video_rows
+from database.bulk_load import copy_batch
+from database.pipeline import run_pipeline
+from database.timing import import_phases
+from database.progress import import_progress
+from monitoring.metrics import (
+    import_records_total, import_seconds, import_phase_seconds, import_records_per_second,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def parse_datetime(dt_str: str):
-    """Парсит строку datetime с учетом часовых поясов"""
-    try:
-        # Убираем Z и добавляем timezone если нужно
-        if dt_str.endswith('Z'):
-            dt_str = dt_str.replace('Z', '+00:00')
-        
-        # Парсим datetime
-        dt = datetime.fromisoformat(dt_str)
-        
-        # Если datetime без timezone, делаем его UTC
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        
-        # Преобразуем в naive datetime (без timezone) для PostgreSQL
-        return dt.astimezone(timezone.utc).replace(tzinfo=None)
-        
-    except Exception as e:
-        logger.error(f"Ошибка парсинга datetime '{dt_str}': {e}")
-        raise
+# Количество видео в одной пачке COPY
+IMPORT_BATCH_SIZE = config('IMPORT_BATCH_SIZE', default=1000, cast=int)
+
+# Инкрементальный режим: неизменившиеся видео пропускаются, снимки только дописываются
+IMPORT_INCREMENTAL = config('IMPORT_INCREMENTAL', default=True, cast=bool)
+
+# Количество процессов преобразования и писателей в параллельном конвейере (1 — без конвейера)
+IMPORT_WORKERS = config('IMPORT_WORKERS', default=1, cast=int)
+
+
+# Размер куска, читаемого из файла за один раз
+READ_CHUNK_SIZE = 1 << 16
+
+# Ключи, под которыми может лежать список видео в корневом объекте
+RECORD_KEYS = ('videos', 'data')
+
+# Признак конца потока записей
+_END = object()
+
+
+class _JsonStream:
+    """Инкрементальный разбор JSON-файла по кускам"""
+
+    def __init__(self, f, chunk_size: int = READ_CHUNK_SIZE, on_read=None):
+        self.f = f
+        self.chunk_size = chunk_size
+        # Вызывается с размером каждого прочитанного куска (ход импорта)
+        self.on_read = on_read
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size: int = 0) -> bool:
+        """Дочитывает следующий кусок файла в буфер"""
+        if self.eof:
+            return False
+        chunk = self.f.read(max(size, self.chunk_size))
+        if not chunk:
+            self.eof = True
+            return False
+        if self.on_read is not None:
+            self.on_read(len(chunk))
+        # Отбрасываем уже разобранную часть буфера
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Возвращает следующий значимый символ (пустая строка в конце файла)"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char: str):
+        """Пропускает ожидаемый символ-разделитель"""
+        found = self.peek()
+        if found != char:
+            raise json.JSONDecodeError(f"Ожидался символ '{char}'", self.buf, self.pos)
+        self.pos += 1
+
+    def decode_value(self):
+        """Разбирает одно JSON-значение целиком"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # Значение не поместилось в буфер: удваиваем объем чтения,
+                # чтобы крупные записи не разбирались заново слишком часто
+                if self._fill(len(self.buf) - self.pos):
+                    continue
+                raise
+            # Число на границе буфера может быть обрезано
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def iter_array(self):
+        """Выдает элементы JSON-массива по одному"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.decode_value()
+            char = self.peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise json.JSONDecodeError("Ожидался символ ',' или ']'", self.buf, self.pos - 1)
+
+
+def _iter_object_records(stream: _JsonStream):
+    """Выдает записи из корневого объекта: {"videos": [...]}, {"data": [...]} или одно видео"""
+    fields = {}
+    streamed = False
+    stream.expect('{')
+    if stream.peek() == '}':
+        stream.pos += 1
+        yield fields
+        return
+    while True:
+        key = stream.decode_value()
+        stream.expect(':')
+        if key in RECORD_KEYS and not streamed:
+            streamed = True
+            if stream.peek() != '[':
+                value = stream.decode_value()
+                logger.error(f"Ожидался список, получен {type(value)}")
+                return
+            yield from stream.iter_array()
+        elif streamed:
+            # Остальные поля после списка видео не нужны
+            stream.decode_value()
+        else:
+            fields[key] = stream.decode_value()
+        char = stream.peek()
+        stream.pos += 1
+        if char == '}':
+            break
+        if char != ',':
+            raise json.JSONDecodeError("Ожидался символ ',' или '}'", stream.buf, stream.pos - 1)
+    # Корневой объект без списка считается одним видео
+    if not streamed:
+        yield fields
 
 
-async def load_json_data(file_path: str):
-    """Загружает данные из JSON файла"""
+def load_json_data(file_path: str, on_read=None):
+    """Потоково читает JSON файл и выдает записи видео по одной
+
+    on_read(символов) вызывается после чтения каждого куска файла.
+    Ошибка разбора JSON пробрасывается: остаток файла иначе молча терялся бы.
+    """
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # Проверяем структуру данных
-        if isinstance(data, dict):
-            if 'videos' in data:
-                data = data['videos']
-            elif 'data' in data:
-                data = data['data']
-            else:
-                data = [data]
-        
-        if not isinstance(data, list):
-            logger.error(f"Ожидался список, получен {type(data)}")
-            return []
-            
-        return data
-        
+            stream = _JsonStream(f, on_read=on_read)
+            first = stream.peek()
+            if first == '[':
+                yield from stream.iter_array()
+            elif first == '{':
+                yield from _iter_object_records(stream)
+            elif first:
+                value = stream.decode_value()
+                logger.error(f"Ожидался список, получен {type(value)}")
+
     except FileNotFoundError:
         logger.error(f"Файл {file_path} не найден!")
-        return []
     except json.JSONDecodeError as e:
+        # Уже загруженные пачки остаются в базе, но импорт не считается успешным
         logger.error(f"Ошибка парсинга JSON: {e}")
-        return []
+        raise
 
 
-async def seed_videos(session, videos_data):
-    """Заполняет таблицу videos"""
+def _read_batch(videos_iter, start_idx: int, size: int):
+    """Читает до size записей и строит по ним строки таблиц: (records, errors, consumed)"""
+    records = []
+    errors = []
+    for idx in range(start_idx, start_idx + size):
+        # Чтение и разбор JSON идут лениво, поэтому время считается на выдаче записи
+        with import_phases.measure('read'):
+            video_data = next(videos_iter, _END)
+        if video_data is _END:
+            break
+        try:
+            with import_phases.measure('transform'):
+                records.append(build_video_rows(video_data, idx))
+        except ValueError as e:
+            errors.append(str(e))
+    return records, errors, len(records) + len(errors)
+
+
+async def seed_videos(conn, videos_data, batch_size: int = IMPORT_BATCH_SIZE,
+                      incremental: bool = IMPORT_INCREMENTAL):
+    """Заполняет таблицы videos и video_snapshots пачками через COPY"""
     inserted_count = 0
     updated_count = 0
+    skipped_count = 0
     error_count = 0
-    
-    for idx, video_data in enumerate(videos_data):
+
+    records = []
+
+    async def flush():
+        nonlocal inserted_count, updated_count, skipped_count, error_count
         try:
-            # Проверяем, что video_data - словарь
-            if not isinstance(video_data, dict):
-                logger.error(f"Элемент {idx} не является словарем: {type(video_data)}")
-                error_count += 1
-                continue
-            
-            video_id = video_data.get('id', f'unknown_{idx}')
-            logger.info(f"Обработка видео {idx + 1}/{len(videos_data)}: {video_id}")
-            
-            # Проверяем обязательные поля
-            required_fields = ['id', 'creator_id', 'video_created_at', 'created_at', 'updated_at']
-            for field in required_fields:
-                if field not in video_data:
-                    logger.error(f"Видео {video_id} пропущено: отсутствует поле {field}")
-                    error_count += 1
-                    continue
-            
-            # Преобразуем строки дат с учетом часовых поясов
-            try:
-                video_created_at = parse_datetime(video_data['video_created_at'])
-                created_at = parse_datetime(video_data['created_at'])
-                updated_at = parse_datetime(video_data['updated_at'])
-            except Exception as e:
-                logger.error(f"Ошибка парсинга дат для видео {video_id}: {e}")
-                error_count += 1
-                continue
-            
-            # Получаем числовые значения с проверкой
-            views_count = video_data.get('views_count', 0) or 0
-            likes_count = video_data.get('likes_count', 0) or 0
-            comments_count = video_data.get('comments_count', 0) or 0
-            reports_count = video_data.get('reports_count', 0) or 0
-            
-            # Создаем запись видео
-            video = Video(
-                id=video_id,
-                creator_id=video_data['creator_id'],
-                video_created_at=video_created_at,
-                views_count=views_count,
-                likes_count=likes_count,
-                comments_count=comments_count,
-                reports_count=reports_count,
-                created_at=created_at,
-                updated_at=updated_at
+            # Вся пачка, включая коммит; внутренние фазы copy_batch считаются отдельно
+            with import_phases.measure('write'):
+                inserted, updated, skipped, snapshots = await copy_batch(conn, records, incremental)
+            inserted_count += inserted
+            updated_count += updated
+            skipped_count += skipped
+            import_progress.add(inserted + updated + skipped)
+            logger.info(
+                f"Промежуточный коммит: обработано {inserted_count + updated_count + skipped_count} видео "
+                f"(+{snapshots} снимков)"
             )
-            
-            session.add(video)
-            await session.flush()
-            inserted_count += 1
-            
-            # Создаем снимки для этого видео
-            snapshots = video_data.get('snapshots', [])
-            if snapshots:
-                snapshots_added = await seed_snapshots_for_video(session, video, snapshots)
-                if snapshots_added > 0:
-                    logger.debug(f"Добавлено {snapshots_added} снимков для видео {video_id}")
-            
-            # Коммитим каждые 100 записей для экономии памяти
-            if inserted_count % 100 == 0:
-                await session.commit()
-                logger.info(f"Промежуточный коммит: обработано {inserted_count} видео")
-            
-        except IntegrityError:
-            await session.rollback()
-            # Если видео уже существует, обновляем его
-            try:
-                await update_existing_video(session, video_data)
-                updated_count += 1
-            except Exception as e:
-                logger.error(f"Ошибка при обновлении видео {video_id}: {e}")
-                error_count += 1
         except Exception as e:
-            await session.rollback()
-            logger.error(f"Ошибка при добавлении видео {video_id}: {e}")
-            error_count += 1
-    
-    # Финальный коммит
-    await session.commit()
-    
-    logger.info(f"Импорт видео завершен:")
-    logger.info(f"  Добавлено: {inserted_count}")
-    logger.info(f"  Обновлено: {updated_count}")
-    logger.info(f"  Ошибок: {error_count}")
-    
-    return inserted_count, updated_count, error_count
-
+            # Пачка откатывается целиком
+            logger.error(f"Ошибка при загрузке пачки из {len(records)} видео: {e}")
+            error_count += len(records)
+            import_progress.add(0, len(records))
+        records.clear()
 
-async def update_existing_video(session, video_data):
-    """Обновляет существующее видео"""
-    video_id = video_data.get('id')
-    
-    try:
-        # Преобразуем даты
-        video_created_at = parse_datetime(video_data['video_created_at'])
-        updated_at = parse_datetime(video_data['updated_at'])
-        created_at = parse_datetime(video_data['created_at'])
-        
-        # Используем upsert операцию
-        stmt = insert(Video).values(
-            id=video_id,
-            creator_id=video_data['creator_id'],
-            video_created_at=video_created_at,
-            views_count=video_data.get('views_count', 0) or 0,
-            likes_count=video_data.get('likes_count', 0) or 0,
-            comments_count=video_data.get('comments_count', 0) or 0,
-            reports_count=video_data.get('reports_count', 0) or 0,
-            created_at=created_at,
-            updated_at=updated_at
-        ).on_conflict_do_update(
-            index_elements=['id'],
-            set_={
-                'views_count': video_data.get('views_count', 0) or 0,
-                'likes_count': video_data.get('likes_count', 0) or 0,
-                'comments_count': video_data.get('comments_count', 0) or 0,
-                'reports_count': video_data.get('reports_count', 0) or 0,
-                'updated_at': updated_at
-            }
+    # Чтение и преобразование пачки идут в отдельном потоке: при фоновом импорте
+    # бот продолжает отвечать, пока разбирается JSON
+    videos_iter = iter(videos_data)
+    start_idx = 0
+    while True:
+        batch, errors, consumed = await asyncio.to_thread(
+            _read_batch, videos_iter, start_idx, batch_size - len(records)
         )
-        
-        await session.execute(stmt)
-        await session.commit()
-        
-        # Добавляем снимки
-        video = await session.get(Video, video_id)
-        snapshots = video_data.get('snapshots', [])
-        if snapshots:
-            await seed_snapshots_for_video(session, video, snapshots)
-        
-    except Exception as e:
-        await session.rollback()
-        raise e
+        if not consumed:
+            break
+        start_idx += consumed
+        records.extend(batch)
+        for message in errors:
+            logger.error(message)
+        error_count += len(errors)
+        import_progress.add(0, len(errors))
 
+        if len(records) >= batch_size:
+            await flush()
 
-async def seed_snapshots_for_video(session, video, snapshots_data):
-    """Заполняет снимки для конкретного видео"""
-    added_count = 0
+    # Финальная пачка
+    if records:
+        await flush()
     
-    for idx, snapshot_data in enumerate(snapshots_data):
-        try:
-            # Проверяем обязательные поля
-            required_fields = ['created_at', 'updated_at']
-            for field in required_fields:
-                if field not in snapshot_data:
-                    logger.warning(f"Снимок {idx} для видео {video.id} пропущен: отсутствует поле {field}")
-                    continue
-            
-            # Преобразуем даты
-            created_at = parse_datetime(snapshot_data['created_at'])
-            updated_at = parse_datetime(snapshot_data['updated_at'])
-            
-            # Получаем числовые значения
-            views_count = snapshot_data.get('views_count', 0) or 0
-            likes_count = snapshot_data.get('likes_count', 0) or 0
-            comments_count = snapshot_data.get('comments_count', 0) or 0
-            reports_count = snapshot_data.get('reports_count', 0) or 0
-            delta_views_count = snapshot_data.get('delta_views_count', 0) or 0
-            delta_likes_count = snapshot_data.get('delta_likes_count', 0) or 0
-            delta_reports_count = snapshot_data.get('delta_reports_count', 0) or 0
-            
-            snapshot = VideoSnapshot(
-                id=str(uuid4()),
-                video_id=video.id,
-                views_count=views_count,
-                likes_count=likes_count,
-                comments_count=comments_count,
-                reports_count=reports_count,
-                delta_views_count=delta_views_count,
-                delta_likes_count=delta_likes_count,
-                delta_reports_count=delta_reports_count,
-                created_at=created_at,
-                updated_at=updated_at
-            )
-            
-            session.add(snapshot)
-            added_count += 1
-            
-        except Exception as e:
-            logger.error(f"Ошибка при добавлении снимка {idx} для видео {video.id}: {e}")
-            continue
+    logger.info(f"Импорт видео завершен:")
+    logger.info(f"  Добавлено: {inserted_count}")
+    logger.info(f"  Обновлено: {updated_count}")
+    logger.info(f"  Без изменений: {skipped_count}")
+    logger.info(f"  Ошибок: {error_count}")
     
-    await session.flush()
-    return added_count
+    return inserted_count, updated_count, skipped_count, error_count
 
 
 async def clear_database(session):
     """Очищает базу данных"""
     try:
+        for model in (DailyTotals, DailyCreatorStats, DailyVideoStats, VideoImportState):
+            await session.execute(model.__table__.delete())
         await session.execute(VideoSnapshot.__table__.delete())
         await session.execute(Video.__table__.delete())
+        await session.execute(text(NOTIFY_SQL))
         await session.commit()
+        bump_generation()
         logger.info("База данных очищена")
     except Exception as e:
         await session.rollback()
@@ -285,13 +300,40 @@ async def count_records(session):
         return 0, 0
 
 
-async def main_db():
-    """Основная функция для заполнения базы данных"""
-    from decouple import config
-    
+def record_import_metrics(inserted: int, updated: int, skipped: int, errors: int,
+                          elapsed: float, phases_before: dict):
+    """Итоги импорта в метрики процесса (видны на /metrics, если импорт шел в процессе бота)"""
+    for result, value in (('inserted', inserted), ('updated', updated), ('skipped', skipped), ('errors', errors)):
+        import_records_total.inc(value, result=result)
+    import_seconds.observe(elapsed)
+    for phase, seconds in import_phases.seconds.items():
+        import_phase_seconds.inc(seconds - phases_before.get(phase, 0.0), phase=phase)
+    processed = inserted + updated + skipped + errors
+    import_records_per_second.set(processed / elapsed if elapsed else 0.0)
+
+
+async def main_db(workers: int = IMPORT_WORKERS, writers: int = 0):
+    """Основная функция для заполнения базы данных
+
+    Возвращает кортеж (inserted, updated, skipped, errors).
+    При workers > 1 импорт идет параллельным конвейером: workers процессов
+    преобразования и writers писателей (по умолчанию столько же).
+    Ход импорта доступен в database.progress.import_progress.
+    """
     # Получаем путь из конфига или используем по умолчанию
     file_path = config('JSON_FILE_PATH', default='data/videos.json')
-    
+
+    import_progress.start(file_path)
+    try:
+        result = await _import_file(file_path, workers, writers)
+    except Exception as e:
+        import_progress.fail(e)
+        raise
+    import_progress.finish()
+    return result
+
+
+async def _import_file(file_path: str, workers: int, writers: int):
     logger.info(f"Ищем файл по пути: {file_path}")
     
     if not os.path.exists(file_path):
@@ -300,31 +342,60 @@ async def main_db():
             
     logger.info(f"Загрузка данных из {file_path}...")
 
-    videos_data = await load_json_data(file_path)
+    # Записи читаются из файла по одной, без загрузки всего файла в память
+    videos_data = load_json_data(file_path, on_read=import_progress.advance)
     
-    if not videos_data:
-        logger.info("Нет данных для импорта!")
-        return
+    # Опционально: очистить базу перед заполнением
+    # async with async_session() as session:
+    #     await clear_database(session)
+    
+    # Создаем недостающие таблицы и ограничения
+    async with engine.begin() as conn:
+        await ensure_schema(conn)
     
-    logger.info(f"Найдено {len(videos_data)} элементов для импорта...")
+    # Заполняем базу данных
+    started = time.perf_counter()
+    phases_before = dict(import_phases.seconds)
+    if workers > 1:
+        result = await run_pipeline(
+            engine, videos_data,
+            workers=workers,
+            writers=writers or workers,
+            batch_size=IMPORT_BATCH_SIZE,
+            incremental=IMPORT_INCREMENTAL,
+        )
+        inserted, updated, skipped, errors = result.inserted, result.updated, result.skipped, result.errors
+    else:
+        async with engine.connect() as conn:
+            inserted, updated, skipped, errors = await seed_videos(conn, videos_data)
+    processed = inserted + updated + skipped + errors
+    record_import_metrics(inserted, updated, skipped, errors, time.perf_counter() - started, phases_before)
+    
+    if not processed:
+        logger.info("Нет данных для импорта!")
+        return inserted, updated, skipped, errors
     
     async with async_session() as session:
-        # Опционально: очистить базу перед заполнением
-        # await clear_database(session)
-        
-        # Заполняем базу данных
-        inserted, updated, errors = await seed_videos(session, videos_data)
-        
         # Подсчитываем общее количество записей
         videos_count, snapshots_count = await count_records(session)
         
         logger.info(f"\n=== ИТОГИ ИМПОРТА ===")
-        logger.info(f"Обработано видео: {len(videos_data)}")
+        logger.info(f"Обработано видео: {processed}")
         logger.info(f"Успешно добавлено: {inserted}")
         logger.info(f"Обновлено: {updated}")
+        logger.info(f"Без изменений: {skipped}")
         logger.info(f"Ошибок: {errors}")
         logger.info(f"Итоговое количество видео в БД: {videos_count}")
         logger.info(f"Итоговое количество снимков в БД: {snapshots_count}")
 
+    return inserted, updated, skipped, errors
+
 if __name__ == "__main__":
-    asyncio.run(main_db())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Импорт videos.json в базу данных")
+    parser.add_argument('--workers', type=int, default=IMPORT_WORKERS,
+                        help="количество процессов преобразования (1 — последовательный импорт)")
+    parser.add_argument('--writers', type=int, default=0,
+                        help="количество параллельных писателей (по умолчанию равно --workers)")
+    args = parser.parse_args()
+
+    asyncio.run(main_db(workers=args.workers, writers=args.writers))
\ No newline at end of file
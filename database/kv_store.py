@@ -0,0 +1,357 @@
+from collections.abc import Mapping, Sequence
+from decimal import Decimal
+from typing import Any, Optional
+import asyncio
+import datetime
+import json
+import logging
+import time
+
+from sqlalchemy import text
+from decouple import config
+
+
+logger = logging.getLogger(__name__)
+
+# Где хранится общее состояние: memory — в процессе, postgres — в таблице kv_store
+STATE_BACKEND = config('STATE_BACKEND', default='memory')
+# Через сколько секунд накопленные записи отправляются в Postgres одной пачкой
+KV_FLUSH_INTERVAL = config('KV_FLUSH_INTERVAL', default=0.05, cast=float)
+# Пачка отправляется сразу, как только накопилось столько записей
+KV_BATCH_SIZE = config('KV_BATCH_SIZE', default=200, cast=int)
+# Как часто удалять просроченные записи (в секундах)
+KV_PURGE_INTERVAL = config('KV_PURGE_INTERVAL', default=300, cast=float)
+
+UPSERT_SQL = """
+    INSERT INTO kv_store (namespace, key, value, expires_at)
+    SELECT r.namespace, r.key, r.value, to_timestamp(r.expires_at)
+    FROM jsonb_to_recordset(CAST(:rows AS jsonb))
+        AS r(namespace text, key text, value jsonb, expires_at double precision)
+    ON CONFLICT (namespace, key) DO UPDATE
+    SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at
+"""
+
+DELETE_SQL = """
+    DELETE FROM kv_store kv
+    USING jsonb_to_recordset(CAST(:rows AS jsonb)) AS r(namespace text, key text)
+    WHERE kv.namespace = r.namespace AND kv.key = r.key
+"""
+
+SELECT_SQL = """
+    SELECT kv.key, kv.value::text AS value
+    FROM kv_store kv
+    WHERE kv.namespace = :namespace
+      AND kv.key IN (SELECT jsonb_array_elements_text(CAST(:keys AS jsonb)))
+      AND (kv.expires_at IS NULL OR kv.expires_at > now())
+"""
+
+CLEAR_SQL = "DELETE FROM kv_store WHERE namespace = :namespace"
+
+PURGE_SQL = "DELETE FROM kv_store WHERE expires_at < now()"
+
+# Отметка удаления в буфере записей
+_DELETED = object()
+
+
+def encode_value(value):
+    """Приводит значение к виду, сохранимому в JSON (Decimal, даты и строки результатов)"""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, Decimal):
+        return {'__decimal__': str(value)}
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'__date__': value.isoformat()}
+    if isinstance(value, Mapping):
+        return {str(key): encode_value(item) for key, item in value.items()}
+    if isinstance(value, Sequence):
+        return [encode_value(item) for item in value]
+    raise TypeError(f"Значение типа {type(value).__name__} нельзя сохранить в хранилище")
+
+
+def decode_value(value):
+    """Обратное преобразование к encode_value"""
+    if isinstance(value, list):
+        return [decode_value(item) for item in value]
+    if isinstance(value, dict):
+        if len(value) == 1:
+            (tag, raw), = value.items()
+            if tag == '__decimal__':
+                return Decimal(raw)
+            if tag == '__datetime__':
+                return datetime.datetime.fromisoformat(raw)
+            if tag == '__date__':
+                return datetime.date.fromisoformat(raw)
+        return {key: decode_value(item) for key, item in value.items()}
+    return value
+
+
+def _expires_at(ttl: Optional[float]) -> Optional[float]:
+    return time.time() + ttl if ttl else None
+
+
+class KVStore:
+    """Хранилище ключ-значение для общего состояния бота
+
+    Значения — всё, что проходит через encode_value. Ключи группируются
+    по пространствам имен (fsm, questions, results, ...).
+    """
+
+    # Видно ли хранилище другим процессам (иначе кэшам нет смысла в нем дублировать записи)
+    shared = False
+
+    async def get(self, namespace: str, key: str) -> Optional[Any]:
+        """Значение по ключу или None"""
+        return (await self.get_many(namespace, [key])).get(key)
+
+    async def get_many(self, namespace: str, keys: list) -> dict:
+        """Найденные значения: {key: value}"""
+        raise NotImplementedError
+
+    async def set(self, namespace: str, key: str, value, ttl: Optional[float] = None):
+        """Сохраняет значение; ttl — время жизни в секундах"""
+        raise NotImplementedError
+
+    async def delete(self, namespace: str, key: str):
+        raise NotImplementedError
+
+    async def clear(self, namespace: str):
+        """Удаляет все ключи пространства имен"""
+        raise NotImplementedError
+
+    async def close(self):
+        """Сохраняет накопленные записи"""
+
+
+class MemoryKVStore(KVStore):
+    """Хранилище в памяти процесса"""
+
+    def __init__(self):
+        # (namespace, key) -> (значение, время истечения или None)
+        self._entries = {}
+        self._writes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get_many(self, namespace: str, keys: list) -> dict:
+        now = time.time()
+        found = {}
+        for key in keys:
+            entry = self._entries.get((namespace, key))
+            if entry is None:
+                continue
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= now:
+                del self._entries[(namespace, key)]
+                continue
+            found[key] = value
+        return found
+
+    async def set(self, namespace: str, key: str, value, ttl: Optional[float] = None):
+        # Копия через encode/decode: как и в Postgres, изменения объекта после записи не видны
+        self._entries[(namespace, key)] = (decode_value(encode_value(value)), _expires_at(ttl))
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            self._purge()
+
+    async def delete(self, namespace: str, key: str):
+        self._entries.pop((namespace, key), None)
+
+    async def clear(self, namespace: str):
+        for entry_key in [entry_key for entry_key in self._entries if entry_key[0] == namespace]:
+            del self._entries[entry_key]
+
+    def _purge(self):
+        now = time.time()
+        self._entries = {
+            entry_key: (value, expires_at)
+            for entry_key, (value, expires_at) in self._entries.items()
+            if expires_at is None or expires_at > now
+        }
+
+
+class PostgresKVStore(KVStore):
+    """Хранилище в таблице kv_store, общее для всех экземпляров бота
+
+    Записи копятся в буфере и отправляются одной пачкой раз в flush_interval
+    или при заполнении пачки; до отправки они видны чтениям этого процесса.
+    Одновременные чтения объединяются в один запрос.
+    """
+
+    shared = True
+
+    def __init__(self, engine, flush_interval: float = KV_FLUSH_INTERVAL, batch_size: int = KV_BATCH_SIZE,
+                 purge_interval: float = KV_PURGE_INTERVAL):
+        self.engine = engine
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.purge_interval = purge_interval
+        # (namespace, key) -> (значение, время истечения) или _DELETED
+        self._writes = {}
+        # Записи, которые отправляются прямо сейчас (еще не закоммичены)
+        self._flushing = {}
+        # (namespace, key) -> Future с результатом чтения
+        self._reads = {}
+        self._read_task = None
+        self._flush_task = None
+        self._batch_full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._last_purge = time.monotonic()
+        self.flushes = 0
+        self.read_batches = 0
+
+    async def get_many(self, namespace: str, keys: list) -> dict:
+        found = {}
+        waiting = {}
+        now = time.time()
+        for key in keys:
+            pending = self._writes.get((namespace, key)) or self._flushing.get((namespace, key))
+            if pending is _DELETED:
+                continue
+            if pending is not None:
+                value, expires_at = pending
+                if expires_at is None or expires_at > now:
+                    found[key] = value
+                continue
+            future = self._reads.get((namespace, key))
+            if future is None:
+                future = asyncio.get_running_loop().create_future()
+                self._reads[(namespace, key)] = future
+            waiting[key] = future
+
+        if waiting:
+            if self._read_task is None:
+                self._read_task = asyncio.ensure_future(self._read_batch())
+            for key, future in waiting.items():
+                value = await asyncio.shield(future)
+                if value is not None:
+                    found[key] = value
+        return found
+
+    async def _read_batch(self):
+        """Выполняет все чтения, накопившиеся за один проход цикла событий"""
+        await asyncio.sleep(0)
+        reads, self._reads = self._reads, {}
+        self._read_task = None
+
+        by_namespace = {}
+        for (namespace, key) in reads:
+            by_namespace.setdefault(namespace, []).append(key)
+
+        try:
+            async with self.engine.connect() as conn:
+                for namespace, keys in by_namespace.items():
+                    for start in range(0, len(keys), self.batch_size):
+                        chunk = keys[start:start + self.batch_size]
+                        result = await conn.execute(
+                            text(SELECT_SQL), {'namespace': namespace, 'keys': json.dumps(chunk)}
+                        )
+                        for key, raw in result:
+                            future = reads.pop((namespace, key))
+                            if not future.done():
+                                future.set_result(decode_value(json.loads(raw)))
+            self.read_batches += 1
+        except Exception as e:
+            logger.error(f"Ошибка чтения из kv_store: {e}")
+        finally:
+            # Не найденные (или не прочитанные из-за ошибки) ключи — промах
+            for future in reads.values():
+                if not future.done():
+                    future.set_result(None)
+
+    def _write(self, namespace: str, key: str, entry):
+        self._writes[(namespace, key)] = entry
+        if len(self._writes) >= self.batch_size:
+            self._batch_full.set()
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def set(self, namespace: str, key: str, value, ttl: Optional[float] = None):
+        self._write(namespace, key, (decode_value(encode_value(value)), _expires_at(ttl)))
+
+    async def delete(self, namespace: str, key: str):
+        self._write(namespace, key, _DELETED)
+
+    async def clear(self, namespace: str):
+        await self.flush()
+        async with self.engine.begin() as conn:
+            await conn.execute(text(CLEAR_SQL), {'namespace': namespace})
+
+    async def _flush_later(self):
+        try:
+            await asyncio.wait_for(self._batch_full.wait(), self.flush_interval)
+        except asyncio.TimeoutError:
+            pass
+        self._batch_full.clear()
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """Отправляет накопленные записи и удаления одной транзакцией"""
+        async with self._flush_lock:
+            if not self._writes:
+                return
+            batch, self._writes = self._writes, {}
+            self._flushing = batch
+
+            upserts = []
+            deletes = []
+            for (namespace, key), entry in batch.items():
+                if entry is _DELETED:
+                    deletes.append({'namespace': namespace, 'key': key})
+                else:
+                    value, expires_at = entry
+                    upserts.append({
+                        'namespace': namespace,
+                        'key': key,
+                        'value': encode_value(value),
+                        'expires_at': expires_at,
+                    })
+
+            try:
+                async with self.engine.begin() as conn:
+                    if upserts:
+                        await conn.execute(text(UPSERT_SQL), {'rows': json.dumps(upserts, ensure_ascii=False)})
+                    if deletes:
+                        await conn.execute(text(DELETE_SQL), {'rows': json.dumps(deletes, ensure_ascii=False)})
+                    if time.monotonic() - self._last_purge > self.purge_interval:
+                        await conn.execute(text(PURGE_SQL))
+                        self._last_purge = time.monotonic()
+                self.flushes += 1
+            except Exception as e:
+                logger.error(f"Ошибка записи в kv_store ({len(batch)} записей): {e}")
+                # Возвращаем записи в буфер, если их еще не перезаписали
+                for entry_key, entry in batch.items():
+                    self._writes.setdefault(entry_key, entry)
+                if self._flush_task is None:
+                    self._flush_task = asyncio.ensure_future(self._flush_later())
+            finally:
+                self._flushing = {}
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            'pending_writes': len(self._writes),
+            'flushes': self.flushes,
+            'read_batches': self.read_batches,
+        }
+
+
+def create_store(engine=None, backend: str = STATE_BACKEND) -> KVStore:
+    """Хранилище общего состояния по настройке STATE_BACKEND"""
+    backend = backend.lower()
+    if backend == 'postgres':
+        if engine is None:
+            from database.engine import get_engine
+            engine = get_engine()
+        return PostgresKVStore(engine)
+    if backend != 'memory':
+        logger.warning(f"Неизвестный STATE_BACKEND={backend}, используется memory")
+    return MemoryKVStore()
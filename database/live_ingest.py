@@ -0,0 +1,410 @@
+from datetime import datetime
+from typing import NamedTuple, Optional
+from uuid import uuid4
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+from aiohttp import web
+from decouple import config
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database.bulk_load import get_driver_connection
+from database.generation import bump_generation, notify_generation
+from database.partitions import snapshot_partitions
+from database.rollups import refresh_rollups
+from database.transform import SNAPSHOT_COLUMNS, timestamps
+from monitoring.metrics import ingest_seconds, ingest_snapshots_total
+
+
+logger = logging.getLogger(__name__)
+
+# HTTP-приемник снимков (0 — не запускается); по умолчанию слушает только локальный адрес
+INGEST_PORT = config('INGEST_PORT', default=0, cast=int)
+INGEST_HOST = config('INGEST_HOST', default='127.0.0.1')
+# Токен в заголовке Authorization: Bearer <токен> (пустой — без проверки)
+INGEST_TOKEN = config('INGEST_TOKEN', default='')
+# Максимум снимков в одном запросе к приемнику
+INGEST_MAX_BATCH = config('INGEST_MAX_BATCH', default=10000, cast=int)
+# Размер пачки при чтении JSON lines из командной строки
+INGEST_BATCH_SIZE = config('INGEST_BATCH_SIZE', default=1000, cast=int)
+
+COUNTER_FIELDS = ('views_count', 'likes_count', 'comments_count', 'reports_count')
+
+CREATE_STAGING_SQL = (
+    """
+    CREATE TEMP TABLE IF NOT EXISTS stage_live (
+        seq integer NOT NULL,
+        id varchar NOT NULL,
+        video_id varchar NOT NULL,
+        creator_id varchar,
+        video_created_at timestamp,
+        views_count bigint,
+        likes_count bigint,
+        comments_count bigint,
+        reports_count bigint,
+        created_at timestamp NOT NULL,
+        updated_at timestamp NOT NULL
+    ) ON COMMIT DELETE ROWS
+    """,
+    """
+    CREATE TEMP TABLE IF NOT EXISTS stage_live_accepted (
+        id varchar NOT NULL,
+        video_id varchar NOT NULL,
+        views_count bigint,
+        likes_count bigint,
+        comments_count bigint,
+        reports_count bigint,
+        delta_views_count bigint,
+        delta_likes_count bigint,
+        delta_reports_count bigint,
+        created_at timestamp NOT NULL,
+        updated_at timestamp
+    ) ON COMMIT DELETE ROWS
+    """,
+)
+
+STAGE_COLUMNS = (
+    'seq', 'id', 'video_id', 'creator_id', 'video_created_at',
+    *COUNTER_FIELDS, 'created_at', 'updated_at',
+)
+
+# Новые видео создаются, если в снимке есть creator_id и video_created_at;
+# итоговые счетчики записываются ниже из последнего принятого снимка
+INSERT_NEW_VIDEOS_SQL = """
+    INSERT INTO videos (
+        id, creator_id, video_created_at,
+        views_count, likes_count, comments_count, reports_count,
+        created_at, updated_at
+    )
+    SELECT DISTINCT ON (video_id) video_id, creator_id, video_created_at, 0, 0, 0, 0, updated_at, updated_at
+    FROM stage_live
+    WHERE creator_id IS NOT NULL AND video_created_at IS NOT NULL
+    ORDER BY video_id, seq
+    ON CONFLICT (id) DO NOTHING
+"""
+
+# Прирост считается от последнего сохраненного снимка, поэтому строки видео
+# блокируются до коммита: другая потоковая пачка и импорт файла (copy_batch
+# обновляет те же строки videos) ждут и затем видят уже записанные снимки.
+# Порядок по id тот же, что у слияния импорта и исключает взаимные блокировки
+LOCK_VIDEOS_SQL = """
+    SELECT v.id FROM videos v
+    WHERE v.id IN (SELECT video_id FROM stage_live)
+    ORDER BY v.id
+    FOR UPDATE OF v
+"""
+
+COUNT_UNKNOWN_SQL = """
+    SELECT COUNT(*) FROM stage_live s
+    WHERE NOT EXISTS (SELECT 1 FROM videos v WHERE v.id = s.video_id)
+"""
+
+_SNAPSHOT_COLUMNS_SQL = ', '.join(SNAPSHOT_COLUMNS)
+
+# Принимаются только снимки новее последнего сохраненного: прирост первого из них
+# считается от сохраненного снимка, остальных — от предыдущего в пачке. Если снимков
+# нет (новое видео или секции с ними отсоединены), прирост считается от итоговых
+# счетчиков видео, иначе он равнялся бы всей истории видео. Повторы одного момента
+# внутри пачки схлопываются (побеждает последний)
+ACCEPT_SNAPSHOTS_SQL = f"""
+    INSERT INTO stage_live_accepted ({_SNAPSHOT_COLUMNS_SQL})
+    WITH staged AS (
+        SELECT DISTINCT ON (s.video_id, s.created_at) s.*
+        FROM stage_live s
+        JOIN videos v ON v.id = s.video_id
+        ORDER BY s.video_id, s.created_at, s.seq DESC
+    ),
+    last AS (
+        SELECT k.video_id, l.created_at,
+               COALESCE(l.views_count, v.views_count) AS views_count,
+               COALESCE(l.likes_count, v.likes_count) AS likes_count,
+               COALESCE(l.reports_count, v.reports_count) AS reports_count
+        FROM (SELECT DISTINCT video_id FROM staged) k
+        JOIN videos v ON v.id = k.video_id
+        LEFT JOIN LATERAL (
+            SELECT p.created_at, p.views_count, p.likes_count, p.reports_count
+            FROM video_snapshots p
+            WHERE p.video_id = k.video_id
+            ORDER BY p.created_at DESC
+            LIMIT 1
+        ) l ON true
+    )
+    SELECT s.id, s.video_id,
+           s.views_count, s.likes_count, s.comments_count, s.reports_count,
+           s.views_count - COALESCE(LAG(s.views_count) OVER w, l.views_count, 0),
+           s.likes_count - COALESCE(LAG(s.likes_count) OVER w, l.likes_count, 0),
+           s.reports_count - COALESCE(LAG(s.reports_count) OVER w, l.reports_count, 0),
+           s.created_at, s.updated_at
+    FROM staged s
+    JOIN last l ON l.video_id = s.video_id
+    WHERE l.created_at IS NULL OR s.created_at > l.created_at
+    WINDOW w AS (PARTITION BY s.video_id ORDER BY s.created_at)
+"""
+
+INSERT_SNAPSHOTS_SQL = f"""
+    INSERT INTO video_snapshots ({_SNAPSHOT_COLUMNS_SQL})
+    SELECT {_SNAPSHOT_COLUMNS_SQL} FROM stage_live_accepted
+    ON CONFLICT (video_id, created_at) DO NOTHING
+"""
+
+# Итоговые счетчики видео — из самого нового принятого снимка
+UPDATE_VIDEOS_SQL = """
+    UPDATE videos v SET
+        views_count = n.views_count,
+        likes_count = n.likes_count,
+        comments_count = n.comments_count,
+        reports_count = n.reports_count,
+        updated_at = n.updated_at
+    FROM (
+        SELECT DISTINCT ON (video_id) *
+        FROM stage_live_accepted
+        ORDER BY video_id, created_at DESC
+    ) n
+    WHERE v.id = n.video_id
+"""
+
+# Инкрементальный импорт файла не должен дописывать снимки раньше принятых здесь
+UPDATE_IMPORT_STATE_SQL = """
+    UPDATE video_import_state st
+    SET last_snapshot_at = GREATEST(st.last_snapshot_at, n.last_at)
+    FROM (
+        SELECT video_id, MAX(created_at) AS last_at
+        FROM stage_live_accepted
+        GROUP BY video_id
+    ) n
+    WHERE st.video_id = n.video_id
+"""
+
+AFFECTED_FROM_ACCEPTED = "SELECT DISTINCT video_id, CAST(created_at AS date) AS day FROM stage_live_accepted"
+
+
+class IngestResult(NamedTuple):
+    """Итог записи пачки снимков"""
+    received: int
+    accepted: int
+    stale: int
+    unknown: int
+    invalid: int
+    videos_created: int
+
+
+def _counter(value) -> Optional[int]:
+    """Целое значение счетчика или None (дробное число, строка не из цифр, bool)"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else None
+    if isinstance(value, str) and value.strip().lstrip('-').isdigit():
+        return int(value)
+    return None
+
+
+def build_live_row(item, seq: int, updated_at: datetime) -> tuple:
+    """Проверяет снимок счетчиков и готовит строку stage_live
+
+    Обязательны video_id, created_at и все счетчики (целые числа); creator_id
+    и video_created_at нужны, только если видео еще нет в базе. При некорректном снимке выбрасывает ValueError.
+    """
+    if not isinstance(item, dict):
+        raise ValueError(f"Снимок {seq} не является словарем: {type(item)}")
+    video_id = item.get('video_id')
+    if not video_id or 'created_at' not in item:
+        raise ValueError(f"Снимок {seq} пропущен: нужны поля video_id и created_at")
+    try:
+        created_at = timestamps.parse(item['created_at'])
+        video_created_at = (
+            timestamps.parse(item['video_created_at']) if item.get('video_created_at') else None
+        )
+    except Exception as e:
+        raise ValueError(f"Снимок {seq} видео {video_id} пропущен: {e}") from e
+    missing = [field for field in COUNTER_FIELDS if item.get(field) is None]
+    if missing:
+        # Нулевой счетчик вместо пропущенного дал бы отрицательный прирост и обнулил бы итог видео
+        raise ValueError(f"Снимок {seq} видео {video_id} пропущен: нет счетчиков {', '.join(missing)}")
+    counters = [_counter(item[field]) for field in COUNTER_FIELDS]
+    if any(value is None for value in counters):
+        raise ValueError(f"Снимок {seq} видео {video_id} пропущен: счетчик не целое число")
+    if any(value < 0 for value in counters):
+        raise ValueError(f"Снимок {seq} видео {video_id} пропущен: отрицательный счетчик")
+
+    return (
+        seq, str(uuid4()), str(video_id), item.get('creator_id'), video_created_at,
+        *counters, created_at, updated_at,
+    )
+
+
+async def ingest_snapshots(conn: AsyncConnection, items: list) -> IngestResult:
+    """Записывает пачку снимков счетчиков одной транзакцией
+
+    Приросты delta_* считаются на стороне базы от последнего сохраненного
+    снимка видео; в той же транзакции обновляются итоговые счетчики videos,
+    дневные агрегаты и поколение данных (кэши результатов и колонки сбрасываются).
+    """
+    updated_at = datetime.utcnow()
+    rows = []
+    invalid = 0
+    for seq, item in enumerate(items):
+        try:
+            rows.append(build_live_row(item, seq, updated_at))
+        except ValueError as e:
+            logger.warning(str(e))
+            invalid += 1
+
+    if not rows:
+        ingest_snapshots_total.inc(invalid, result='invalid')
+        return IngestResult(len(items), 0, 0, 0, invalid, 0)
+
+    started = time.perf_counter()
+    driver = await get_driver_connection(conn)
+    # Секции снимков создаются до транзакции пачки
+    await snapshot_partitions.ensure(driver, (row[STAGE_COLUMNS.index('created_at')] for row in rows))
+
+    async with driver.transaction():
+        for statement in CREATE_STAGING_SQL:
+            await driver.execute(statement)
+        await driver.copy_records_to_table('stage_live', records=rows, columns=STAGE_COLUMNS)
+
+        status = await driver.execute(INSERT_NEW_VIDEOS_SQL)
+        videos_created = int(status.split()[-1])
+        await driver.execute(LOCK_VIDEOS_SQL)
+        unknown = await driver.fetchval(COUNT_UNKNOWN_SQL)
+
+        status = await driver.execute(ACCEPT_SNAPSHOTS_SQL)
+        accepted = int(status.split()[-1])
+        if accepted:
+            await driver.execute(INSERT_SNAPSHOTS_SQL)
+            await driver.execute(UPDATE_VIDEOS_SQL)
+            await driver.execute(UPDATE_IMPORT_STATE_SQL)
+            await refresh_rollups(driver, source=AFFECTED_FROM_ACCEPTED)
+            # Кэши результатов в других процессах сбросятся после коммита
+            await notify_generation(driver)
+
+    if accepted:
+        bump_generation()
+    ingest_seconds.observe(time.perf_counter() - started)
+
+    # Не новее сохраненных и повторы внутри пачки
+    stale = len(rows) - accepted - unknown
+    result = IngestResult(len(items), accepted, stale, unknown, invalid, videos_created)
+    for name in ('accepted', 'stale', 'unknown', 'invalid'):
+        ingest_snapshots_total.inc(getattr(result, name), result=name)
+    logger.info(
+        f"Потоковая загрузка: принято {accepted} из {len(items)} снимков "
+        f"(устаревших {stale}, неизвестных видео {unknown}, некорректных {invalid}, новых видео {videos_created})"
+    )
+    return result
+
+
+# HTTP-приемник: POST /ingest, тело — JSON-массив снимков или JSON lines
+
+def parse_body(body: str) -> list:
+    """Снимки из тела запроса: JSON-массив, {"snapshots": [...]} или JSON lines"""
+    body = body.strip()
+    if body.startswith('['):
+        return json.loads(body)
+    if body.startswith('{') and '\n' not in body:
+        data = json.loads(body)
+        return data['snapshots'] if 'snapshots' in data else [data]
+    return [json.loads(line) for line in body.splitlines() if line.strip()]
+
+
+def _authorized(request: web.Request, token: str) -> bool:
+    return not token or request.headers.get('Authorization') == f'Bearer {token}'
+
+
+async def ingest_handler(request: web.Request) -> web.Response:
+    engine = request.app['engine']
+    if not _authorized(request, request.app['token']):
+        return web.json_response({'error': 'unauthorized'}, status=401)
+    try:
+        items = parse_body(await request.text())
+    except (ValueError, KeyError, TypeError) as e:
+        return web.json_response({'error': f'некорректный JSON: {e}'}, status=400)
+    if not isinstance(items, list):
+        return web.json_response({'error': 'ожидался список снимков'}, status=400)
+    if len(items) > INGEST_MAX_BATCH:
+        return web.json_response({'error': f'больше {INGEST_MAX_BATCH} снимков в запросе'}, status=413)
+
+    try:
+        async with engine.connect() as conn:
+            result = await ingest_snapshots(conn, items)
+    except Exception as e:
+        # Пачка откатывается целиком, ее можно отправить повторно
+        logger.error(f"Ошибка потоковой загрузки пачки из {len(items)} снимков: {e}")
+        return web.json_response({'error': str(e)}, status=500)
+    return web.json_response(result._asdict())
+
+
+async def start_ingest_server(engine, port: int = INGEST_PORT, host: str = INGEST_HOST,
+                              token: str = INGEST_TOKEN) -> Optional[web.AppRunner]:
+    """Запускает POST /ingest на host:port; возвращает runner для остановки (None, если port=0)"""
+    if not port:
+        return None
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app['engine'] = engine
+    app['token'] = token
+    app.router.add_post('/ingest', ingest_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Прием снимков на http://{host}:{port}/ingest")
+    return runner
+
+
+# Командная строка: JSON lines из файла или stdin
+
+async def main_ingest(path: str, batch_size: int):
+    from database.engine import get_engine
+
+    engine = get_engine()
+    totals = dict.fromkeys(IngestResult._fields, 0)
+    batch = []
+
+    async def flush():
+        async with engine.connect() as conn:
+            result = await ingest_snapshots(conn, batch)
+        for name, value in result._asdict().items():
+            totals[name] += value
+        batch.clear()
+
+    source = sys.stdin if path == '-' else open(path, encoding='utf-8')
+    try:
+        for number, line in enumerate(source, 1):
+            if not line.strip():
+                continue
+            try:
+                batch.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                logger.error(f"Строка {number}: некорректный JSON: {e}")
+                totals['received'] += 1
+                totals['invalid'] += 1
+                continue
+            if len(batch) >= batch_size:
+                await flush()
+        if batch:
+            await flush()
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        await engine.dispose()
+
+    logger.info(f"Итого: {totals}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Загрузка снимков счетчиков (JSON lines) с расчетом приростов")
+    parser.add_argument('--file', default='-', help="файл JSON lines, '-' — стандартный ввод")
+    parser.add_argument('--batch-size', type=int, default=INGEST_BATCH_SIZE,
+                        help="снимков в одной транзакции")
+    args = parser.parse_args()
+
+    asyncio.run(main_ingest(args.file, args.batch_size))
@@ -0,0 +1,39 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+import logging
+
+from database.models import Base
+from database.rollups import backfill_rollups
+
+
+logger = logging.getLogger(__name__)
+
+# Миграции для баз, созданных до появления новых ограничений.
+# Каждая миграция должна быть идемпотентной.
+MIGRATIONS = (
+    # Убираем дубли снимков, накопленные повторными импортами,
+    # и включаем естественный ключ (video_id, created_at)
+    """
+    DO $$
+    BEGIN
+        IF to_regclass('uq_video_snapshots_video_created') IS NULL THEN
+            DELETE FROM video_snapshots a
+            USING video_snapshots b
+            WHERE a.video_id = b.video_id
+              AND a.created_at = b.created_at
+              AND a.id > b.id;
+            ALTER TABLE video_snapshots
+                ADD CONSTRAINT uq_video_snapshots_video_created UNIQUE (video_id, created_at);
+        END IF;
+    END $$
+    """,
+)
+
+
+async def ensure_schema(conn: AsyncConnection):
+    """Создает недостающие таблицы и применяет миграции"""
+    await conn.run_sync(Base.metadata.create_all)
+    for statement in MIGRATIONS:
+        await conn.execute(text(statement))
+    await backfill_rollups(conn)
+    logger.info("Схема базы данных актуальна")
@@ -1,19 +1,17 @@
 
-from sqlalchemy import Column, String, DateTime, BigInteger, ForeignKey
+from sqlalchemy import Column, String, DateTime, Date, BigInteger, ForeignKey, UniqueConstraint
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import DeclarativeBase, relationship
-from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker, create_async_engine
-from decouple import config
+from sqlalchemy.ext.asyncio import AsyncAttrs, async_sessionmaker
 import datetime
 import asyncio
 
+from database.engine import get_engine
+from database.partitions import SNAPSHOT_PARTITIONED
 
-LOGIN=config('LOGIN')
-PASSWORD=config('PASSWORD')
-HOST=config('HOST')
-DB=config('DB')
 
-# Создаём асинхронный движок для PostgreSQL
-engine = create_async_engine(url=f'postgresql+asyncpg://{LOGIN}:{PASSWORD}@{HOST}:5432/{DB}')
+# Общий для приложения асинхронный движок PostgreSQL
+engine = get_engine()
 
 async_session=async_sessionmaker(engine)
 
@@ -38,6 +36,12 @@ class Video(Base):
 
 class VideoSnapshot(Base):
     __tablename__ = 'video_snapshots'
+    __table_args__ = (
+        # Естественный ключ снимка: один замер на видео в момент времени
+        UniqueConstraint('video_id', 'created_at', name='uq_video_snapshots_video_created'),
+        # Секции по времени замера (SNAPSHOT_PARTITIONING) создает импорт, см. database/partitions.py
+        {'postgresql_partition_by': 'RANGE (created_at)'} if SNAPSHOT_PARTITIONED else {},
+    )
     
     id = Column(String, primary_key=True)
     video_id = Column(String, ForeignKey('videos.id'), nullable=False, index=True)
@@ -48,14 +52,73 @@ class VideoSnapshot(Base):
     delta_views_count = Column(BigInteger, default=0)
     delta_likes_count = Column(BigInteger, default=0)
     delta_reports_count = Column(BigInteger, default=0)
-    created_at = Column(DateTime, nullable=False, index=True)
+    # В секционированной таблице ключ секционирования входит в первичный ключ
+    created_at = Column(DateTime, nullable=False, index=True, primary_key=SNAPSHOT_PARTITIONED)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow)
     
     video = relationship("Video", back_populates="snapshots")
 
+class VideoImportState(Base):
+    __tablename__ = 'video_import_state'
+    
+    video_id = Column(String, ForeignKey('videos.id', ondelete='CASCADE'), primary_key=True)
+    fingerprint = Column(String(40), nullable=False)
+    last_snapshot_at = Column(DateTime)
+    imported_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+# Дневные агрегаты по снимкам. Поддерживаются импортом (database/rollups.py)
+# и позволяют отвечать на вопросы за день или период без сканирования снимков.
+
+class DailyVideoStats(Base):
+    __tablename__ = 'daily_video_stats'
+    
+    video_id = Column(String, ForeignKey('videos.id', ondelete='CASCADE'), primary_key=True)
+    day = Column(Date, primary_key=True, index=True)
+    creator_id = Column(String, nullable=False, index=True)
+    delta_views_count = Column(BigInteger, default=0)
+    delta_likes_count = Column(BigInteger, default=0)
+    delta_reports_count = Column(BigInteger, default=0)
+    snapshots_count = Column(BigInteger, default=0)
+    # Число замеров с delta_views_count > 0
+    positive_views_snapshots = Column(BigInteger, default=0)
+
+class DailyCreatorStats(Base):
+    __tablename__ = 'daily_creator_stats'
+    
+    creator_id = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True, index=True)
+    delta_views_count = Column(BigInteger, default=0)
+    delta_likes_count = Column(BigInteger, default=0)
+    delta_reports_count = Column(BigInteger, default=0)
+    snapshots_count = Column(BigInteger, default=0)
+    videos_with_new_views = Column(BigInteger, default=0)
+
+class DailyTotals(Base):
+    __tablename__ = 'daily_totals'
+    
+    day = Column(Date, primary_key=True)
+    delta_views_count = Column(BigInteger, default=0)
+    delta_likes_count = Column(BigInteger, default=0)
+    delta_reports_count = Column(BigInteger, default=0)
+    snapshots_count = Column(BigInteger, default=0)
+    videos_with_new_views = Column(BigInteger, default=0)
+
+# Общее состояние экземпляров бота: состояния FSM, кэши, поколение данных
+# (database/kv_store.py). Записи с истекшим expires_at не выдаются и удаляются.
+
+class KVEntry(Base):
+    __tablename__ = 'kv_store'
+    
+    namespace = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    value = Column(JSONB, nullable=False)
+    expires_at = Column(DateTime(timezone=True), index=True)
+
 async def async_main():
+  from database.migrations import ensure_schema
+
   async with engine.begin() as conn:
-    await conn.run_sync(Base.metadata.create_all) 
+    await ensure_schema(conn)
   print("Таблицы успешно созданы!")
 
 if __name__ == "__main__":
@@ -0,0 +1,420 @@
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional
+import argparse
+import asyncio
+import logging
+import os
+import re
+import sys
+
+from decouple import config
+
+
+logger = logging.getLogger(__name__)
+
+# Секционирование video_snapshots по времени замера: day, month или off.
+# Секции создаются импортом по мере появления новых дат
+SNAPSHOT_PARTITIONING = config('SNAPSHOT_PARTITIONING', default='month').lower()
+SNAPSHOT_PARTITIONED = SNAPSHOT_PARTITIONING in ('day', 'month')
+
+SNAPSHOTS_TABLE = 'video_snapshots'
+# Дневные агрегаты по снимкам (database/rollups.py): при отсоединении секции чистятся за ее дни
+ROLLUP_TABLES = ('daily_video_stats', 'daily_creator_stats', 'daily_totals')
+
+# Создание секций сериализуется между процессами импорта
+PARTITION_LOCK_SQL = "SELECT pg_advisory_xact_lock(80020802)"
+
+IS_PARTITIONED_SQL = f"""
+    SELECT EXISTS (
+        SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('{SNAPSHOTS_TABLE}')
+    )
+"""
+
+# Секции и их границы: FOR VALUES FROM ('2025-11-01 00:00:00') TO ('2025-12-01 00:00:00')
+LIST_PARTITIONS_SQL = f"""
+    SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound,
+           GREATEST(c.reltuples, 0)::bigint AS rows
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = to_regclass('{SNAPSHOTS_TABLE}')
+    ORDER BY c.relname
+"""
+
+_BOUND_RE = re.compile(r"FROM \('(\d{4}-\d{2}-\d{2})[^']*'\) TO \('(\d{4}-\d{2}-\d{2})[^']*'\)")
+
+
+def partition_start(moment, granularity: str = SNAPSHOT_PARTITIONING) -> date:
+    """Начало секции, в которую попадает момент времени"""
+    day = moment.date() if isinstance(moment, datetime) else moment
+    return day.replace(day=1) if granularity == 'month' else day
+
+
+def partition_end(start: date, granularity: str = SNAPSHOT_PARTITIONING) -> date:
+    """Начало следующей секции"""
+    if granularity == 'month':
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def partition_name(start: date, granularity: str = SNAPSHOT_PARTITIONING) -> str:
+    suffix = start.strftime('%Y%m') if granularity == 'month' else start.strftime('%Y%m%d')
+    return f"{SNAPSHOTS_TABLE}_p{suffix}"
+
+
+def create_partition_sql(start: date, granularity: str = SNAPSHOT_PARTITIONING) -> str:
+    end = partition_end(start, granularity)
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(start, granularity)} "
+        f"PARTITION OF {SNAPSHOTS_TABLE} FOR VALUES FROM ('{start}') TO ('{end}')"
+    )
+
+
+def parse_bound(bound: str) -> Optional[tuple]:
+    """Границы секции (start, end) из pg_get_expr(relpartbound) или None"""
+    match = _BOUND_RE.search(bound or '')
+    if not match:
+        return None
+    return date.fromisoformat(match[1]), date.fromisoformat(match[2])
+
+
+async def list_partitions(driver) -> list:
+    """Секции video_snapshots: список (name, start, end, rows) по возрастанию дат"""
+    partitions = []
+    for row in await driver.fetch(LIST_PARTITIONS_SQL):
+        bounds = parse_bound(row['bound'])
+        if bounds is not None:
+            partitions.append((row['name'], bounds[0], bounds[1], row['rows']))
+    return sorted(partitions, key=lambda item: item[1])
+
+
+class PartitionManager:
+    """Создает недостающие секции video_snapshots перед записью снимков
+
+    Известные секции запоминаются в процессе, поэтому запрос к каталогу
+    и DDL выполняются, только когда в пачке появилась новая дата.
+    Секции создаются в отдельной короткой транзакции: блокировка таблицы
+    на время DDL не держится до конца записи пачки.
+    """
+
+    def __init__(self, granularity: str = SNAPSHOT_PARTITIONING):
+        self.granularity = granularity
+        self.enabled = granularity in ('day', 'month')
+        self.known = set()
+        self._partitioned: Optional[bool] = None
+
+    async def _load(self, driver) -> bool:
+        self._partitioned = bool(await driver.fetchval(IS_PARTITIONED_SQL))
+        if not self._partitioned:
+            logger.warning(
+                f"Таблица {SNAPSHOTS_TABLE} не секционирована; перенести данные в секции: "
+                f"python -m database.partitions migrate"
+            )
+            return False
+        self.known = {start for _, start, _, _ in await list_partitions(driver)}
+        return True
+
+    async def ensure(self, driver, moments: Iterable) -> int:
+        """Создает секции для моментов времени (соединение asyncpg вне транзакции)
+
+        Возвращает число созданных секций.
+        """
+        if not self.enabled or self._partitioned is False:
+            return 0
+        starts = {partition_start(moment, self.granularity) for moment in moments if moment is not None}
+        missing = starts - self.known
+        if not missing:
+            return 0
+        if self._partitioned is None and not await self._load(driver):
+            return 0
+        missing = starts - self.known
+        if not missing:
+            return 0
+
+        async with driver.transaction():
+            await driver.execute(PARTITION_LOCK_SQL)
+            for start in sorted(missing):
+                await driver.execute(create_partition_sql(start, self.granularity))
+        self.known |= missing
+        logger.info(f"Созданы секции {SNAPSHOTS_TABLE}: {', '.join(str(start) for start in sorted(missing))}")
+        return len(missing)
+
+    def forget(self, starts: Iterable[date]):
+        """Секции отсоединены: при появлении их дат они будут созданы заново"""
+        self.known -= set(starts)
+
+
+# Секции, известные этому процессу
+snapshot_partitions = PartitionManager()
+
+
+# Переписывание условий по дню на диапазон по created_at.
+# DATE(created_at) = '2025-11-28' не дает отсечь секции и использовать индекс,
+# а created_at >= '2025-11-28' AND created_at < '2025-11-29' — дает.
+
+# После значения не должно идти выражение (+ 1, ::text): такое условие не переписывается
+_DAY_VALUE = (
+    r"(?:(?:DATE\s*)?'(?P<{name}>\d{{4}}-\d{{2}}-\d{{2}})'(?:\s*::\s*date)?|:(?P<{name}_param>\w+)\b)"
+    r"(?!\s*(?:[-+*/%^|]|::))"
+)
+_DAY_COLUMN = (
+    r"(?:DATE\s*\(\s*(?P<c1>(?:\w+\.)?created_at)\s*\)"
+    r"|CAST\s*\(\s*(?P<c2>(?:\w+\.)?created_at)\s+AS\s+DATE\s*\)"
+    r"|(?<![\w.])(?P<c3>(?:\w+\.)?created_at)\s*::\s*date)"
+)
+_DAY_CONDITION_RE = re.compile(
+    rf"{_DAY_COLUMN}\s*(?:"
+    rf"(?P<op>>=|<=|=|>|<)\s*{_DAY_VALUE.format(name='value')}"
+    rf"|BETWEEN\s+{_DAY_VALUE.format(name='low')}\s+AND\s+{_DAY_VALUE.format(name='high')})",
+    re.IGNORECASE,
+)
+
+_OPERATOR_BEFORE_RE = re.compile(r"(?:[-+*/%^|]|::)\s*$")
+
+
+def _day_value(match, name: str, params: dict) -> Optional[tuple]:
+    """День из литерала или параметра: (date, параметр или None)"""
+    literal = match[name]
+    param = match[f'{name}_param']
+    try:
+        if literal is not None:
+            return date.fromisoformat(literal), None
+        value = params.get(param)
+        if isinstance(value, datetime):
+            return None
+        if isinstance(value, str):
+            value = date.fromisoformat(value)
+        if isinstance(value, date):
+            return value, param
+    except ValueError:
+        pass
+    return None
+
+
+def _bound(day: date, param: Optional[str], next_day: bool, extra: dict) -> str:
+    if next_day:
+        day += timedelta(days=1)
+    if param is None:
+        return f"TIMESTAMP '{day}'"
+    # Параметр asyncpg для сравнения с timestamp должен быть datetime
+    name = f"{param}_{'end' if next_day else 'start'}"
+    extra[name] = datetime.combine(day, datetime.min.time())
+    return f":{name}"
+
+
+def rewrite_for_pruning(sql_query: str, params: Optional[dict] = None) -> Optional[tuple]:
+    """Заменяет условия на день по created_at диапазонами: (sql, params) или None
+
+    Диапазон по самой колонке позволяет Postgres отсечь лишние секции
+    video_snapshots и использовать индекс по created_at. Условия с другими
+    выражениями в правой части не переписываются.
+    """
+    params = params or {}
+    extra = {}
+
+    def replace(match):
+        # Колонка — часть выражения (x + DATE(created_at) = ...): условие не переписывается
+        if _OPERATOR_BEFORE_RE.search(match.string, 0, match.start()):
+            return match[0]
+        column = match['c1'] or match['c2'] or match['c3']
+        op = match['op']
+        if op is not None:
+            value = _day_value(match, 'value', params)
+            if value is None:
+                return match[0]
+            day, param = value
+            if op == '=':
+                return (f"({column} >= {_bound(day, param, False, extra)} "
+                        f"AND {column} < {_bound(day, param, True, extra)})")
+            if op == '>=':
+                return f"{column} >= {_bound(day, param, False, extra)}"
+            if op == '>':
+                return f"{column} >= {_bound(day, param, True, extra)}"
+            if op == '<=':
+                return f"{column} < {_bound(day, param, True, extra)}"
+            return f"{column} < {_bound(day, param, False, extra)}"
+
+        low = _day_value(match, 'low', params)
+        high = _day_value(match, 'high', params)
+        if low is None or high is None:
+            return match[0]
+        return (f"({column} >= {_bound(*low, False, extra)} "
+                f"AND {column} < {_bound(*high, True, extra)})")
+
+    if SNAPSHOTS_TABLE not in sql_query.lower():
+        return None
+    rewritten = _DAY_CONDITION_RE.sub(replace, sql_query)
+    if rewritten == sql_query:
+        return None
+    # Параметры, которые больше не встречаются в запросе, не передаются
+    params = {
+        name: value for name, value in {**params, **extra}.items()
+        if re.search(rf':{re.escape(name)}\b', rewritten)
+    }
+    return rewritten, params
+
+
+# Обслуживание секций из командной строки
+
+async def _create(driver, manager: PartitionManager, date_from: date, date_to: date):
+    moments = []
+    day = date_from
+    while day <= date_to:
+        moments.append(day)
+        day += timedelta(days=1)
+    created = await manager.ensure(driver, moments)
+    logger.info(f"Создано секций: {created}")
+
+
+async def _detach(driver, before: date, archive: Optional[str], drop: bool, concurrently: bool):
+    """Отсоединяет секции, целиком лежащие раньше before, и при необходимости выгружает их в CSV
+
+    Отсоединенная секция остается обычной таблицей: ее можно вернуть через
+    ATTACH PARTITION. Дневные агрегаты за эти дни удаляются вместе с ней,
+    чтобы запросы по агрегатам и по снимкам отвечали одинаково; после
+    возврата секции их пересчитывает refresh_rollups(driver, AFFECTED_ALL).
+    """
+    from database.generation import bump_generation, notify_generation
+    from database.rollups import ROLLUP_LOCK_SQL
+
+    detached = [item for item in await list_partitions(driver) if item[2] <= before]
+    if not detached:
+        logger.info(f"Нет секций раньше {before}")
+        return
+    if archive:
+        os.makedirs(archive, exist_ok=True)
+
+    for name, start, end, rows in detached:
+        # CONCURRENTLY не блокирует запросы к таблице, но не выполняется в транзакции
+        mode = ' CONCURRENTLY' if concurrently else ''
+        await driver.execute(f"ALTER TABLE {SNAPSHOTS_TABLE} DETACH PARTITION {name}{mode}")
+        logger.info(f"Секция {name} ({start} — {end}, ~{rows} строк) отсоединена")
+        async with driver.transaction():
+            await driver.execute(ROLLUP_LOCK_SQL)
+            for table in ROLLUP_TABLES:
+                await driver.execute(f"DELETE FROM {table} WHERE day >= $1 AND day < $2", start, end)
+        logger.info(f"Дневные агрегаты за {start} — {end} удалены")
+        if archive:
+            path = os.path.join(archive, f"{name}.csv")
+            await driver.copy_from_table(name, output=path, format='csv', header=True)
+            logger.info(f"Секция {name} выгружена в {path}")
+        if drop:
+            await driver.execute(f"DROP TABLE {name}")
+            logger.info(f"Таблица {name} удалена")
+
+    snapshot_partitions.forget(start for _, start, _, _ in detached)
+    # Снимков стало меньше: кэши результатов и колонки в других процессах устарели
+    async with driver.transaction():
+        await notify_generation(driver)
+    bump_generation()
+
+
+# Перенос несекционированной таблицы в секционированную одной транзакцией
+MIGRATE_RENAME_SQL = (
+    f"ALTER TABLE {SNAPSHOTS_TABLE} RENAME TO {SNAPSHOTS_TABLE}_flat",
+    f"ALTER TABLE {SNAPSHOTS_TABLE}_flat RENAME CONSTRAINT {SNAPSHOTS_TABLE}_pkey TO {SNAPSHOTS_TABLE}_flat_pkey",
+    f"ALTER TABLE {SNAPSHOTS_TABLE}_flat RENAME CONSTRAINT uq_video_snapshots_video_created "
+    f"TO uq_video_snapshots_flat_video_created",
+    f"ALTER TABLE {SNAPSHOTS_TABLE}_flat RENAME CONSTRAINT {SNAPSHOTS_TABLE}_video_id_fkey "
+    f"TO {SNAPSHOTS_TABLE}_flat_video_id_fkey",
+    f"ALTER INDEX IF EXISTS ix_{SNAPSHOTS_TABLE}_video_id RENAME TO ix_{SNAPSHOTS_TABLE}_flat_video_id",
+    f"ALTER INDEX IF EXISTS ix_{SNAPSHOTS_TABLE}_created_at RENAME TO ix_{SNAPSHOTS_TABLE}_flat_created_at",
+)
+
+MIGRATE_RANGE_SQL = f"SELECT MIN(created_at), MAX(created_at) FROM {SNAPSHOTS_TABLE}_flat"
+
+
+def _create_table_sql() -> list:
+    """DDL секционированной таблицы снимков по модели (с индексами)"""
+    from sqlalchemy.dialects import postgresql
+    from sqlalchemy.schema import CreateIndex, CreateTable
+    from database.models import VideoSnapshot
+
+    table = VideoSnapshot.__table__
+    dialect = postgresql.dialect()
+    statements = [str(CreateTable(table).compile(dialect=dialect))]
+    statements += [str(CreateIndex(index).compile(dialect=dialect)) for index in table.indexes]
+    return statements
+
+
+async def _migrate(driver, keep_old: bool):
+    """Переносит снимки из обычной таблицы в секционированную (SNAPSHOT_PARTITIONING)"""
+    from database.transform import SNAPSHOT_COLUMNS
+
+    if not SNAPSHOT_PARTITIONED:
+        logger.error("Секционирование выключено (SNAPSHOT_PARTITIONING=off)")
+        return False
+    if await driver.fetchval(IS_PARTITIONED_SQL):
+        logger.info(f"Таблица {SNAPSHOTS_TABLE} уже секционирована")
+        return False
+
+    columns = ', '.join(SNAPSHOT_COLUMNS)
+    async with driver.transaction():
+        for statement in MIGRATE_RENAME_SQL:
+            await driver.execute(statement)
+        for statement in _create_table_sql():
+            await driver.execute(statement)
+
+        first, last = await driver.fetchrow(MIGRATE_RANGE_SQL)
+        if first is not None:
+            start = partition_start(first)
+            while start <= last.date():
+                await driver.execute(create_partition_sql(start))
+                start = partition_end(start)
+        status = await driver.execute(
+            f"INSERT INTO {SNAPSHOTS_TABLE} ({columns}) SELECT {columns} FROM {SNAPSHOTS_TABLE}_flat"
+        )
+        if not keep_old:
+            await driver.execute(f"DROP TABLE {SNAPSHOTS_TABLE}_flat")
+    await driver.execute(f"ANALYZE {SNAPSHOTS_TABLE}")
+    logger.info(f"Снимки перенесены в секционированную таблицу: {status.split()[-1]} строк")
+    return True
+
+
+async def main_partitions(args):
+    from database.bulk_load import get_driver_connection
+    from database.generation import notify_generation
+    from database.models import engine
+
+    async with engine.connect() as conn:
+        # Автофиксация: DETACH CONCURRENTLY не выполняется внутри транзакции
+        conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+        driver = await get_driver_connection(conn)
+        if args.command == 'list':
+            partitions = await list_partitions(driver)
+            for name, start, end, rows in partitions:
+                print(f"{name}\t{start} — {end}\t~{rows} строк")
+            if not partitions:
+                print(f"Секций нет (таблица {SNAPSHOTS_TABLE} не секционирована или пуста)")
+        elif args.command == 'create':
+            await _create(driver, snapshot_partitions, args.date_from, args.date_to)
+        elif args.command == 'detach':
+            await _detach(driver, args.before, args.archive, args.drop, args.concurrently)
+        elif args.command == 'migrate' and await _migrate(driver, args.keep_old):
+            # Снимки не менялись, но изменилась таблица: колонки и кэши перечитываются
+            async with driver.transaction():
+                await notify_generation(driver)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=f"Обслуживание секций {SNAPSHOTS_TABLE}")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help="секции, их границы и оценка числа строк")
+    create = commands.add_parser('create', help="заранее создать секции за период")
+    create.add_argument('--from', dest='date_from', type=date.fromisoformat, required=True)
+    create.add_argument('--to', dest='date_to', type=date.fromisoformat, required=True)
+    detach = commands.add_parser('detach', help="отсоединить секции, целиком лежащие раньше даты")
+    detach.add_argument('--before', type=date.fromisoformat, required=True)
+    detach.add_argument('--archive', help="каталог для выгрузки отсоединенных секций в CSV")
+    detach.add_argument('--drop', action='store_true', help="удалить отсоединенные таблицы")
+    detach.add_argument('--concurrently', action='store_true',
+                        help="DETACH PARTITION CONCURRENTLY (Postgres 14+), не блокирует запросы")
+    migrate = commands.add_parser('migrate', help="перенести существующие снимки в секционированную таблицу")
+    migrate.add_argument('--keep-old', action='store_true',
+                         help=f"оставить прежнюю таблицу как {SNAPSHOTS_TABLE}_flat")
+    args = parser.parse_args()
+
+    asyncio.run(main_partitions(args))
@@ -0,0 +1,218 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from itertools import islice
+import asyncio
+import logging
+import time
+
+from database.bulk_load import copy_batch, refresh_affected
+from database.progress import import_progress
+from database.transform import transform_chunk
+
+
+logger = logging.getLogger(__name__)
+
+# Признак конца потока в очередях
+_DONE = None
+
+
+@dataclass
+class StageStats:
+    """Счетчики производительности одной стадии конвейера"""
+    name: str
+    records: int = 0
+    rows: int = 0
+    busy: float = 0.0
+    started: float = field(default_factory=time.perf_counter)
+    finished: float = 0.0
+
+    def add(self, records: int, rows: int, seconds: float):
+        self.records += records
+        self.rows += rows
+        self.busy += seconds
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.name}: {self.records} записей, {self.rows} строк за {self.elapsed:.1f} с "
+            f"({self.rows_per_second:.0f} строк/с, занято {self.busy:.1f} с)"
+        )
+
+
+@dataclass
+class PipelineResult:
+    """Итоги работы конвейера импорта"""
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+    errors: int = 0
+    stages: list = field(default_factory=list)
+
+
+def _record_rows(records: list) -> int:
+    """Количество строк таблиц (видео + снимки) в пачке"""
+    return sum(1 + len(record.snapshot_rows) for record in records)
+
+
+async def _reader(videos_data, batch_size: int, out_queue: asyncio.Queue, consumers: int, stats: StageStats):
+    """Читает сырые записи пачками; разбор JSON выполняется в отдельном потоке"""
+    loop = asyncio.get_running_loop()
+    iterator = iter(videos_data)
+    start_idx = 0
+
+    try:
+        while True:
+            started = time.perf_counter()
+            chunk = await loop.run_in_executor(None, lambda: list(islice(iterator, batch_size)))
+            if not chunk:
+                break
+            stats.add(len(chunk), len(chunk), time.perf_counter() - started)
+            await out_queue.put((start_idx, chunk))
+            start_idx += len(chunk)
+    finally:
+        stats.finish()
+        for _ in range(consumers):
+            await out_queue.put(_DONE)
+
+
+async def _transformer(pool, in_queue: asyncio.Queue, out_queue: asyncio.Queue, result: PipelineResult,
+                       stats: StageStats):
+    """Преобразует пачки в строки таблиц в пуле процессов"""
+    loop = asyncio.get_running_loop()
+
+    while True:
+        item = await in_queue.get()
+        if item is _DONE:
+            return
+        start_idx, chunk = item
+
+        started = time.perf_counter()
+        records, errors = await loop.run_in_executor(pool, transform_chunk, chunk, start_idx)
+        stats.add(len(chunk), _record_rows(records), time.perf_counter() - started)
+
+        for message in errors:
+            logger.error(message)
+        result.errors += len(errors)
+        import_progress.add(0, len(errors))
+
+        if records:
+            await out_queue.put(records)
+
+
+async def _writer(engine, in_queue: asyncio.Queue, result: PipelineResult, incremental: bool, stats: StageStats,
+                  affected: set):
+    """Загружает пачки в базу через собственное соединение из пула
+
+    Агрегаты не пересчитываются: затронутые дни копятся в affected.
+    """
+    async with engine.connect() as conn:
+        while True:
+            records = await in_queue.get()
+            if records is _DONE:
+                return
+
+            started = time.perf_counter()
+            try:
+                inserted, updated, skipped, snapshots = await copy_batch(conn, records, incremental, affected)
+            except Exception as e:
+                # Пачка откатывается целиком
+                logger.error(f"Ошибка при загрузке пачки из {len(records)} видео: {e}")
+                result.errors += len(records)
+                import_progress.add(0, len(records))
+                continue
+
+            stats.add(len(records), inserted + updated + snapshots, time.perf_counter() - started)
+            result.inserted += inserted
+            result.updated += updated
+            result.skipped += skipped
+            import_progress.add(inserted + updated + skipped)
+            logger.info(
+                f"Промежуточный коммит: обработано {result.inserted + result.updated + result.skipped} видео "
+                f"(+{snapshots} снимков)"
+            )
+
+
+async def _close_queue(queue: asyncio.Queue, consumers: int):
+    for _ in range(consumers):
+        await queue.put(_DONE)
+
+
+async def _wait_stage(tasks: list, watched: list = ()):
+    """Ждет завершения задач стадии
+
+    Исключение любой из задач стадии или наблюдаемых задач других стадий
+    прерывает ожидание сразу, а не после завершения остальных.
+    """
+    pending = set(tasks) | set(watched)
+    while not all(task.done() for task in tasks):
+        # FIRST_EXCEPTION дождался бы и наблюдаемых задач, которые завершаются
+        # только на следующей стадии, поэтому завершения проверяются по одному
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+
+
+async def run_pipeline(engine, videos_data, workers: int, writers: int, batch_size: int,
+                       incremental: bool = True) -> PipelineResult:
+    """Параллельный импорт: чтение -> преобразование в пуле процессов -> N писателей
+
+    Очереди между стадиями ограничены, поэтому быстрая стадия ждет медленную
+    и память не растет. Дневные агрегаты пересчитываются одним шагом после
+    писателей — в том числе после ошибки, по уже закоммиченным пачкам.
+    """
+    result = PipelineResult()
+    read_stats = StageStats('Чтение')
+    transform_stats = StageStats('Преобразование')
+    write_stats = StageStats('Запись')
+    result.stages = [read_stats, transform_stats, write_stats]
+
+    raw_queue = asyncio.Queue(maxsize=workers * 2)
+    rows_queue = asyncio.Queue(maxsize=writers * 2)
+    affected = set()
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            transformers = [
+                asyncio.create_task(_transformer(pool, raw_queue, rows_queue, result, transform_stats))
+                for _ in range(workers)
+            ]
+            writer_tasks = [
+                asyncio.create_task(_writer(engine, rows_queue, result, incremental, write_stats, affected))
+                for _ in range(writers)
+            ]
+            reader = asyncio.create_task(_reader(videos_data, batch_size, raw_queue, workers, read_stats))
+
+            closer = None
+            try:
+                # Писатели наблюдаются с самого начала: если все они упадут, очередь
+                # строк заполнится и преобразование будет ждать вечно
+                await _wait_stage([reader, *transformers], writer_tasks)
+                transform_stats.finish()
+                closer = asyncio.create_task(_close_queue(rows_queue, writers))
+                await _wait_stage([closer, *writer_tasks])
+                write_stats.finish()
+            except BaseException:
+                for task in (reader, *transformers, *writer_tasks, closer):
+                    if task is not None:
+                        task.cancel()
+                raise
+    finally:
+        # Пачки, закоммиченные до ошибки, тоже должны попасть в агрегаты
+        if affected:
+            async with engine.connect() as conn:
+                await refresh_affected(conn, affected)
+
+    for stage in result.stages:
+        logger.info(stage.summary())
+
+    return result
@@ -0,0 +1,330 @@
+from collections import Counter
+from dataclasses import dataclass, asdict, field
+from typing import Optional
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+
+from sqlalchemy import text
+
+
+logger = logging.getLogger(__name__)
+
+# Узлы с меньшей оценкой стоимости не считаются поводом для индекса
+MIN_NODE_COST = 1000.0
+
+# Колонки времени, для которых при диапазонных условиях предлагается BRIN
+TIME_COLUMNS = ('created_at', 'video_created_at', 'updated_at')
+
+_DATE_EXPR_RE = re.compile(r'\bdate\((\w+)\)', re.IGNORECASE)
+_COMPARISON_RE = re.compile(r'\(?(\w+)\s*(=|<>|>=|<=|>|<)\s*', re.IGNORECASE)
+_INDEX_KEYS_RE = re.compile(r'USING\s+(\w+)\s+\((.*)\)', re.IGNORECASE)
+
+# Секции секционированных таблиц: в планах EXPLAIN они видны под своими именами
+PARTITIONS_SQL = """
+    SELECT p.relname AS parent, c.relname AS partition
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    JOIN pg_class p ON p.oid = i.inhparent
+    JOIN pg_namespace n ON n.oid = p.relnamespace
+    WHERE p.relkind = 'p' AND n.nspname = current_schema()
+    ORDER BY c.relname
+"""
+
+
+@dataclass
+class IndexRecommendation:
+    """Рекомендуемый индекс и статистика запросов, которым он помог бы"""
+    table: str
+    name: str
+    method: str
+    keys: str
+    reason: str
+    hits: int = 0
+    total_cost: float = 0.0
+    # Секции, если table секционирована
+    partitions: list = field(default_factory=list)
+
+    def ddl(self) -> list:
+        """Команды создания индекса
+
+        CREATE INDEX CONCURRENTLY не выполняется на секционированной таблице:
+        индекс создается на ней самой (ON ONLY, без построения), на каждой
+        секции — CONCURRENTLY и присоединяется к нему. Новые секции получают
+        индекс автоматически.
+        """
+        using = f"USING {self.method} ({self.keys})"
+        if not self.partitions:
+            return [f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {self.name} ON {self.table} {using}"]
+        suffix = self.name[len(f'ix_{self.table}_'):] if self.name.startswith(f'ix_{self.table}_') else self.name
+        statements = [f"CREATE INDEX IF NOT EXISTS {self.name} ON ONLY {self.table} {using}"]
+        for partition in self.partitions:
+            child = f"ix_{partition}_{suffix}"[:63]
+            statements.append(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child} ON {partition} {using}")
+            statements.append(f"ALTER INDEX {self.name} ATTACH PARTITION {child}")
+        return statements
+
+
+@dataclass
+class PlanShape:
+    """Форма плана (дерево типов узлов) и её суммарная стоимость"""
+    shape: str
+    count: int = 0
+    total_cost: float = 0.0
+    example_sql: str = ''
+
+
+async def partitions_of(conn) -> dict:
+    """Секции секционированных таблиц по pg_inherits: {таблица: [секции]}"""
+    result = await conn.execute(text(PARTITIONS_SQL))
+    partitions = {}
+    for parent, partition in result:
+        partitions.setdefault(parent, []).append(partition)
+    return partitions
+
+
+def _normalize_keys(keys: str) -> str:
+    """Ключи индекса для сравнения: без пробелов и без скобок вокруг одиночного выражения"""
+    keys = re.sub(r'\s+', '', keys).lower()
+    if keys.startswith('(') and keys.endswith(')') and ',' not in keys:
+        keys = keys[1:-1]
+    return keys
+
+
+def _walk(node: dict):
+    yield node
+    for child in node.get('Plans', []):
+        yield from _walk(child)
+
+
+def plan_shape(node: dict) -> str:
+    """Компактная запись дерева плана: Aggregate(Seq Scan[video_snapshots])"""
+    label = node.get('Node Type', '?')
+    if node.get('Relation Name'):
+        label += f"[{node['Relation Name']}]"
+    children = node.get('Plans', [])
+    if children:
+        label += '(' + ', '.join(plan_shape(child) for child in children) + ')'
+    return label
+
+
+async def explain(conn, sql_query: str, params: Optional[dict] = None) -> dict:
+    """Возвращает корневой узел плана EXPLAIN (FORMAT JSON) без выполнения запроса"""
+    result = await conn.execute(text(f'EXPLAIN (FORMAT JSON) {sql_query}'), params or {})
+    plan = result.scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+
+class PlanAdvisor:
+    """Собирает планы сгенерированных запросов и предлагает индексы"""
+
+    def __init__(self, min_cost: float = MIN_NODE_COST, path: Optional[str] = None):
+        self.min_cost = min_cost
+        self.path = path or None
+        self.shapes = {}
+        self.recommendations = {}
+        self.node_types = Counter()
+        if self.path:
+            self.load()
+
+    def record(self, sql_query: str, plan: dict):
+        """Учитывает план одного запроса"""
+        shape = plan_shape(plan)
+        entry = self.shapes.setdefault(shape, PlanShape(shape, example_sql=sql_query))
+        entry.count += 1
+        entry.total_cost += plan.get('Total Cost', 0.0)
+
+        for node in _walk(plan):
+            self.node_types[node.get('Node Type', '?')] += 1
+            if node.get('Node Type') == 'Seq Scan' and node.get('Total Cost', 0.0) >= self.min_cost:
+                for recommendation in self._recommend_for_scan(node):
+                    stored = self.recommendations.setdefault(recommendation.name, recommendation)
+                    stored.hits += 1
+                    stored.total_cost += node.get('Total Cost', 0.0)
+
+    def _recommend_for_scan(self, node: dict) -> list:
+        """Индексы, которые позволили бы не сканировать таблицу целиком"""
+        table = node.get('Relation Name')
+        condition = node.get('Filter', '')
+        if not table or not condition:
+            return []
+
+        recommendations = []
+        compared = {match[1].lower(): match[2] for match in _COMPARISON_RE.finditer(condition)}
+
+        # DATE(col) = ... не использует btree по col — нужен индекс по выражению
+        for column in {match[1].lower() for match in _DATE_EXPR_RE.finditer(condition)}:
+            recommendations.append(IndexRecommendation(
+                table, f'ix_{table}_{column}_date', 'btree', f'(date({column}))',
+                f'условие по DATE({column})',
+            ))
+
+        # Выборка по видео и времени — составной индекс
+        if 'video_id' in compared and 'created_at' in compared:
+            recommendations.append(IndexRecommendation(
+                table, f'ix_{table}_video_id_created_at', 'btree', 'video_id, created_at',
+                'условие по video_id и created_at',
+            ))
+
+        # Диапазоны по времени на больших таблицах — компактный BRIN
+        for column in TIME_COLUMNS:
+            if compared.get(column) in ('>', '>=', '<', '<='):
+                recommendations.append(IndexRecommendation(
+                    table, f'ix_{table}_{column}_brin', 'brin', column,
+                    f'диапазонное условие по {column}',
+                ))
+
+        # Прочие колонки с условиями — обычный btree
+        for column in compared:
+            if column in TIME_COLUMNS or column in ('video_id', 'date'):
+                continue
+            recommendations.append(IndexRecommendation(
+                table, f'ix_{table}_{column}', 'btree', column,
+                f'условие по {column}',
+            ))
+
+        return recommendations
+
+    def attach_partitions(self, partitions: dict):
+        """Переносит рекомендации с секций на секционированные таблицы
+
+        partitions — {таблица: [секции]} из partitions_of. Индекс на одной
+        секции не помог бы остальным и новым секциям, поэтому рекомендации
+        по секциям объединяются в рекомендацию для самой таблицы.
+        """
+        parents = {child: parent for parent, children in partitions.items() for child in children}
+        merged = {}
+        for recommendation in self.recommendations.values():
+            parent = parents.get(recommendation.table, recommendation.table)
+            name = recommendation.name
+            if parent != recommendation.table and name.startswith(f'ix_{recommendation.table}_'):
+                name = f'ix_{parent}_' + name[len(f'ix_{recommendation.table}_'):]
+            stored = merged.get(name)
+            if stored is None:
+                stored = merged[name] = IndexRecommendation(
+                    parent, name, recommendation.method, recommendation.keys, recommendation.reason,
+                    partitions=list(partitions.get(parent, [])),
+                )
+            stored.hits += recommendation.hits
+            stored.total_cost += recommendation.total_cost
+        self.recommendations = merged
+
+    async def existing_indexes(self, conn) -> set:
+        """Ключи уже существующих индексов: {(table, method, keys)}"""
+        result = await conn.execute(text(
+            "SELECT tablename, indexdef FROM pg_indexes WHERE schemaname = current_schema()"
+        ))
+        existing = set()
+        for table, indexdef in result:
+            match = _INDEX_KEYS_RE.search(indexdef)
+            if match:
+                existing.add((table, match[1].lower(), _normalize_keys(match[2])))
+        return existing
+
+    def report(self, existing: Optional[set] = None, min_hits: int = 1) -> list:
+        """Рекомендации, отсортированные по суммарной стоимости, без уже существующих индексов"""
+        existing = existing or set()
+        result = []
+        for recommendation in self.recommendations.values():
+            key = (recommendation.table, recommendation.method, _normalize_keys(recommendation.keys))
+            if recommendation.hits >= min_hits and key not in existing:
+                result.append(recommendation)
+        return sorted(result, key=lambda item: item.total_cost, reverse=True)
+
+    def migration_sql(self, recommendations: list) -> str:
+        """Текст миграции с рекомендованными индексами"""
+        lines = ['-- Индексы, рекомендованные по планам сгенерированных запросов']
+        for recommendation in recommendations:
+            lines.append(
+                f'-- {recommendation.reason}: {recommendation.hits} запросов, '
+                f'стоимость {recommendation.total_cost:.0f}'
+            )
+            lines.extend(statement + ';' for statement in recommendation.ddl())
+        return '\n'.join(lines) + '\n'
+
+    async def apply(self, engine, recommendations: list):
+        """Создает рекомендованные индексы (CONCURRENTLY, вне транзакции)"""
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+            for recommendation in recommendations:
+                for statement in recommendation.ddl():
+                    logger.info(f"Создание индекса: {statement}")
+                    await conn.execute(text(statement))
+
+    def load(self):
+        """Загружает накопленную статистику из файла"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось загрузить статистику планов из {self.path}: {e}")
+            return
+        self.shapes = {item['shape']: PlanShape(**item) for item in data.get('shapes', [])}
+        self.recommendations = {item['name']: IndexRecommendation(**item) for item in data.get('recommendations', [])}
+        self.node_types = Counter(data.get('node_types', {}))
+
+    def save(self):
+        """Сохраняет накопленную статистику в файл"""
+        data = {
+            'shapes': [asdict(shape) for shape in self.shapes.values()],
+            'recommendations': [asdict(item) for item in self.recommendations.values()],
+            'node_types': dict(self.node_types),
+        }
+        tmp_path = f'{self.path}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить статистику планов в {self.path}: {e}")
+
+
+async def main_advisor(path: str, apply: bool, output: Optional[str], min_hits: int):
+    """Печатает рекомендации по накопленной статистике и при необходимости применяет их"""
+    from database.models import engine
+
+    advisor = PlanAdvisor(path=path)
+    for shape in sorted(advisor.shapes.values(), key=lambda item: item.total_cost, reverse=True):
+        logger.info(f"{shape.count} x {shape.shape} (стоимость {shape.total_cost:.0f}): {shape.example_sql}")
+
+    async with engine.connect() as conn:
+        # Планы называют секции video_snapshots; индексы нужны на самой таблице
+        advisor.attach_partitions(await partitions_of(conn))
+        existing = await advisor.existing_indexes(conn)
+    recommendations = advisor.report(existing, min_hits=min_hits)
+
+    migration = advisor.migration_sql(recommendations)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(migration)
+        logger.info(f"Миграция записана в {output}")
+    else:
+        print(migration)
+
+    if apply and recommendations:
+        await advisor.apply(engine, recommendations)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from decouple import config
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Рекомендации индексов по планам сгенерированных запросов")
+    parser.add_argument('--path', default=config('PLAN_ADVISOR_PATH', default='data/plan_advisor.json'),
+                        help="файл накопленной статистики планов")
+    parser.add_argument('--min-hits', type=int, default=1, help="минимальное число запросов для рекомендации")
+    parser.add_argument('--output', help="записать миграцию в файл вместо вывода на экран")
+    parser.add_argument('--apply', action='store_true', help="создать рекомендованные индексы")
+    args = parser.parse_args()
+
+    asyncio.run(main_advisor(args.path, args.apply, args.output, args.min_hits))
@@ -0,0 +1,107 @@
+from typing import Optional
+import os
+import time
+
+
+class ImportProgress:
+    """Ход текущего импорта: доля прочитанного файла и обработанные видео
+
+    Импорт при запуске бота идет в фоне, и по этим данным бот сообщает
+    пользователям и в лог, сколько осталось.
+    """
+
+    IDLE = 'idle'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self):
+        self.state = self.IDLE
+        self.file_path: Optional[str] = None
+        self.total_bytes = 0
+        self.read_bytes = 0
+        self.processed = 0
+        self.errors = 0
+        self.started = 0.0
+        self.finished = 0.0
+        self.error: Optional[str] = None
+
+    def start(self, file_path: str):
+        self.__init__()
+        self.state = self.RUNNING
+        self.file_path = file_path
+        try:
+            self.total_bytes = os.path.getsize(file_path)
+        except OSError:
+            self.total_bytes = 0
+        self.started = time.monotonic()
+
+    def advance(self, chars: int):
+        """Прочитан очередной кусок файла (символы — почти байты: JSON в основном ASCII)"""
+        self.read_bytes += chars
+
+    def add(self, processed: int, errors: int = 0):
+        """Пачка записана (processed видео) или отброшена (errors видео)"""
+        self.processed += processed
+        self.errors += errors
+
+    def finish(self):
+        self.state = self.DONE
+        self.read_bytes = max(self.read_bytes, self.total_bytes)
+        self.finished = time.monotonic()
+
+    def fail(self, error: BaseException):
+        self.state = self.FAILED
+        self.error = str(error)
+        self.finished = time.monotonic()
+
+    @property
+    def running(self) -> bool:
+        return self.state == self.RUNNING
+
+    @property
+    def ratio(self) -> float:
+        if self.state == self.DONE:
+            return 1.0
+        if not self.total_bytes:
+            return 0.0
+        return min(1.0, self.read_bytes / self.total_bytes)
+
+    @property
+    def elapsed(self) -> float:
+        if not self.started:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    def eta(self) -> Optional[float]:
+        """Оценка оставшегося времени в секундах по скорости чтения файла"""
+        ratio = self.ratio
+        if not self.running or ratio <= 0.01:
+            return None
+        return self.elapsed * (1 - ratio) / ratio
+
+    def describe(self) -> str:
+        """Краткое описание для пользователя и лога"""
+        if self.state == self.IDLE:
+            return "импорт не запускался"
+        if self.state == self.FAILED:
+            return f"импорт завершился ошибкой: {self.error}"
+        text = f"загружено {self.ratio:.0%} ({self.processed} видео за {self.elapsed:.0f} с)"
+        eta = self.eta()
+        if eta is not None:
+            text += f", осталось примерно {max(1, round(eta / 60))} мин"
+        return text
+
+    def summary(self) -> dict:
+        return {
+            'state': self.state,
+            'ratio': round(self.ratio, 4),
+            'processed': self.processed,
+            'errors': self.errors,
+            'elapsed': round(self.elapsed, 1),
+            'eta': round(self.eta(), 1) if self.eta() is not None else None,
+        }
+
+
+# Импорт в этом процессе
+import_progress = ImportProgress()
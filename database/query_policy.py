@@ -0,0 +1,125 @@
+from collections import Counter
+from typing import Optional
+import logging
+
+from sqlalchemy import text
+from decouple import config
+
+
+logger = logging.getLogger(__name__)
+
+# Максимальное время выполнения одного запроса (мс), 0 — без ограничения
+QUERY_TIMEOUT_MS = config('QUERY_TIMEOUT_MS', default=5000, cast=int)
+# Запросы с оценкой стоимости EXPLAIN выше порога не выполняются, 0 — без проверки
+QUERY_MAX_COST = config('QUERY_MAX_COST', default=5000000, cast=float)
+# Сколько строк результата читается из курсора; больше — ошибка запроса
+QUERY_MAX_ROWS = config('QUERY_MAX_ROWS', default=1000, cast=int)
+
+# Причины отказа
+REASON_COST = 'cost'
+REASON_TIMEOUT = 'timeout'
+REASON_ROWS = 'rows'
+REASON_WRITE = 'write'
+REASON_SCHEMA = 'schema'
+
+# Коды ошибок Postgres
+SQLSTATE_QUERY_CANCELED = '57014'
+SQLSTATE_READ_ONLY = '25006'
+
+USER_MESSAGES = {
+    REASON_COST: "Запрос получился слишком тяжелым для базы. Попробуйте уточнить вопрос: период, креатора или видео.",
+    REASON_TIMEOUT: "Запрос выполнялся слишком долго и был остановлен. Попробуйте уточнить вопрос.",
+    REASON_ROWS: "Запрос вернул слишком много строк вместо одного ответа. Попробуйте переформулировать вопрос.",
+    REASON_WRITE: "Запрос пытался изменить данные и был отклонен.",
+    REASON_SCHEMA: "Запрос обращается к данным, которые бот не использует. Попробуйте переформулировать вопрос.",
+}
+
+
+class QueryRejected(Exception):
+    """Запрос нарушил политику выполнения; user_message можно показать пользователю"""
+
+    def __init__(self, reason: str, detail: str = ''):
+        self.reason = reason
+        self.detail = detail
+        self.user_message = USER_MESSAGES.get(reason, "Запрос отклонен.")
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+
+
+def _sqlstate(error: BaseException) -> Optional[str]:
+    """Код ошибки Postgres из исключения SQLAlchemy/asyncpg"""
+    for candidate in (getattr(error, 'orig', None), error.__cause__, error):
+        code = getattr(candidate, 'sqlstate', None) or getattr(candidate, 'pgcode', None)
+        if code:
+            return code
+    return None
+
+
+class QueryPolicy:
+    """Ограничения на выполнение сгенерированных запросов
+
+    Запрос выполняется в транзакции только для чтения с statement_timeout,
+    заранее проверяется по оценке стоимости EXPLAIN, а строки результата
+    читаются из курсора не больше max_rows + 1.
+    """
+
+    def __init__(self, timeout_ms: int = QUERY_TIMEOUT_MS, max_cost: float = QUERY_MAX_COST,
+                 max_rows: int = QUERY_MAX_ROWS):
+        self.timeout_ms = timeout_ms
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.executed = 0
+        self.violations = Counter()
+
+    @property
+    def needs_plan(self) -> bool:
+        return self.max_cost > 0
+
+    async def begin(self, conn):
+        """Настраивает транзакцию соединения: только чтение и ограничение времени"""
+        await conn.execute(text('SET TRANSACTION READ ONLY'))
+        if self.timeout_ms > 0:
+            # SET не принимает параметры; значение — целое число из настроек
+            await conn.execute(text(f'SET LOCAL statement_timeout = {int(self.timeout_ms)}'))
+
+    def check_plan(self, sql_query: str, plan: dict):
+        """Отклоняет запрос, если оценка стоимости плана выше порога"""
+        cost = plan.get('Total Cost', 0.0)
+        if self.max_cost > 0 and cost > self.max_cost:
+            self._reject(REASON_COST, f"стоимость {cost:.0f} > {self.max_cost:.0f}", sql_query)
+
+    async def fetch(self, conn, sql_query: str, params: Optional[dict] = None) -> list:
+        """Выполняет запрос и читает не больше max_rows строк через серверный курсор"""
+        result = await conn.stream(text(sql_query), params or {})
+        try:
+            rows = await result.fetchmany(self.max_rows + 1)
+        finally:
+            await result.close()
+        if len(rows) > self.max_rows:
+            self._reject(REASON_ROWS, f"больше {self.max_rows} строк", sql_query)
+        self.executed += 1
+        return rows
+
+    def classify(self, error: BaseException, sql_query: str) -> Optional[QueryRejected]:
+        """QueryRejected для ошибок, вызванных ограничениями политики, иначе None"""
+        code = _sqlstate(error)
+        if code == SQLSTATE_QUERY_CANCELED:
+            reason = REASON_TIMEOUT
+        elif code == SQLSTATE_READ_ONLY:
+            reason = REASON_WRITE
+        else:
+            return None
+        self.violations[reason] += 1
+        logger.warning(f"Запрос отклонен ({reason}): {sql_query}")
+        return QueryRejected(reason, str(error))
+
+    def _reject(self, reason: str, detail: str, sql_query: str):
+        self.violations[reason] += 1
+        logger.warning(f"Запрос отклонен ({reason}, {detail}): {sql_query}")
+        raise QueryRejected(reason, detail)
+
+    def stats(self) -> dict:
+        return {
+            'executed': self.executed,
+            **{f'rejected_{reason}': self.violations[reason]
+               for reason in (REASON_COST, REASON_TIMEOUT, REASON_ROWS, REASON_WRITE, REASON_SCHEMA)},
+        }
@@ -0,0 +1,133 @@
+from collections import OrderedDict
+from typing import Optional
+import hashlib
+import json
+import re
+
+from database.generation import current_generation
+from database.kv_store import encode_value
+from monitoring.metrics import cache_lookups_total
+
+
+# Строковые литералы и идентификаторы в кавычках не меняем при канонизации
+_QUOTED_RE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+_SPACES_RE = re.compile(r'\s+')
+_PUNCT_SPACES_RE = re.compile(r'\s*([(),=<>+*/-])\s*')
+
+# Признак промаха (None — допустимый результат запроса)
+MISS = object()
+
+# Пространство имен результатов в общем хранилище
+SHARED_NAMESPACE = 'results'
+
+
+def canonicalize_sql(sql_query: str) -> str:
+    """Каноническая форма SQL для ключа кэша
+
+    Регистр, пробелы и завершающая точка с запятой не влияют на результат;
+    содержимое кавычек сохраняется как есть.
+    """
+    parts = _QUOTED_RE.split(sql_query.strip().rstrip(';'))
+    for idx in range(0, len(parts), 2):
+        part = _SPACES_RE.sub(' ', parts[idx].lower())
+        parts[idx] = _PUNCT_SPACES_RE.sub(r'\1', part)
+    return ''.join(parts).strip()
+
+
+class ResultCache:
+    """Кэш результатов запросов с вытеснением LRU
+
+    Каждая запись помнит поколение данных, на котором была получена.
+    После импорта поколение меняется, и старые записи перестают выдаваться.
+
+    С общим хранилищем (store) промахи проверяются и в нем. Ключ там включает
+    общее поколение данных (shared_generation), поэтому после импорта записи
+    других процессов тоже перестают совпадать и удаляются по ttl.
+    """
+
+    def __init__(self, maxsize: int = 1024, store=None, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.store = store
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        # ключ -> (поколение, результат)
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(sql_query: str, params=None):
+        return canonicalize_sql(sql_query), tuple(sorted((params or {}).items()))
+
+    def get(self, key):
+        """Возвращает результат или MISS"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            generation, value = entry
+            if generation == current_generation():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+        self.misses += 1
+        return MISS
+
+    def put(self, key, value, generation: int):
+        """Сохраняет результат, полученный на поколении generation"""
+        if generation != current_generation():
+            # Данные изменились, пока выполнялся запрос
+            return
+        self._entries[key] = (generation, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def shared_key(key, shared_generation: int) -> str:
+        digest = hashlib.sha1(json.dumps(encode_value(key), ensure_ascii=False).encode('utf-8')).hexdigest()
+        return f'{shared_generation}:{digest}'
+
+    async def lookup(self, key, shared_generation: Optional[int] = None):
+        """Как get, но при промахе проверяет общее хранилище"""
+        value = self.get(key)
+        if value is not MISS or self.store is None or shared_generation is None:
+            cache_lookups_total.inc(cache='result', result='hit' if value is not MISS else 'miss')
+            return value
+
+        generation = current_generation()
+        # Значение хранится в списке: None — допустимый результат, а не промах
+        stored = await self.store.get(SHARED_NAMESPACE, self.shared_key(key, shared_generation))
+        if stored is None:
+            cache_lookups_total.inc(cache='result', result='miss')
+            return MISS
+        value = stored[0]
+        self.put(key, value, generation)
+        self.misses -= 1
+        self.hits += 1
+        self.shared_hits += 1
+        cache_lookups_total.inc(cache='result', result='shared_hit')
+        return value
+
+    async def remember(self, key, value, generation: int, shared_generation: Optional[int] = None):
+        """Как put, но запись попадает и в общее хранилище"""
+        if generation != current_generation():
+            return
+        self.put(key, value, generation)
+        if self.store is not None and shared_generation is not None:
+            await self.store.set(SHARED_NAMESPACE, self.shared_key(key, shared_generation), [value], ttl=self.ttl)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'shared_hits': self.shared_hits,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,217 @@
+from typing import Optional
+import logging
+import re
+
+from sqlalchemy import text
+
+
+logger = logging.getLogger(__name__)
+
+# Пересчет агрегатов сериализуется: параллельные писатели иначе могли бы
+# перезаписать дневной итог значением, посчитанным без чужих строк
+ROLLUP_LOCK_SQL = "SELECT pg_advisory_xact_lock(80020801)"
+
+# Затронутые пары (video_id, day) в пачке импорта
+AFFECTED_FROM_STAGE = "SELECT DISTINCT video_id, CAST(created_at AS date) AS day FROM stage_snapshots"
+# Пары, накопленные писателями параллельного импорта (см. bulk_load.refresh_affected)
+AFFECTED_FROM_DAYS = "SELECT video_id, day FROM stage_rollup_days"
+# Все пары — для первоначального заполнения
+AFFECTED_ALL = "SELECT DISTINCT video_id, CAST(created_at AS date) AS day FROM video_snapshots"
+
+# Агрегаты по видео за день пересчитываются из снимков целиком,
+# поэтому повторный пересчет идемпотентен
+REFRESH_VIDEO_DAYS_SQL = """
+    WITH affected AS ({source})
+    INSERT INTO daily_video_stats (
+        video_id, day, creator_id,
+        delta_views_count, delta_likes_count, delta_reports_count,
+        snapshots_count, positive_views_snapshots
+    )
+    SELECT a.video_id, a.day, v.creator_id,
+           COALESCE(SUM(s.delta_views_count), 0),
+           COALESCE(SUM(s.delta_likes_count), 0),
+           COALESCE(SUM(s.delta_reports_count), 0),
+           COUNT(*),
+           COUNT(*) FILTER (WHERE s.delta_views_count > 0)
+    FROM affected a
+    JOIN video_snapshots s
+      ON s.video_id = a.video_id AND s.created_at >= a.day AND s.created_at < a.day + 1
+    JOIN videos v ON v.id = a.video_id
+    GROUP BY a.video_id, a.day, v.creator_id
+    ORDER BY a.video_id, a.day
+    ON CONFLICT (video_id, day) DO UPDATE SET
+        creator_id = EXCLUDED.creator_id,
+        delta_views_count = EXCLUDED.delta_views_count,
+        delta_likes_count = EXCLUDED.delta_likes_count,
+        delta_reports_count = EXCLUDED.delta_reports_count,
+        snapshots_count = EXCLUDED.snapshots_count,
+        positive_views_snapshots = EXCLUDED.positive_views_snapshots
+"""
+
+REFRESH_CREATOR_DAYS_SQL = """
+    WITH affected AS ({source}),
+    keys AS (
+        SELECT DISTINCT v.creator_id, a.day
+        FROM affected a
+        JOIN videos v ON v.id = a.video_id
+    )
+    INSERT INTO daily_creator_stats (
+        creator_id, day,
+        delta_views_count, delta_likes_count, delta_reports_count,
+        snapshots_count, videos_with_new_views
+    )
+    SELECT d.creator_id, d.day,
+           SUM(d.delta_views_count),
+           SUM(d.delta_likes_count),
+           SUM(d.delta_reports_count),
+           SUM(d.snapshots_count),
+           COUNT(*) FILTER (WHERE d.positive_views_snapshots > 0)
+    FROM daily_video_stats d
+    JOIN keys k ON k.creator_id = d.creator_id AND k.day = d.day
+    GROUP BY d.creator_id, d.day
+    ORDER BY d.creator_id, d.day
+    ON CONFLICT (creator_id, day) DO UPDATE SET
+        delta_views_count = EXCLUDED.delta_views_count,
+        delta_likes_count = EXCLUDED.delta_likes_count,
+        delta_reports_count = EXCLUDED.delta_reports_count,
+        snapshots_count = EXCLUDED.snapshots_count,
+        videos_with_new_views = EXCLUDED.videos_with_new_views
+"""
+
+REFRESH_TOTALS_SQL = """
+    WITH affected AS ({source})
+    INSERT INTO daily_totals (
+        day,
+        delta_views_count, delta_likes_count, delta_reports_count,
+        snapshots_count, videos_with_new_views
+    )
+    SELECT d.day,
+           SUM(d.delta_views_count),
+           SUM(d.delta_likes_count),
+           SUM(d.delta_reports_count),
+           SUM(d.snapshots_count),
+           COUNT(*) FILTER (WHERE d.positive_views_snapshots > 0)
+    FROM daily_video_stats d
+    WHERE d.day IN (SELECT day FROM affected)
+    GROUP BY d.day
+    ORDER BY d.day
+    ON CONFLICT (day) DO UPDATE SET
+        delta_views_count = EXCLUDED.delta_views_count,
+        delta_likes_count = EXCLUDED.delta_likes_count,
+        delta_reports_count = EXCLUDED.delta_reports_count,
+        snapshots_count = EXCLUDED.snapshots_count,
+        videos_with_new_views = EXCLUDED.videos_with_new_views
+"""
+
+REFRESH_SQL = (REFRESH_VIDEO_DAYS_SQL, REFRESH_CREATOR_DAYS_SQL, REFRESH_TOTALS_SQL)
+
+
+async def refresh_rollups(driver, source: str = AFFECTED_FROM_STAGE):
+    """Пересчитывает дневные агрегаты для затронутых пар (video_id, day)
+
+    Выполняется на соединении asyncpg внутри текущей транзакции.
+    """
+    await driver.execute(ROLLUP_LOCK_SQL)
+    for statement in REFRESH_SQL:
+        await driver.execute(statement.format(source=source))
+
+
+async def backfill_rollups(conn):
+    """Заполняет пустые агрегаты по уже загруженным снимкам (соединение SQLAlchemy)"""
+    has_rollups = await conn.scalar(text("SELECT EXISTS (SELECT 1 FROM daily_video_stats)"))
+    has_snapshots = await conn.scalar(text("SELECT EXISTS (SELECT 1 FROM video_snapshots)"))
+    if has_rollups or not has_snapshots:
+        return
+
+    logger.info("Заполнение дневных агрегатов по загруженным снимкам...")
+    await conn.execute(text(ROLLUP_LOCK_SQL))
+    for statement in REFRESH_SQL:
+        await conn.execute(text(statement.format(source=AFFECTED_ALL)))
+    logger.info("Дневные агрегаты заполнены")
+
+
+# Переписывание сгенерированного SQL на агрегаты.
+# Поддерживаются только формы, для которых ответ по агрегатам точно совпадает.
+
+# Дата — литерал или параметр запроса (:day) от быстрого разбора вопроса
+_DATE_LITERAL = r"((?:DATE\s*)?'\d{4}-\d{2}-\d{2}'(?:\s*::\s*date)?|:\w+)"
+_DAY_COLUMN = r"(?:DATE\s*\(\s*created_at\s*\)|created_at\s*::\s*date|CAST\s*\(\s*created_at\s+AS\s+DATE\s*\))"
+_DAY_EQ = rf"{_DAY_COLUMN}\s*=\s*{_DATE_LITERAL}"
+_DAY_BETWEEN = rf"{_DAY_COLUMN}\s+BETWEEN\s+{_DATE_LITERAL}\s+AND\s+{_DATE_LITERAL}"
+_POSITIVE_VIEWS = r"delta_views_count\s*>\s*0"
+
+_SELECT_RE = re.compile(
+    r"^SELECT\s+(?P<agg>"
+    r"SUM\s*\(\s*(?P<col>delta_views_count|delta_likes_count|delta_reports_count)\s*\)"
+    r"|COUNT\s*\(\s*DISTINCT\s+video_id\s*\)"
+    r"|COUNT\s*\(\s*\*\s*\))"
+    r"(?P<alias>\s+AS\s+\w+)?"
+    r"\s+FROM\s+video_snapshots\s+WHERE\s+(?P<where>.+)$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+_WHERE_PATTERNS = (
+    re.compile(rf"^(?:{_DAY_EQ}|{_DAY_BETWEEN})$", re.IGNORECASE),
+    re.compile(rf"^(?:{_DAY_EQ}|{_DAY_BETWEEN})\s+AND\s+(?P<positive>{_POSITIVE_VIEWS})$", re.IGNORECASE),
+    re.compile(rf"^(?P<positive>{_POSITIVE_VIEWS})\s+AND\s+(?:{_DAY_EQ}|{_DAY_BETWEEN})$", re.IGNORECASE),
+)
+
+
+def _match_where(where: str):
+    """Разбирает условие: (day_from, day_to, positive_views) или None
+
+    Даты возвращаются исходными токенами запроса (литерал или параметр).
+    """
+    where = where.strip()
+    # Условие может быть целиком в скобках
+    while where.startswith('(') and where.endswith(')'):
+        where = where[1:-1].strip()
+    for pattern in _WHERE_PATTERNS:
+        match = pattern.match(where)
+        if match:
+            positive = match.groupdict().get('positive') is not None
+            days = [group for group in match.groups() if group and group != match.groupdict().get('positive')]
+            day_from = days[0]
+            day_to = days[1] if len(days) > 1 else days[0]
+            return day_from, day_to, positive
+    return None
+
+
+def rewrite_for_rollups(sql_query: str) -> Optional[str]:
+    """Переписывает запрос к video_snapshots на дневные агрегаты, если это возможно"""
+    match = _SELECT_RE.match(sql_query.strip().rstrip(';').strip())
+    if not match:
+        return None
+    where = _match_where(match['where'])
+    if where is None:
+        return None
+    day_from, day_to, positive = where
+
+    alias = match['alias'] or ''
+    day_filter = f"day = {day_from}" if day_from == day_to else f"day BETWEEN {day_from} AND {day_to}"
+    agg = re.sub(r'\s+', '', match['agg']).upper()
+
+    if agg.startswith('SUM'):
+        if positive:
+            # Сумма только положительных приростов в агрегатах не хранится
+            return None
+        column = match['col'].lower()
+        return f"SELECT SUM({column}){alias} FROM daily_totals WHERE {day_filter}"
+
+    if 'DISTINCT' in agg:
+        if positive:
+            if day_from == day_to:
+                return f"SELECT COALESCE(SUM(videos_with_new_views), 0){alias} FROM daily_totals WHERE {day_filter}"
+            return (
+                f"SELECT COUNT(DISTINCT video_id){alias} FROM daily_video_stats "
+                f"WHERE {day_filter} AND positive_views_snapshots > 0"
+            )
+        return f"SELECT COUNT(DISTINCT video_id){alias} FROM daily_video_stats WHERE {day_filter}"
+
+    # COUNT(*)
+    if positive:
+        return (
+            f"SELECT COALESCE(SUM(positive_views_snapshots), 0){alias} FROM daily_video_stats "
+            f"WHERE {day_filter}"
+        )
+    return f"SELECT COALESCE(SUM(snapshots_count), 0){alias} FROM daily_totals WHERE {day_filter}"
@@ -0,0 +1,604 @@
+from collections import OrderedDict, deque
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+from typing import NamedTuple, Optional
+import hashlib
+import logging
+import re
+
+from decouple import config
+
+from database.query_policy import QueryRejected, REASON_SCHEMA
+
+
+logger = logging.getLogger(__name__)
+
+# Проверять таблицы, колонки и функции сгенерированного SQL по списку разрешенных
+SQL_VALIDATE = config('SQL_VALIDATE', default=True, cast=bool)
+# Выносить литералы в параметры: запросы одной формы дают один текст,
+# один подготовленный запрос на соединении и один ключ кэша
+SQL_PARAMETERIZE = config('SQL_PARAMETERIZE', default=True, cast=bool)
+# Сколько различных форм запросов держать в статистике
+SQL_STATS_SIZE = config('SQL_STATS_SIZE', default=500, cast=int)
+
+# Таблицы, доступные сгенерированным запросам; колонки берутся из database/models.py
+ALLOWED_TABLES = ('videos', 'video_snapshots', 'daily_video_stats', 'daily_creator_stats', 'daily_totals')
+
+ALLOWED_FUNCTIONS = frozenset((
+    'count', 'sum', 'avg', 'min', 'max', 'round', 'coalesce', 'nullif', 'greatest', 'least',
+    'abs', 'ceil', 'ceiling', 'floor', 'trunc', 'sqrt', 'power', 'mod', 'sign', 'div',
+    'date_trunc', 'date_part', 'to_char', 'to_date', 'to_timestamp', 'make_date', 'age', 'now',
+    'lower', 'upper', 'length', 'concat',
+    'percentile_cont', 'percentile_disc', 'stddev', 'stddev_pop', 'stddev_samp', 'variance',
+    'string_agg', 'array_agg', 'bool_and', 'bool_or', 'every',
+    'row_number', 'rank', 'dense_rank', 'lag', 'lead', 'first_value', 'last_value', 'ntile',
+    'cume_dist', 'percent_rank',
+))
+
+# Имена типов: встречаются в CAST, после :: и перед литералом (DATE '2025-11-28')
+TYPE_NAMES = frozenset((
+    'date', 'time', 'timestamp', 'timestamptz', 'interval', 'bigint', 'integer', 'int', 'int4', 'int8',
+    'smallint', 'numeric', 'decimal', 'real', 'double', 'precision', 'float', 'float8', 'text',
+    'varchar', 'character', 'char', 'varying', 'boolean', 'bool', 'zone', 'without',
+))
+
+KEYWORDS = TYPE_NAMES | frozenset((
+    'select', 'from', 'where', 'and', 'or', 'not', 'in', 'is', 'null', 'like', 'ilike', 'between',
+    'exists', 'case', 'when', 'then', 'else', 'end', 'as', 'on', 'join', 'inner', 'left', 'right',
+    'full', 'outer', 'cross', 'using', 'group', 'by', 'order', 'having', 'limit', 'offset', 'asc',
+    'desc', 'nulls', 'first', 'last', 'distinct', 'all', 'any', 'some', 'union', 'intersect',
+    'except', 'with', 'over', 'partition', 'filter', 'within', 'true', 'false', 'at', 'cast',
+    'extract', 'current_date', 'current_timestamp', 'epoch', 'year', 'month', 'day', 'hour',
+    'minute', 'second', 'week', 'dow', 'doy', 'quarter', 'isodow', 'rows', 'range', 'preceding',
+    'following', 'unbounded', 'current', 'row', 'fetch', 'next', 'only', 'lateral', 'window',
+))
+
+# Ключевые слова, после которых скобка отделяется пробелом в канонической форме
+_SPACED_BEFORE_PAREN = frozenset((
+    'and', 'or', 'not', 'in', 'from', 'join', 'where', 'on', 'as', 'select', 'when', 'then', 'else',
+    'by', 'having', 'exists', 'union', 'all', 'any', 'some', 'over', 'filter', 'within', 'lateral', 'with',
+    'distinct', 'using', 'intersect', 'except',
+))
+# Ключевые слова, завершающие перечисление таблиц после FROM
+_FROM_END = frozenset((
+    'where', 'group', 'order', 'having', 'limit', 'offset', 'union', 'intersect', 'except', 'window', 'on',
+    'using',
+))
+
+_TOKEN_RE = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<quoted>"(?:[^"]|"")*")
+  | (?P<number>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?)
+  | (?P<cast>::)
+  | (?P<param>:[A-Za-z_]\w*)
+  | (?P<ident>[^\W\d][\w$]*)
+  | (?P<op><>|!=|>=|<=|\|\||[-+*/%<>=]|[~!@#^&|`?][-+*/<>=~!@#%^&|`?]*)
+  | (?P<punct>[(),.;])
+""", re.VERBOSE | re.DOTALL)
+
+_DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+_TIMESTAMP_RE = re.compile(r'^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d{1,6})?)?$')
+
+INT4_MAX = 2 ** 31 - 1
+
+SQLSTATE_AMBIGUOUS_PARAMETER = '42P08'
+SQLSTATE_INDETERMINATE_DATATYPE = '42P18'
+
+
+class Token(NamedTuple):
+    kind: str
+    text: str
+
+
+class CanonicalQuery(NamedTuple):
+    """Запрос в канонической форме: текст, параметры и отпечаток формы
+
+    untyped — параметры без типа: строки, которые приводит bind_untyped.
+    """
+    sql: str
+    params: dict
+    fingerprint: str
+    untyped: tuple = ()
+
+
+class SQLParseError(ValueError):
+    pass
+
+
+def tokenize(sql_query: str) -> list:
+    """Лексемы запроса без пробелов и комментариев; идентификаторы — в нижнем регистре"""
+    tokens = []
+    position = 0
+    while position < len(sql_query):
+        match = _TOKEN_RE.match(sql_query, position)
+        if match is None:
+            raise SQLParseError(f"неожиданный символ {sql_query[position]!r} в позиции {position}")
+        position = match.end()
+        kind = match.lastgroup
+        if kind in ('space', 'comment'):
+            continue
+        text = match.group()
+        tokens.append(Token(kind, text.lower() if kind == 'ident' else text))
+    return tokens
+
+
+@lru_cache(maxsize=1)
+def allowed_columns() -> dict:
+    """Колонки разрешенных таблиц по моделям: {таблица: frozenset(колонок)}"""
+    # Модели загружаются при первом запросе, а не при запуске бота
+    from database.models import Base
+
+    return {
+        name: frozenset(column.name for column in Base.metadata.tables[name].columns)
+        for name in ALLOWED_TABLES
+    }
+
+
+def _is_keyword(token: Token) -> bool:
+    return token.kind == 'ident' and token.text in KEYWORDS
+
+
+def _reject(detail: str, sql_query: str):
+    logger.warning(f"Запрос отклонен ({REASON_SCHEMA}, {detail}): {sql_query}")
+    raise QueryRejected(REASON_SCHEMA, detail)
+
+
+def _declared_names(tokens: list) -> tuple:
+    """Имена, объявленные в самом запросе: (CTE, псевдонимы таблиц и выражений)"""
+    ctes = set()
+    names = set()
+    for idx, token in enumerate(tokens):
+        if token.kind not in ('ident', 'quoted') or _is_keyword(token):
+            continue
+        prev = tokens[idx - 1] if idx else None
+        nxt = tokens[idx + 1] if idx + 1 < len(tokens) else None
+        if prev is None or (nxt is not None and nxt.text in ('(', '.')):
+            continue
+        # name AS (...) — CTE
+        if nxt is not None and nxt.text == 'as' and idx + 2 < len(tokens) and tokens[idx + 2].text == '(':
+            ctes.add(token.text)
+        # ... AS name
+        elif prev.text == 'as':
+            names.add(token.text)
+        # Псевдоним без AS: сразу после выражения, таблицы или CASE ... END
+        elif prev.kind in ('ident', 'quoted', 'number', 'string', 'param') and not _is_keyword(prev) \
+                or prev.text in (')', 'end'):
+            names.add(token.text)
+    return ctes, names | ctes
+
+
+def validate(tokens: list, sql_query: str):
+    """Проверяет, что запрос обращается только к разрешенным таблицам, колонкам и функциям
+
+    Нарушение выбрасывает QueryRejected(REASON_SCHEMA).
+    """
+    schema = allowed_columns()
+    all_columns = frozenset().union(*schema.values())
+    ctes, declared = _declared_names(tokens)
+
+    if any(token.text == ';' for token in tokens):
+        _reject("несколько выражений", sql_query)
+
+    # Состояние по уровням скобок: был ли SELECT и идет ли перечисление таблиц
+    has_select = [False]
+    in_from = [False]
+    for idx, token in enumerate(tokens):
+        prev = tokens[idx - 1] if idx else None
+        nxt = tokens[idx + 1] if idx + 1 < len(tokens) else None
+
+        if token.text == '(':
+            has_select.append(False)
+            in_from.append(False)
+            continue
+        if token.text == ')':
+            if len(has_select) > 1:
+                has_select.pop()
+                in_from.pop()
+            continue
+        if token.kind != 'ident' and token.kind != 'quoted':
+            continue
+
+        name = token.text
+        if token.kind == 'ident' and name in KEYWORDS:
+            if name == 'select':
+                has_select[-1] = True
+                in_from[-1] = False
+            elif name == 'from' and has_select[-1] or name == 'join':
+                in_from[-1] = True
+            elif name in _FROM_END:
+                in_from[-1] = False
+            continue
+
+        if prev is not None and prev.text in ('::', 'as'):
+            # Тип приведения или объявление псевдонима
+            continue
+        if nxt is not None and nxt.text == '(':
+            if name not in ALLOWED_FUNCTIONS:
+                _reject(f"функция {name}", sql_query)
+            continue
+        if prev is not None and prev.text == '.':
+            qualifier = tokens[idx - 2].text
+            # Колонки таблицы проверяются строго; у псевдонимов, подзапросов и CTE
+            # это колонки любой разрешенной таблицы или имена, объявленные в запросе
+            if qualifier in schema and qualifier not in ctes:
+                known = name in schema[qualifier]
+            else:
+                known = name in all_columns or name in declared
+            if not known:
+                _reject(f"колонка {qualifier}.{name}", sql_query)
+            continue
+        if nxt is not None and nxt.text == '.':
+            if name not in schema and name not in declared:
+                _reject(f"таблица {name}", sql_query)
+            continue
+        if in_from[-1] and prev is not None and (prev.text in ('from', 'join', ',')):
+            if name not in schema and name not in ctes:
+                _reject(f"таблица {name}", sql_query)
+            continue
+        if name in declared or name in all_columns:
+            continue
+        _reject(f"идентификатор {name}", sql_query)
+
+
+def _typed_value(value) -> Optional[tuple]:
+    """Параметр вызывающего кода: (значение, тип для CAST) или (строка, None) без типа
+
+    Числа и логические значения имеют тип, как и числовые литералы. Строки и
+    даты передаются без типа, как строковые литералы: тип выведет Postgres.
+    """
+    if isinstance(value, bool):
+        return value, 'boolean'
+    if isinstance(value, int):
+        return value, 'integer' if abs(value) <= INT4_MAX else 'bigint'
+    if isinstance(value, (float, Decimal)):
+        return Decimal(str(value)), 'numeric'
+    if isinstance(value, (str, date)):
+        # str(datetime) — '2025-11-28 00:00:00', как литерал в запросе
+        return str(value), None
+    return None
+
+
+def _typed_literal(type_name: str, value: str) -> Optional[tuple]:
+    """Литерал с явным типом: DATE '...' или '...'::timestamp"""
+    try:
+        if type_name == 'date' and _DATE_RE.match(value):
+            return date.fromisoformat(value), 'date'
+        if type_name == 'timestamp' and (_DATE_RE.match(value) or _TIMESTAMP_RE.match(value)):
+            return datetime.fromisoformat(value), 'timestamp'
+    except ValueError:
+        pass
+    return None
+
+
+def _number_value(text: str) -> tuple:
+    if re.fullmatch(r'\d+', text):
+        value = int(text)
+        return value, 'integer' if value <= INT4_MAX else 'bigint'
+    return Decimal(text), 'numeric'
+
+
+def _grouped_literals(tokens: list) -> set:
+    """Литералы внутри выражений GROUP BY, ORDER BY и PARTITION BY
+
+    Выражение в SELECT совпадает с выражением группировки, только если их
+    литералы одинаковы, поэтому такие литералы остаются в тексте во всем
+    запросе. Номера колонок (ORDER BY 1) не учитываются.
+    """
+    grouped = set()
+    # Для каждого уровня скобок: идет ли выражение группировки или сортировки
+    clause = [False]
+    prev = None
+    for token in tokens:
+        if token.text == '(':
+            clause.append(clause[-1])
+        elif token.text == ')' and len(clause) > 1:
+            clause.pop()
+        elif token.kind == 'ident':
+            if token.text == 'by' and prev is not None and prev.text in ('order', 'group', 'partition'):
+                clause[-1] = True
+            elif token.text in _FROM_END or token.text == 'select':
+                clause[-1] = False
+        elif token.kind in ('string', 'number') and clause[-1]:
+            if not (token.kind == 'number' and prev is not None and prev.text in ('by', ',')):
+                grouped.add(token.text)
+        prev = token
+    return grouped
+
+
+def parameterize(tokens: list, params: Optional[dict] = None) -> tuple:
+    """Выносит литералы и именованные параметры в позиционные :p1, :p2, ...
+
+    Литерал с типом (число, DATE '...', '...'::timestamp) оборачивается в CAST
+    с этим типом. Строковый литерал без типа становится параметром без типа,
+    как и строки и даты вызывающего кода: тип по месту в запросе выведет
+    Postgres, значение приводится к нему в bind_untyped. Одинаковые значения
+    получают один параметр. Литералы из выражений группировки и сортировки,
+    номера колонок, модификаторы типов и интервалы остаются в тексте.
+    Возвращает (лексемы, параметры, имена параметров без типа).
+    """
+    params = params or {}
+    grouped = _grouped_literals(tokens)
+    result = []
+    values = {}
+    names = {}
+    untyped = []
+
+    def add(value, type_name: Optional[str]):
+        key = (type_name, type(value).__name__, str(value))
+        name = names.get(key)
+        if name is None:
+            name = names[key] = f"p{len(values) + 1}"
+            values[name] = value
+            if type_name is None:
+                untyped.append(name)
+        if type_name is None:
+            result.append(Token('param', f':{name}'))
+            return
+        result.extend((
+            Token('ident', 'cast'), Token('punct', '('), Token('param', f':{name}'),
+            Token('ident', 'as'), Token('ident', type_name), Token('punct', ')'),
+        ))
+
+    # Для каждого уровня скобок: открыта ли скобка модификатора типа и идет ли ORDER/GROUP BY
+    typmod = [False]
+    ordinal = [False]
+    idx = 0
+    while idx < len(tokens):
+        token = tokens[idx]
+        prev = result[-1] if result else None
+        nxt = tokens[idx + 1] if idx + 1 < len(tokens) else None
+
+        if token.text == '(':
+            typmod.append(prev is not None and prev.text in TYPE_NAMES and prev.text != 'date')
+            ordinal.append(False)
+        elif token.text == ')' and len(typmod) > 1:
+            typmod.pop()
+            ordinal.pop()
+        elif token.kind == 'ident':
+            if token.text == 'by' and prev is not None and prev.text in ('order', 'group'):
+                ordinal[-1] = True
+            elif token.text in _FROM_END or token.text == 'select':
+                ordinal[-1] = False
+
+        if token.kind == 'string' and token.text not in grouped:
+            literal = token.text[1:-1].replace("''", "'")
+            typed = None
+            consumed = 1
+            if prev is not None and prev.kind == 'ident' and prev.text in TYPE_NAMES \
+                    and (len(result) < 2 or result[-2].text != '::'):
+                # DATE '2025-11-28' — тип перед литералом
+                typed = _typed_literal(prev.text, literal)
+                if typed is not None:
+                    result.pop()
+            elif nxt is not None and nxt.text == '::':
+                type_name = tokens[idx + 2].text if idx + 2 < len(tokens) else ''
+                typed = _typed_literal(type_name, literal)
+                consumed = 3 if typed is not None else 1
+            else:
+                typed = literal, None
+            if typed is not None:
+                add(*typed)
+                idx += consumed
+                continue
+
+        elif token.kind == 'number' and not typmod[-1] and token.text not in grouped:
+            if not (ordinal[-1] and prev is not None and prev.text in ('by', ',')):
+                add(*_number_value(token.text))
+                idx += 1
+                continue
+
+        elif token.kind == 'param':
+            name = token.text[1:]
+            typed = _typed_value(params[name]) if name in params else None
+            if typed is not None:
+                add(*typed)
+                idx += 1
+                continue
+
+        result.append(token)
+        idx += 1
+
+    # Параметры неизвестного типа передаются под прежними именами
+    for token in result:
+        if token.kind == 'param' and token.text[1:] in params and token.text[1:] not in values:
+            values[token.text[1:]] = params[token.text[1:]]
+    return result, values, tuple(untyped)
+
+
+def render(tokens: list) -> str:
+    """Текст запроса из лексем с единообразными пробелами"""
+    parts = []
+    prev = None
+    for token in tokens:
+        text = token.text
+        if prev is not None:
+            glued = (
+                text in (')', ',', '.', '::') or prev.text in ('(', '.', '::')
+                or text == '(' and prev.kind == 'ident' and prev.text not in _SPACED_BEFORE_PAREN
+            )
+            if not glued:
+                parts.append(' ')
+        parts.append(text)
+        prev = token
+    return ''.join(parts)
+
+
+def fingerprint(sql_query: str) -> str:
+    return hashlib.sha1(sql_query.encode('utf-8')).hexdigest()[:16]
+
+
+def canonicalize(sql_query: str, params: Optional[dict] = None,
+                 validate_schema: bool = SQL_VALIDATE, extract_literals: bool = SQL_PARAMETERIZE) -> CanonicalQuery:
+    """Разбирает сгенерированный SQL, проверяет его и приводит к канонической форме
+
+    Недопустимые таблицы, колонки и функции выбрасывают QueryRejected.
+    Запрос, который не удалось разобрать, тоже отклоняется: иначе он ушел бы
+    в Postgres без проверки. Без проверки (SQL_VALIDATE=False) такой запрос
+    выполняется как есть.
+    """
+    params = dict(params or {})
+    try:
+        tokens = tokenize(sql_query)
+    except SQLParseError as e:
+        if validate_schema:
+            _reject(f"не удалось разобрать: {e}", sql_query)
+        logger.warning(f"Не удалось разобрать запрос ({e}): {sql_query}")
+        return CanonicalQuery(sql_query, params, fingerprint(sql_query))
+
+    if validate_schema:
+        validate(tokens, sql_query)
+    untyped = ()
+    if extract_literals:
+        tokens, params, untyped = parameterize(tokens, params)
+    canonical = render(tokens)
+    return CanonicalQuery(canonical, params, fingerprint(canonical), untyped)
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _coerce(value: str, type_name: str):
+    """Строка в значение типа, выведенного Postgres; ValueError, если не приводится"""
+    if type_name in ('text', 'varchar', 'bpchar', 'name'):
+        return value
+    if type_name == 'date':
+        return date.fromisoformat(value)
+    if type_name == 'timestamp':
+        return datetime.fromisoformat(value)
+    if type_name in ('int2', 'int4', 'int8'):
+        return int(value)
+    if type_name == 'numeric':
+        return Decimal(value)
+    if type_name in ('float4', 'float8'):
+        return float(value)
+    raise ValueError(f"тип {type_name}")
+
+
+class ParamTypes:
+    """Типы параметров канонических запросов, выведенные Postgres
+
+    Тип параметра зависит только от текста запроса, поэтому PREPARE
+    выполняется один раз на форму запроса в процессе.
+    """
+
+    def __init__(self, maxsize: int = SQL_STATS_SIZE):
+        self.maxsize = maxsize
+        self._types = OrderedDict()
+
+    async def get(self, driver, sql_query: str) -> Optional[dict]:
+        """{параметр: имя типа} или None, если Postgres не смог вывести типы"""
+        if sql_query in self._types:
+            self._types.move_to_end(sql_query)
+            return self._types[sql_query]
+
+        # :name -> $n в порядке первого появления, как для PREPARE в asyncpg
+        positions = {}
+        tokens = []
+        for token in tokenize(sql_query):
+            if token.kind == 'param':
+                number = positions.setdefault(token.text[1:], len(positions) + 1)
+                token = Token('param', f'${number}')
+            tokens.append(token)
+        try:
+            statement = await driver.prepare(render(tokens))
+            types = {name: statement.get_parameters()[number - 1].name for name, number in positions.items()}
+        except Exception as e:
+            # Один параметр в местах разных типов или тип не выводится
+            if getattr(e, 'sqlstate', None) not in (SQLSTATE_AMBIGUOUS_PARAMETER, SQLSTATE_INDETERMINATE_DATATYPE):
+                raise
+            logger.info(f"Postgres не вывел типы параметров ({e}): {sql_query}")
+            types = None
+        self._types[sql_query] = types
+        if len(self._types) > self.maxsize:
+            self._types.popitem(last=False)
+        return types
+
+
+param_types = ParamTypes()
+
+
+async def bind_untyped(driver, query: CanonicalQuery) -> tuple:
+    """Приводит параметры без типа к типам, выведенным Postgres: (sql, params)
+
+    asyncpg требует значение того типа, который Postgres вывел для параметра
+    (date, а не строку). Соединение asyncpg должно быть вне транзакции: ошибка
+    PREPARE прервала бы ее. Значение, которое не приводится, и параметры
+    запроса, типы которого Postgres не вывел, возвращаются в текст литералами —
+    так запрос выполнится ровно как сгенерированный.
+    """
+    if not query.untyped:
+        return query.sql, query.params
+    types = await param_types.get(driver, query.sql)
+    sql_query = query.sql
+    params = dict(query.params)
+    inline = []
+    for name in query.untyped:
+        if types is None:
+            inline.append(name)
+            continue
+        try:
+            params[name] = _coerce(params[name], types[name])
+        except ValueError:
+            inline.append(name)
+    if inline:
+        tokens = []
+        for token in tokenize(sql_query):
+            if token.kind == 'param' and token.text[1:] in inline:
+                token = Token('string', _quote(query.params[token.text[1:]]))
+            tokens.append(token)
+        sql_query = render(tokens)
+        for name in inline:
+            params.pop(name)
+    return sql_query, params
+
+
+class QueryStats:
+    """Задержки выполнения по формам запросов (отпечаткам)
+
+    Хранит не больше maxsize форм, вытесняя давно не встречавшиеся,
+    и по каждой — последние samples замеров для перцентилей.
+    """
+
+    def __init__(self, maxsize: int = SQL_STATS_SIZE, samples: int = 200):
+        self.maxsize = maxsize
+        self.samples = samples
+        self._entries = OrderedDict()
+
+    def record(self, query: CanonicalQuery, seconds: float):
+        entry = self._entries.get(query.fingerprint)
+        if entry is None:
+            entry = {'sql': query.sql, 'count': 0, 'total': 0.0, 'max': 0.0, 'samples': deque(maxlen=self.samples)}
+            self._entries[query.fingerprint] = entry
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(query.fingerprint)
+        entry['count'] += 1
+        entry['total'] += seconds
+        entry['max'] = max(entry['max'], seconds)
+        entry['samples'].append(seconds)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def top(self, limit: int = 10) -> list:
+        """Формы с наибольшим суммарным временем; задержки в миллисекундах"""
+        entries = sorted(self._entries.items(), key=lambda item: item[1]['total'], reverse=True)[:limit]
+        report = []
+        for key, entry in entries:
+            samples = sorted(entry['samples'])
+            report.append({
+                'fingerprint': key,
+                'count': entry['count'],
+                'total_ms': round(entry['total'] * 1000, 2),
+                'mean_ms': round(entry['total'] / entry['count'] * 1000, 2),
+                'p50_ms': round(samples[len(samples) // 2] * 1000, 2),
+                'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 2),
+                'max_ms': round(entry['max'] * 1000, 2),
+                'sql': entry['sql'],
+            })
+        return report
@@ -0,0 +1,39 @@
+from collections import Counter
+from contextlib import contextmanager
+import time
+
+
+class PhaseTimings:
+    """Суммарное время по фазам импорта (чтение, преобразование, COPY, слияния)
+
+    Используется бенчмарком импорта (tools/bench_ingest.py), чтобы
+    регрессии в отдельных фазах были видны в цифрах.
+    """
+
+    def __init__(self):
+        self.seconds = Counter()
+        self.calls = Counter()
+
+    @contextmanager
+    def measure(self, phase: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[phase] += time.perf_counter() - started
+            self.calls[phase] += 1
+
+    def reset(self):
+        self.seconds.clear()
+        self.calls.clear()
+
+    def summary(self) -> dict:
+        """{фаза: {'seconds': ..., 'calls': ...}} в порядке убывания времени"""
+        return {
+            phase: {'seconds': round(seconds, 3), 'calls': self.calls[phase]}
+            for phase, seconds in self.seconds.most_common()
+        }
+
+
+# Фазы импорта в этом процессе
+import_phases = PhaseTimings()
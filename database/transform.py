@@ -0,0 +1,220 @@
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import NamedTuple
+from uuid import uuid4
+import hashlib
+import json
+import logging
+
+try:
+    import numpy as np
+except ImportError:  # numpy нужен только для векторного пути
+    np = None
+
+
+logger = logging.getLogger(__name__)
+
+# Сколько различных строк дат держать в кэше преобразования
+TIMESTAMP_CACHE_SIZE = 65536
+
+# Порядок колонок в кортежах строк для COPY
+VIDEO_COLUMNS = (
+    'id', 'creator_id', 'video_created_at',
+    'views_count', 'likes_count', 'comments_count', 'reports_count',
+    'created_at', 'updated_at',
+)
+
+SNAPSHOT_COLUMNS = (
+    'id', 'video_id',
+    'views_count', 'likes_count', 'comments_count', 'reports_count',
+    'delta_views_count', 'delta_likes_count', 'delta_reports_count',
+    'created_at', 'updated_at',
+)
+
+VIDEO_REQUIRED_FIELDS = ('id', 'creator_id', 'video_created_at', 'created_at', 'updated_at')
+SNAPSHOT_REQUIRED_FIELDS = ('created_at', 'updated_at')
+
+
+class VideoRecord(NamedTuple):
+    """Подготовленная к загрузке запись видео"""
+    video_row: tuple
+    snapshot_rows: list
+    fingerprint: str
+
+
+def record_fingerprint(video_data: dict) -> str:
+    """Хэш содержимого записи видео, не зависящий от порядка ключей"""
+    payload = json.dumps(video_data, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def parse_datetime(dt_str: str):
+    """Парсит строку datetime с учетом часовых поясов"""
+    try:
+        # Убираем Z и добавляем timezone если нужно
+        if dt_str.endswith('Z'):
+            dt_str = dt_str.replace('Z', '+00:00')
+
+        # Парсим datetime
+        dt = datetime.fromisoformat(dt_str)
+
+        # Если datetime без timezone, делаем его UTC
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+
+        # Преобразуем в naive datetime (без timezone) для PostgreSQL
+        return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+    except Exception as e:
+        logger.error(f"Ошибка парсинга datetime '{dt_str}': {e}")
+        raise
+
+
+class TimestampConverter:
+    """Пакетное преобразование строк дат в naive UTC datetime
+
+    Результаты совпадают с parse_datetime. Почасовые замеры дают небольшое
+    число различных строк, поэтому повторы берутся из ограниченного LRU-кэша.
+    """
+
+    def __init__(self, maxsize: int = TIMESTAMP_CACHE_SIZE):
+        self._parse = lru_cache(maxsize=maxsize)(parse_datetime)
+
+    def parse(self, value: str) -> datetime:
+        """Преобразует одну строку (через кэш)"""
+        return self._parse(value)
+
+    def convert(self, values, strict: bool = True) -> list:
+        """Преобразует столбец строк в список datetime
+
+        При strict=False некорректные значения заменяются на None.
+        """
+        parse = self._parse
+        if strict:
+            return [parse(value) for value in values]
+
+        result = []
+        for value in values:
+            try:
+                result.append(parse(value))
+            except Exception:
+                result.append(None)
+        return result
+
+    def convert_datetime64(self, values):
+        """Векторный путь: столбец строк -> numpy-массив datetime64[us]
+
+        Каждая различная строка разбирается один раз, остальное — индексация.
+        """
+        if np is None:
+            raise RuntimeError("Для преобразования в datetime64 нужен пакет numpy")
+        unique, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+        parsed = np.array([self._parse(value) for value in unique.tolist()], dtype='datetime64[us]')
+        return parsed[inverse]
+
+    def cache_info(self):
+        return self._parse.cache_info()
+
+
+# Конвертер модуля: у каждого процесса пула свой кэш
+timestamps = TimestampConverter()
+
+
+def build_snapshot_rows(video_id: str, snapshots_data) -> list:
+    """Готовит кортежи строк video_snapshots для одного видео"""
+    valid = []
+
+    for idx, snapshot_data in enumerate(snapshots_data):
+        # Проверяем обязательные поля
+        if not isinstance(snapshot_data, dict):
+            logger.error(f"Ошибка при добавлении снимка {idx} для видео {video_id}: не является словарем")
+            continue
+        missing = [field for field in SNAPSHOT_REQUIRED_FIELDS if field not in snapshot_data]
+        if missing:
+            logger.warning(f"Снимок {idx} для видео {video_id} пропущен: отсутствует поле {missing[0]}")
+            continue
+        valid.append((idx, snapshot_data))
+
+    # Даты всех снимков видео преобразуем столбцами
+    created = timestamps.convert([snapshot_data['created_at'] for _, snapshot_data in valid], strict=False)
+    updated = timestamps.convert([snapshot_data['updated_at'] for _, snapshot_data in valid], strict=False)
+
+    rows = []
+    for (idx, snapshot_data), created_at, updated_at in zip(valid, created, updated):
+        if created_at is None or updated_at is None:
+            logger.error(f"Ошибка при добавлении снимка {idx} для видео {video_id}: некорректная дата")
+            continue
+
+        rows.append((
+            str(uuid4()),
+            video_id,
+            snapshot_data.get('views_count', 0) or 0,
+            snapshot_data.get('likes_count', 0) or 0,
+            snapshot_data.get('comments_count', 0) or 0,
+            snapshot_data.get('reports_count', 0) or 0,
+            snapshot_data.get('delta_views_count', 0) or 0,
+            snapshot_data.get('delta_likes_count', 0) or 0,
+            snapshot_data.get('delta_reports_count', 0) or 0,
+            created_at,
+            updated_at,
+        ))
+
+    return rows
+
+
+def build_video_rows(video_data, idx: int = 0):
+    """Проверяет запись видео и готовит строку videos и строки её снимков
+
+    Возвращает VideoRecord. При некорректной записи выбрасывает ValueError.
+    """
+    # Проверяем, что video_data - словарь
+    if not isinstance(video_data, dict):
+        raise ValueError(f"Элемент {idx} не является словарем: {type(video_data)}")
+
+    video_id = video_data.get('id', f'unknown_{idx}')
+
+    # Проверяем обязательные поля
+    for field in VIDEO_REQUIRED_FIELDS:
+        if field not in video_data:
+            raise ValueError(f"Видео {video_id} пропущено: отсутствует поле {field}")
+
+    # Преобразуем строки дат с учетом часовых поясов
+    try:
+        video_created_at = timestamps.parse(video_data['video_created_at'])
+        created_at = timestamps.parse(video_data['created_at'])
+        updated_at = timestamps.parse(video_data['updated_at'])
+    except Exception as e:
+        raise ValueError(f"Ошибка парсинга дат для видео {video_id}: {e}") from e
+
+    video_row = (
+        video_id,
+        video_data['creator_id'],
+        video_created_at,
+        video_data.get('views_count', 0) or 0,
+        video_data.get('likes_count', 0) or 0,
+        video_data.get('comments_count', 0) or 0,
+        video_data.get('reports_count', 0) or 0,
+        created_at,
+        updated_at,
+    )
+
+    snapshot_rows = build_snapshot_rows(video_id, video_data.get('snapshots', []) or [])
+
+    return VideoRecord(video_row, snapshot_rows, record_fingerprint(video_data))
+
+
+def transform_chunk(chunk: list, start_idx: int = 0):
+    """Преобразует пачку сырых записей в VideoRecord
+
+    Используется воркерами пула процессов, поэтому возвращает ошибки
+    списком сообщений, а не пишет их в лог родительского процесса.
+    Возвращает кортеж (records, errors).
+    """
+    records = []
+    errors = []
+    for offset, video_data in enumerate(chunk):
+        try:
+            records.append(build_video_rows(video_data, start_idx + offset))
+        except ValueError as e:
+            errors.append(str(e))
+    return records, errors
@@ -1,6 +1,7 @@
 import asyncio
 import os
 import sys
+import time
 from pathlib import Path
 import logging
 from dotenv import load_dotenv
@@ -11,8 +12,16 @@ from decouple import config
 sys.path.append(str(Path(__file__).parent))
 
 from bot.bot import VideoAnalyticsBot
-from database.init_db import main_db
+from bot.webhook import WebhookSettings, register_webhook, run_workers
+from bot.readiness import Readiness
 from database.db_handlers import DatabaseOperations
+from database.engine import get_engine, warm_up
+from database.kv_store import create_store
+from database.progress import import_progress
+from monitoring.metrics import import_progress_ratio
+
+# Момент запуска процесса: от него считается время до приема обновлений
+STARTED = time.perf_counter()
 
 # Настройка логирования
 logging.basicConfig(
@@ -22,6 +31,38 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# Импорт данных при запуске: background (бот отвечает сразу), blocking (ждать импорт) или off
+STARTUP_IMPORT = config('STARTUP_IMPORT', default='background').lower()
+# Как часто писать в лог ход фонового импорта, секунды
+STARTUP_PROGRESS_INTERVAL = config('STARTUP_PROGRESS_INTERVAL', default=10, cast=float)
+
+
+async def run_import():
+    # Модели и импортер загружаются только когда нужен импорт
+    from database.init_db import main_db
+    await main_db()
+
+
+async def log_import_progress():
+    while True:
+        await asyncio.sleep(STARTUP_PROGRESS_INTERVAL)
+        logger.info(f"Импорт данных: {import_progress.describe()}")
+
+
+async def run_startup_import(readiness: Readiness):
+    """Фоновый импорт: бот уже принимает обновления и отвечает по готовности данных"""
+    reporter = asyncio.create_task(log_import_progress())
+    try:
+        await run_import()
+        logger.info(f"База данных инициализирована: {import_progress.describe()}")
+    except Exception as e:
+        # Бот продолжает работать по данным, которые уже есть в базе
+        logger.error(f"Ошибка импорта данных: {e}")
+    finally:
+        reporter.cancel()
+        readiness.import_finished()
+
+
 async def main():
     """Основная функция запуска"""
     # Загрузка переменных окружения
@@ -30,10 +71,6 @@ async def main():
     # Получение конфигурации
     TELEGRAM_TOKEN = config('TELEGRAM_TOKEN')
     OPENAI_API_KEY = config('OPENAI_API_KEY')
-    DB = config('DB')
-    LOGIN = config('LOGIN')
-    PASSWORD = config('PASSWORD')
-    HOST = config('HOST')
     
     if not TELEGRAM_TOKEN:
         logger.error("Не задан TELEGRAM_TOKEN в переменных окружения")
@@ -43,33 +80,82 @@ async def main():
         logger.error("Не задан OPENAI_API_KEY в переменных окружения")
         sys.exit(1)
     
-    # Создаем URL базы данных
-    DB_URL = f'postgresql+asyncpg://{LOGIN}:{PASSWORD}@{HOST}:5432/{DB}'
+    # Режим получения обновлений: polling или webhook
+    BOT_MODE = config('BOT_MODE', default='polling').lower()
+    webhook_settings = WebhookSettings.from_config()
+    
+    if BOT_MODE == 'webhook' and not webhook_settings.url:
+        logger.error("Для режима webhook не задан WEBHOOK_URL в переменных окружения")
+        sys.exit(1)
     
+    # Несколько воркеров webhook: каждый процесс создает свои соединения и бота,
+    # поэтому здесь только регистрируем webhook, а воркеры запускаются вне цикла событий.
+    # Воркеры запускаются после возврата из main, поэтому импорт в этом режиме всегда блокирующий
+    multi_worker = BOT_MODE == 'webhook' and webhook_settings.workers > 1
     
     # Инициализация базы данных
-    logger.info("Инициализация базы данных...")
-    try:
-        await main_db() # потом нужно включить
-        logger.info("База данных инициализирована")
-    except Exception as e:
-        logger.error(f"Ошибка инициализации базы данных: {e}")
-        sys.exit(1)
+    if STARTUP_IMPORT == 'blocking' or (multi_worker and STARTUP_IMPORT != 'off'):
+        logger.info("Инициализация базы данных...")
+        try:
+            await run_import()
+            logger.info("База данных инициализирована")
+        except Exception as e:
+            logger.error(f"Ошибка инициализации базы данных: {e}")
+            sys.exit(1)
+    
+    if multi_worker:
+        try:
+            await register_webhook(TELEGRAM_TOKEN, webhook_settings)
+        except Exception as e:
+            logger.error(f"Ошибка регистрации webhook: {e}")
+            sys.exit(1)
+        await get_engine().dispose()
+        return webhook_settings
+    
+    # Создаем экземпляр DatabaseOperations на общем пуле соединений
+    engine = get_engine()
+    # Общее состояние экземпляров бота (STATE_BACKEND)
+    store = create_store(engine)
+    db_operations = DatabaseOperations(engine=engine, store=store)
+    
+    # Открываем соединения заранее, чтобы первые вопросы не ждали подключения
+    await warm_up(engine)
+    # Колонки для простых агрегатов загружаются в фоне (COLUMNAR_ENABLED)
+    await db_operations.warm_up_columnar()
     
-    # Создаем экземпляр DatabaseOperations
-    db_operations = DatabaseOperations(DB_URL)
+    # Фоновый импорт: пока он идет, бот отвечает по уже загруженным данным
+    # или сообщает, что данные загружаются (STARTUP_SERVE_STALE)
+    readiness = Readiness()
+    import_task = None
+    if STARTUP_IMPORT == 'background':
+        await readiness.check_data(engine)
+        import_progress_ratio.set_function(lambda: import_progress.ratio)
+        import_task = asyncio.create_task(run_startup_import(readiness))
     
     # Запуск бота
-    logger.info("Запуск Telegram бота...")
+    logger.info(f"Запуск Telegram бота, подготовка заняла {time.perf_counter() - STARTED:.2f} с")
     try:
-        bot = VideoAnalyticsBot(TELEGRAM_TOKEN, db_operations)
-        await bot.run()
+        bot = VideoAnalyticsBot(
+            TELEGRAM_TOKEN, db_operations, api_url=webhook_settings.api_url or None, store=store,
+            readiness=readiness,
+        )
+        if BOT_MODE == 'webhook':
+            await bot.run_webhook(webhook_settings)
+        else:
+            await bot.run()
     except Exception as e:
         logger.error(f"Ошибка запуска бота: {e}")
         sys.exit(1)
+    finally:
+        if import_task is not None and not import_task.done():
+            # При следующем запуске уже записанные видео пропускаются по отпечаткам (video_import_state)
+            import_task.cancel()
 
 if __name__ == "__main__":
     try:        
-        asyncio.run(main())
+        workers_settings = asyncio.run(main())
+        if workers_settings:
+            logger.info(f"Запуск Telegram бота в режиме webhook, воркеров: {workers_settings.workers}")
+            run_workers(config('TELEGRAM_TOKEN'), workers_settings)
     except KeyboardInterrupt:
         logger.info('Бот выключен')
\ No newline at end of file
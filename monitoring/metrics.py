@@ -0,0 +1,216 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Optional
+import math
+import time
+
+
+# Границы гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Границы гистограммы числа строк результата
+ROWS_BUCKETS = (0, 1, 2, 5, 10, 50, 100, 500, 1000)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: tuple = ()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + '}'
+
+
+class Metric:
+    """Метрика с метками; значения хранятся по кортежу значений меток"""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name}: ожидались метки {self.labels}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self) -> list:
+        """[(имя, значения меток, доп. метки, значение)] для вывода"""
+        return [(self.name, key, (), value) for key, value in sorted(self._values.items())]
+
+    def reset(self):
+        self._values.clear()
+
+
+class Counter(Metric):
+    """Монотонно растущий счетчик"""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """Текущее значение; может вычисляться функцией в момент выдачи метрик"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        super().__init__(name, documentation, labels)
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def set_function(self, function: Optional[Callable[[], float]]):
+        """Значение без меток, которое берется из function() при каждой выдаче"""
+        self._function = function
+
+    def samples(self) -> list:
+        if self._function is not None:
+            return [(self.name, (), (), self._function())]
+        return super().samples()
+
+
+class Histogram(Metric):
+    """Распределение значений по накопительным корзинам, сумма и количество"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # [счетчики корзин, сумма, количество]
+            state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет время блока"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def samples(self) -> list:
+        samples = []
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append((f'{self.name}_bucket', key, (('le', _format_value(bound)),), cumulative))
+            samples.append((f'{self.name}_sum', key, (), total))
+            samples.append((f'{self.name}_count', key, (), count))
+        return samples
+
+
+class Registry:
+    """Набор метрик процесса и их выдача в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (),
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, key, extra, value in metric.samples():
+                lines.append(f'{name}{_format_labels(metric.labels if key else (), key, extra)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        for metric in self._metrics.values():
+            metric.reset()
+
+
+# Метрики процесса бота
+registry = Registry()
+
+handler_seconds = registry.histogram(
+    'bot_handler_seconds', "Время обработки вопроса от получения до ответа", ('outcome',))
+parse_seconds = registry.histogram(
+    'bot_parse_seconds', "Время получения SQL для вопроса", ('path',))
+parse_total = registry.counter(
+    'bot_parse_total', "Вопросы по путям разбора (fast_path, cache, llm)", ('path',))
+llm_seconds = registry.histogram(
+    'bot_llm_seconds', "Время ответа модели на вопрос (со всеми попытками)", ('outcome',))
+db_checkout_seconds = registry.histogram(
+    'bot_db_checkout_seconds', "Ожидание соединения из пула")
+db_execute_seconds = registry.histogram(
+    'bot_db_execute_seconds', "Выполнение SQL запроса (без ожидания соединения)")
+db_rows_fetched = registry.histogram(
+    'bot_db_rows_fetched', "Строк в результате запроса", buckets=ROWS_BUCKETS)
+columnar_queries_total = registry.counter(
+    'bot_columnar_queries_total', "Запросы к колоночному движку (answered, answered_stale, unsupported, stale)", ('result',))
+cache_lookups_total = registry.counter(
+    'bot_cache_lookups_total', "Обращения к кэшам вопросов и результатов", ('cache', 'result'))
+errors_total = registry.counter(
+    'bot_errors_total', "Ошибки обработки вопросов по видам", ('kind',))
+slow_queries_total = registry.counter(
+    'bot_slow_queries_total', "Запросы дольше SLOW_QUERY_SECONDS")
+handlers_in_flight = registry.gauge(
+    'bot_handlers_in_flight', "Обновления в обработке")
+db_connections_in_use = registry.gauge(
+    'bot_db_connections_in_use', "Занятые соединения пула")
+import_records_total = registry.counter(
+    'bot_import_records_total', "Записи видео, обработанные импортом", ('result',))
+import_seconds = registry.histogram(
+    'bot_import_seconds', "Длительность импорта",
+    buckets=(1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0))
+import_phase_seconds = registry.counter(
+    'bot_import_phase_seconds_total', "Время импорта по фазам", ('phase',))
+import_records_per_second = registry.gauge(
+    'bot_import_records_per_second', "Скорость последнего импорта, записей в секунду")
+import_progress_ratio = registry.gauge(
+    'bot_import_progress_ratio', "Доля файла, обработанная текущим импортом")
+ingest_snapshots_total = registry.counter(
+    'bot_ingest_snapshots_total', "Снимки, полученные потоковой загрузкой (accepted, stale, unknown, invalid)",
+    ('result',))
+ingest_seconds = registry.histogram(
+    'bot_ingest_seconds', "Запись одной пачки потоковой загрузки")
@@ -0,0 +1,34 @@
+from typing import Optional
+import logging
+
+from aiohttp import web
+from decouple import config
+
+from monitoring.metrics import registry
+
+
+logger = logging.getLogger(__name__)
+
+# Порт HTTP-сервера метрик (0 — сервер не запускается)
+METRICS_PORT = config('METRICS_PORT', default=0, cast=int)
+METRICS_HOST = config('METRICS_HOST', default='0.0.0.0')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    """Метрики процесса в текстовом формате Prometheus"""
+    return web.Response(body=registry.render().encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
+
+
+async def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> Optional[web.AppRunner]:
+    """Запускает /metrics на host:port; возвращает runner для остановки (None, если port=0)"""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,164 @@
+from datetime import date
+from typing import NamedTuple, Optional
+import re
+
+from nlp.normalize import normalize_question
+
+
+class FastPathMatch(NamedTuple):
+    """Результат локального разбора вопроса"""
+    template: str
+    sql: str
+    params: dict
+
+
+# Шаблоны работают с нормализованным текстом: даты уже в виде YYYY-MM-DD,
+# идентификаторы — в виде «id <значение>», пунктуации нет.
+_DATE = r'\d{4}-\d{2}-\d{2}'
+_PERIOD = (
+    rf'(?:(?:за |в период )?с (?P<date_from>{_DATE}) (?:по|до) (?P<date_to>{_DATE})(?: включительно)?'
+    rf'|(?:за )?(?P<day>{_DATE}))'
+)
+
+# Метрики видео и их приростов в снимках
+_METRICS = {
+    'просмотр': ('views_count', 'delta_views_count'),
+    'лайк': ('likes_count', 'delta_likes_count'),
+    'жалоб': ('reports_count', 'delta_reports_count'),
+    'комментари': ('comments_count', None),
+}
+_METRIC = r'(?P<metric>просмотр\w*|лайк\w*|жалоб\w*|комментари\w*)'
+
+_COMPARISONS = {'больше': '>', 'более': '>', 'свыше': '>', 'меньше': '<', 'менее': '<'}
+
+_TOTAL_VIDEOS_RE = re.compile(
+    r'^сколько (?:всего )?видео(?: всего)?(?: есть)?(?: всего)?(?: в (?:системе|базе))?$'
+)
+_CREATOR_VIDEOS_RE = re.compile(
+    r'^сколько (?:всего )?видео (?:у|для) креатора (?:с )?id (?P<creator_id>[\w-]+)'
+    r'(?: (?:вышло|вышли|было опубликовано|опубликовано|опубликовал|выпустил))?'
+    rf'(?: {_PERIOD})?(?: всего)?$'
+)
+_VIDEOS_OVER_RE = re.compile(
+    r'^сколько (?:всего )?видео (?:набрало|набрали|имеет|имеют|получило|получили|собрало|собрали) '
+    r'(?P<cmp>больше|более|свыше|меньше|менее) (?:чем )?(?P<threshold>\d[\d ]*\d|\d) '
+    rf'{_METRIC}(?: за все время)?$'
+)
+_GROWTH_RE = re.compile(
+    rf'^на сколько {_METRIC} (?:в сумме )?(?:выросли|выросло|выросла|увеличились|увеличилось) '
+    rf'(?:в сумме )?(?:все )?(?:видео )?(?:в сумме )?{_PERIOD}$'
+)
+_NEW_VIEWS_RE = re.compile(
+    r'^сколько (?:разных |различных )?видео (?:получали|получало|получило|получили) новые просмотры '
+    rf'{_PERIOD}$'
+)
+
+
+def _metric_columns(word: str):
+    for stem, columns in _METRICS.items():
+        if word.startswith(stem):
+            return columns
+    return None, None
+
+
+def _period(match):
+    """Условие по дате и параметры: (оператор, params) или None при некорректной дате"""
+    try:
+        if match['day']:
+            return '= :day', {'day': date.fromisoformat(match['day'])}
+        if match['date_from']:
+            date_from = date.fromisoformat(match['date_from'])
+            date_to = date.fromisoformat(match['date_to'])
+            if date_from > date_to:
+                return None
+            return 'BETWEEN :date_from AND :date_to', {'date_from': date_from, 'date_to': date_to}
+    except ValueError:
+        return None
+    return '', {}
+
+
+def _match_total_videos(text: str) -> Optional[FastPathMatch]:
+    if _TOTAL_VIDEOS_RE.match(text):
+        return FastPathMatch('total_videos', 'SELECT COUNT(*) FROM videos', {})
+    return None
+
+
+def _match_creator_videos(text: str) -> Optional[FastPathMatch]:
+    match = _CREATOR_VIDEOS_RE.match(text)
+    if not match:
+        return None
+    period = _period(match)
+    if period is None:
+        return None
+    condition, params = period
+    params['creator_id'] = match['creator_id']
+    sql = 'SELECT COUNT(*) FROM videos WHERE creator_id = :creator_id'
+    if condition:
+        return FastPathMatch('creator_videos_period', f'{sql} AND DATE(video_created_at) {condition}', params)
+    return FastPathMatch('creator_videos', sql, params)
+
+
+def _match_videos_over(text: str) -> Optional[FastPathMatch]:
+    match = _VIDEOS_OVER_RE.match(text)
+    if not match:
+        return None
+    column, _ = _metric_columns(match['metric'])
+    if column is None:
+        return None
+    threshold = int(match['threshold'].replace(' ', ''))
+    return FastPathMatch(
+        'videos_over_threshold',
+        f"SELECT COUNT(*) FROM videos WHERE {column} {_COMPARISONS[match['cmp']]} :threshold",
+        {'threshold': threshold},
+    )
+
+
+def _match_growth(text: str) -> Optional[FastPathMatch]:
+    match = _GROWTH_RE.match(text)
+    if not match:
+        return None
+    _, delta_column = _metric_columns(match['metric'])
+    period = _period(match)
+    if delta_column is None or period is None or not period[0]:
+        return None
+    condition, params = period
+    return FastPathMatch(
+        'growth_on_period',
+        f'SELECT SUM({delta_column}) FROM video_snapshots WHERE DATE(created_at) {condition}',
+        params,
+    )
+
+
+def _match_new_views(text: str) -> Optional[FastPathMatch]:
+    match = _NEW_VIEWS_RE.match(text)
+    if not match:
+        return None
+    period = _period(match)
+    if period is None or not period[0]:
+        return None
+    condition, params = period
+    return FastPathMatch(
+        'videos_with_new_views',
+        f'SELECT COUNT(DISTINCT video_id) FROM video_snapshots '
+        f'WHERE DATE(created_at) {condition} AND delta_views_count > 0',
+        params,
+    )
+
+
+_MATCHERS = (
+    _match_total_videos,
+    _match_creator_videos,
+    _match_videos_over,
+    _match_growth,
+    _match_new_views,
+)
+
+
+def match_fast_path(question: str) -> Optional[FastPathMatch]:
+    """Разбирает вопрос известного вида без обращения к модели"""
+    text = normalize_question(question)
+    for matcher in _MATCHERS:
+        result = matcher(text)
+        if result is not None:
+            return result
+    return None
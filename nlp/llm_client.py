@@ -0,0 +1,224 @@
+from collections import Counter, deque
+from typing import Optional
+import asyncio
+import logging
+import random
+import re
+import time
+
+from decouple import config
+
+
+logger = logging.getLogger(__name__)
+
+# Модель и резервная модель для хеджирования (пустая — без хеджирования)
+LLM_MODEL = config('LLM_MODEL', default='nex-agi/deepseek-v3.1-nex-n1:free')
+LLM_FALLBACK_MODEL = config('LLM_FALLBACK_MODEL', default='')
+# Общий срок ответа на один вопрос и срок одной попытки (в секундах)
+LLM_DEADLINE = config('LLM_DEADLINE', default=20, cast=float)
+LLM_ATTEMPT_TIMEOUT = config('LLM_ATTEMPT_TIMEOUT', default=10, cast=float)
+# Повторы после ошибки или таймаута попытки и базовая пауза между ними
+LLM_RETRIES = config('LLM_RETRIES', default=2, cast=int)
+LLM_RETRY_DELAY = config('LLM_RETRY_DELAY', default=0.3, cast=float)
+# Резервный запрос отправляется, если основной дольше этого перцентиля задержек
+LLM_HEDGE_PERCENTILE = config('LLM_HEDGE_PERCENTILE', default=0.9, cast=float)
+# Задержка хеджирования, пока задержек накоплено мало
+LLM_HEDGE_DELAY = config('LLM_HEDGE_DELAY', default=3, cast=float)
+# Потоковый ответ: чтение прекращается, как только пришел законченный SQL
+LLM_STREAM = config('LLM_STREAM', default=True, cast=bool)
+
+# Минимум замеров для расчета перцентиля
+MIN_LATENCY_SAMPLES = 20
+
+_RETRYABLE_ERRORS = None
+
+
+def retryable_errors() -> tuple:
+    """Ошибки, после которых имеет смысл повторить запрос
+
+    openai импортируется при первом запросе к модели, а не при запуске бота.
+    """
+    global _RETRYABLE_ERRORS
+    if _RETRYABLE_ERRORS is None:
+        import openai
+
+        _RETRYABLE_ERRORS = (
+            asyncio.TimeoutError,
+            openai.APITimeoutError,
+            openai.APIConnectionError,
+            openai.RateLimitError,
+            openai.InternalServerError,
+        )
+    return _RETRYABLE_ERRORS
+
+_QUOTED_RE = re.compile(r"'(?:[^']|'')*'?")
+_FENCE_RE = re.compile(r'```(?:sql)?', re.IGNORECASE)
+_SQL_START_RE = re.compile(r'^\s*(SELECT|WITH)\b', re.IGNORECASE)
+
+
+def clean_sql(content: str) -> str:
+    """SQL из ответа модели: без markdown-обрамления и завершающей точки с запятой"""
+    return _FENCE_RE.sub('', content).strip().rstrip(';').strip()
+
+
+def complete_statement(content: str) -> Optional[str]:
+    """Законченный SQL-запрос из начала потокового ответа или None, если он еще не пришел
+
+    Запрос считается законченным после точки с запятой вне кавычек или после
+    закрывающего ``` (дальше модель обычно поясняет ответ).
+    """
+    fences = list(_FENCE_RE.finditer(content))
+    if fences and not content[:fences[0].start()].strip():
+        if len(fences) < 2:
+            return None
+        return clean_sql(content[fences[0].end():fences[1].start()])
+
+    if not _SQL_START_RE.match(content):
+        return None
+    # Точки с запятой внутри строковых литералов (в том числе недописанных) не считаются
+    masked = _QUOTED_RE.sub(lambda match: ' ' * len(match[0]), content)
+    end = masked.find(';')
+    return clean_sql(content[:end]) if end != -1 else None
+
+
+class LatencyTracker:
+    """Последние задержки ответов для выбора момента хеджирования"""
+
+    def __init__(self, window: int = 200):
+        self._values = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self._values.append(seconds)
+
+    def percentile(self, share: float) -> Optional[float]:
+        if len(self._values) < MIN_LATENCY_SAMPLES:
+            return None
+        values = sorted(self._values)
+        return values[min(len(values) - 1, int(share * len(values)))]
+
+
+class LLMClient:
+    """Запросы к модели со сроками, повторами, хеджированием и потоковым чтением
+
+    На вопрос отводится deadline секунд. Каждая попытка ограничена
+    attempt_timeout; после сетевых ошибок, 429 и 5xx попытка повторяется
+    с паузой со случайным разбросом. Если основная модель отвечает дольше
+    обычного (перцентиль hedge_percentile), параллельно отправляется запрос
+    к fallback_model, и берется первый успешный ответ.
+    """
+
+    def __init__(self, client, model: str = LLM_MODEL, fallback_model: str = LLM_FALLBACK_MODEL,
+                 deadline: float = LLM_DEADLINE, attempt_timeout: float = LLM_ATTEMPT_TIMEOUT,
+                 retries: int = LLM_RETRIES, retry_delay: float = LLM_RETRY_DELAY,
+                 hedge_percentile: float = LLM_HEDGE_PERCENTILE, hedge_delay: float = LLM_HEDGE_DELAY,
+                 stream: bool = LLM_STREAM):
+        self.client = client
+        self.model = model
+        self.fallback_model = fallback_model or None
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.stream = stream
+        self.latency = LatencyTracker()
+        self.counters = Counter()
+
+    def _hedge_after(self) -> float:
+        return self.latency.percentile(self.hedge_percentile) or self.hedge_delay
+
+    async def complete_sql(self, messages: list) -> Optional[str]:
+        """SQL от модели или None, если за отведенное время ответа нет"""
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.deadline
+        try:
+            sql = await asyncio.wait_for(self._hedged(messages, deadline), self.deadline)
+        except asyncio.TimeoutError:
+            self.counters['deadline_exceeded'] += 1
+            logger.error(f"Модель не ответила за {self.deadline} с")
+            return None
+        except Exception as e:
+            self.counters['failed'] += 1
+            logger.error(f"Ошибка OpenAI: {e}")
+            return None
+        logger.info(f"Ответ модели за {time.perf_counter() - started:.2f} с")
+        return sql
+
+    async def _hedged(self, messages: list, deadline: float) -> str:
+        """Основной запрос и, если он задерживается или падает, резервный"""
+        primary = asyncio.ensure_future(self._with_retries(self.model, messages, deadline))
+        tasks = {primary}
+        try:
+            if self.fallback_model:
+                done, _ = await asyncio.wait(tasks, timeout=self._hedge_after())
+                if not done or primary.exception() is not None:
+                    self.counters['hedged'] += 1
+                    logger.info(f"Резервный запрос к {self.fallback_model}")
+                    tasks.add(asyncio.ensure_future(self._with_retries(self.fallback_model, messages, deadline)))
+
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    if task is not primary:
+                        self.counters['hedge_won'] += 1
+                    return task.result()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _with_retries(self, model: str, messages: list, deadline: float) -> str:
+        for attempt in range(self.retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            started = time.perf_counter()
+            self.counters['attempts'] += 1
+            try:
+                sql = await asyncio.wait_for(self._attempt(model, messages), min(self.attempt_timeout, remaining))
+            except retryable_errors() as e:
+                if attempt == self.retries:
+                    raise
+                # Полный случайный разброс: повторы разных вопросов не совпадают по времени
+                delay = random.uniform(0, self.retry_delay * 2 ** attempt)
+                delay = min(delay, max(0.0, deadline - time.monotonic()))
+                self.counters['retries'] += 1
+                logger.warning(f"Повтор запроса к {model} через {delay:.2f} с: {type(e).__name__}")
+                await asyncio.sleep(delay)
+                continue
+            if model == self.model:
+                self.latency.record(time.perf_counter() - started)
+            return sql
+        raise asyncio.TimeoutError()
+
+    async def _attempt(self, model: str, messages: list) -> str:
+        if not self.stream:
+            completion = await self.client.chat.completions.create(model=model, messages=messages)
+            return clean_sql(completion.choices[0].message.content or '')
+
+        stream = await self.client.chat.completions.create(model=model, messages=messages, stream=True)
+        content = ''
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                content += chunk.choices[0].delta.content or ''
+                sql = complete_statement(content)
+                if sql:
+                    # Остаток ответа (пояснения модели) не нужен
+                    self.counters['early_stop'] += 1
+                    return sql
+        finally:
+            await stream.close()
+        return clean_sql(content)
+
+    def stats(self) -> dict:
+        return {
+            **dict(self.counters),
+            'hedge_after': round(self._hedge_after(), 3),
+        }
@@ -0,0 +1,63 @@
+import re
+
+
+# Названия месяцев в родительном падеже (как в «28 ноября 2025»)
+MONTHS = {
+    'января': 1, 'февраля': 2, 'марта': 3, 'апреля': 4,
+    'мая': 5, 'июня': 6, 'июля': 7, 'августа': 8,
+    'сентября': 9, 'октября': 10, 'ноября': 11, 'декабря': 12,
+}
+
+_MONTHS_RE = '|'.join(MONTHS)
+# Необязательное «года»/«г.» после года
+_YEAR_SUFFIX_RE = r'(?:\s*(?:года|г\.?)(?=\W|$))?'
+
+# «с 1 по 5 ноября 2025» — общий месяц и год у обеих дат
+_DAY_RANGE_RE = re.compile(rf'\bс\s+(\d{{1,2}})\s+по\s+(\d{{1,2}})\s+({_MONTHS_RE})\s+(\d{{4}}){_YEAR_SUFFIX_RE}')
+# «28 ноября 2025», «28 ноября 2025 года»
+_TEXT_DATE_RE = re.compile(rf'\b(\d{{1,2}})\s+({_MONTHS_RE})\s+(\d{{4}}){_YEAR_SUFFIX_RE}')
+# «28.11.2025»
+_DOTTED_DATE_RE = re.compile(r'\b(\d{1,2})\.(\d{1,2})\.(\d{4})\b')
+# «id 123», «id: 123», «id=123», «айди 123», «идентификатором 123»
+_ID_RE = re.compile(r'\b(?:id|айди|идентификатор\w*)\b\s*[:=№#]?\s*[«"\']?([\w-]+)[»"\']?', re.IGNORECASE)
+_ID_PLACEHOLDER_RE = re.compile(r'__id(\d+)__')
+# Все, кроме букв, цифр, дефиса и подчеркивания, считаем разделителем
+_PUNCT_RE = re.compile(r'[^\w\s-]+')
+_SPACES_RE = re.compile(r'\s+')
+
+
+def iso_date(day, month, year) -> str:
+    """Дата в виде 'YYYY-MM-DD'"""
+    return f'{int(year):04d}-{int(month):02d}-{int(day):02d}'
+
+
+def canonicalize_dates(text: str) -> str:
+    """Приводит даты в тексте к виду 'YYYY-MM-DD'"""
+    text = _DAY_RANGE_RE.sub(
+        lambda m: f'с {iso_date(m[1], MONTHS[m[3]], m[4])} по {iso_date(m[2], MONTHS[m[3]], m[4])}',
+        text,
+    )
+    text = _TEXT_DATE_RE.sub(lambda m: iso_date(m[1], MONTHS[m[2]], m[3]), text)
+    text = _DOTTED_DATE_RE.sub(lambda m: iso_date(m[1], m[2], m[3]), text)
+    return text
+
+
+def normalize_question(text: str) -> str:
+    """Нормализованная форма вопроса для ключей кэша
+
+    Регистр, «ё», пунктуация и пробелы не влияют на результат, даты
+    приводятся к ISO-виду, а идентификаторы — к виду «id <значение>».
+    Регистр самих идентификаторов сохраняется.
+    """
+    ids = []
+
+    def stash_id(match):
+        ids.append(match[1])
+        return f' id __id{len(ids) - 1}__ '
+
+    text = _ID_RE.sub(stash_id, text)
+    text = text.lower().replace('ё', 'е')
+    text = canonicalize_dates(text)
+    text = _PUNCT_RE.sub(' ', text)
+    text = _SPACES_RE.sub(' ', text).strip()
+    return _ID_PLACEHOLDER_RE.sub(lambda m: ids[int(m[1])], text)
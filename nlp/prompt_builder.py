@@ -0,0 +1,230 @@
+from collections import Counter
+from typing import NamedTuple, Optional
+import json
+import logging
+import math
+import re
+
+from decouple import config
+
+from nlp.normalize import canonicalize_dates
+from nlp.prompt_templates import SECTIONS, EXAMPLES, PromptExample, render_prompt
+
+try:
+    import tiktoken
+except ImportError:  # точный подсчет токенов необязателен
+    tiktoken = None
+
+
+logger = logging.getLogger(__name__)
+
+# Собирать промпт из релевантных вопросу примеров и разделов (иначе — полный SQL_SCHEMA)
+PROMPT_RETRIEVAL = config('PROMPT_RETRIEVAL', default=True, cast=bool)
+# Сколько примеров и необязательных разделов правил попадает в промпт
+PROMPT_TOP_EXAMPLES = config('PROMPT_TOP_EXAMPLES', default=3, cast=int)
+PROMPT_TOP_SECTIONS = config('PROMPT_TOP_SECTIONS', default=2, cast=int)
+# Дополнительные примеры: JSON-список [{"question": ..., "sql": ...}]
+PROMPT_EXAMPLES_PATH = config('PROMPT_EXAMPLES_PATH', default='')
+
+_WORD_RE = re.compile(r'[a-zа-яё_]+|\d{4}-\d{2}-\d{2}|\d+', re.IGNORECASE)
+# Окончания русских слов, отбрасываемые при стемминге (от длинных к коротким)
+_SUFFIXES = sorted((
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ых', 'их', 'ой', 'ей', 'ий', 'ый', 'ая', 'яя',
+    'ое', 'ее', 'ов', 'ев', 'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'ую', 'юю', 'ие', 'ые',
+    'ли', 'ло', 'ла', 'ть', 'ет', 'ют', 'ат', 'ят', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь',
+), key=len, reverse=True)
+# Слова, которые есть почти в каждом вопросе и не помогают выбору
+_STOP_WORDS = {'сколько', 'в', 'с', 'по', 'на', 'за', 'у', 'и', 'все', 'всех', 'есть', 'id', 'года'}
+_DATE_TOKEN_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+_NUMBER_RE = re.compile(r'^\d+$')
+
+
+def stem(word: str) -> str:
+    """Грубый стемминг: отбрасывает падежное окончание у слов длиннее 4 букв"""
+    if len(word) <= 4:
+        return word
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            return word[:-len(suffix)]
+    return word
+
+
+def tokenize(text: str) -> list:
+    """Термы для поиска: стеммы слов; даты и числа заменяются на общие признаки"""
+    terms = []
+    for word in _WORD_RE.findall(canonicalize_dates(text).lower()):
+        if word in _STOP_WORDS:
+            continue
+        if _DATE_TOKEN_RE.match(word):
+            terms.append('<date>')
+        elif _NUMBER_RE.match(word):
+            terms.append('<number>')
+        else:
+            terms.append(stem(word))
+    return terms
+
+
+def count_tokens(text: str) -> int:
+    """Число токенов: tiktoken, если установлен, иначе оценка по словам и знакам"""
+    if tiktoken is not None:
+        return len(_encoding().encode(text))
+    return len(re.findall(r'\w+|[^\w\s]', text))
+
+
+_ENCODING = None
+
+
+def _encoding():
+    global _ENCODING
+    if _ENCODING is None:
+        _ENCODING = tiktoken.get_encoding('cl100k_base')
+    return _ENCODING
+
+
+class TfidfIndex:
+    """TF-IDF по термам tokenize с косинусной близостью"""
+
+    def __init__(self, documents: list):
+        self.size = len(documents)
+        counts = [Counter(tokenize(document)) for document in documents]
+        document_frequency = Counter(term for terms in counts for term in terms)
+        # Сглаженный IDF: термы, которые есть во всех документах, получают малый, но ненулевой вес
+        self.idf = {
+            term: math.log((1 + self.size) / (1 + frequency)) + 1.0
+            for term, frequency in document_frequency.items()
+        }
+        self.vectors = [self._vector(terms) for terms in counts]
+
+    def _vector(self, terms: Counter) -> dict:
+        vector = {term: (1 + math.log(count)) * self.idf.get(term, 0.0) for term, count in terms.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+    def search(self, text: str, k: int) -> list:
+        """[(индекс документа, близость)] по убыванию близости, только с близостью > 0"""
+        query = self._vector(Counter(tokenize(text)))
+        scores = []
+        for idx, vector in enumerate(self.vectors):
+            score = sum(weight * vector.get(term, 0.0) for term, weight in query.items())
+            if score > 0:
+                scores.append((idx, score))
+        scores.sort(key=lambda item: item[1], reverse=True)
+        return scores[:k]
+
+
+class BuiltPrompt(NamedTuple):
+    """Системный промпт для вопроса и его размер"""
+    text: str
+    tokens: int
+    examples: list
+    sections: list
+
+
+class PromptBuilder:
+    """Компактный промпт: обязательные разделы, top-k похожих примеров и правил
+
+    Описание схемы обязательно и попадает в каждый промпт; отбор сокращает
+    только примеры и разделы правил. Раздел правил с keywords включается
+    и тогда, когда вопрос совпадает с ними (даты — по названию месяца).
+    """
+
+    def __init__(self, sections: list = SECTIONS, examples: list = EXAMPLES,
+                 top_examples: int = PROMPT_TOP_EXAMPLES, top_sections: int = PROMPT_TOP_SECTIONS,
+                 enabled: bool = PROMPT_RETRIEVAL):
+        self.sections = list(sections)
+        self.examples = list(examples)
+        self.top_examples = top_examples
+        self.top_sections = top_sections
+        self.enabled = enabled
+
+        self.rule_sections = [section for section in self.sections if not section.required]
+        self.example_index = TfidfIndex([example.question for example in self.examples])
+        self.section_index = TfidfIndex([section.text for section in self.rule_sections])
+
+        self.full_prompt = render_prompt(self.sections, self.examples)
+        self.full_tokens = count_tokens(self.full_prompt)
+        self.built = 0
+        self.total_tokens = 0
+
+    @classmethod
+    def from_config(cls) -> 'PromptBuilder':
+        examples = list(EXAMPLES)
+        if PROMPT_EXAMPLES_PATH:
+            examples.extend(load_examples(PROMPT_EXAMPLES_PATH))
+        return cls(examples=examples)
+
+    def build(self, question: str) -> BuiltPrompt:
+        """Промпт для вопроса"""
+        if not self.enabled:
+            prompt = BuiltPrompt(self.full_prompt, self.full_tokens, self.examples,
+                                 [section.name for section in self.sections])
+            self._account(prompt)
+            return prompt
+
+        examples = [self.examples[idx] for idx, _ in self.example_index.search(question, self.top_examples)]
+        if not examples:
+            # Ничего похожего — первые примеры как общий образец
+            examples = self.examples[:self.top_examples]
+
+        rules = {self.rule_sections[idx].name for idx, _ in self.section_index.search(question, self.top_sections)}
+        sections = [
+            section for section in self.sections
+            if section.required
+            or section.name in rules
+            or (section.keywords and re.search(section.keywords, question, re.IGNORECASE))
+        ]
+
+        text = render_prompt(sections, examples)
+        prompt = BuiltPrompt(text, count_tokens(text), examples, [section.name for section in sections])
+        self._account(prompt)
+        return prompt
+
+    def _account(self, prompt: BuiltPrompt):
+        self.built += 1
+        self.total_tokens += prompt.tokens
+        logger.info(
+            f"Промпт: {prompt.tokens} токенов (полный: {self.full_tokens}), "
+            f"разделы: {', '.join(prompt.sections)}, примеров: {len(prompt.examples)}"
+        )
+
+    def stats(self) -> dict:
+        """Средний размер промпта и экономия относительно полного"""
+        average = self.total_tokens / self.built if self.built else 0.0
+        return {
+            'prompts': self.built,
+            'full_tokens': self.full_tokens,
+            'avg_tokens': round(average, 1),
+            'saved_rate': 1 - average / self.full_tokens if self.built and self.full_tokens else 0.0,
+        }
+
+
+def load_examples(path: str) -> list:
+    """Примеры из JSON-файла [{"question": ..., "sql": ...}]"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Не удалось загрузить примеры из {path}: {e}")
+        return []
+    return [PromptExample(item['question'], item['sql'].strip().rstrip(';')) for item in data]
+
+
+def prompt_report(questions: list, builder: Optional[PromptBuilder] = None) -> dict:
+    """Размеры промптов для списка вопросов — для оценки экономии"""
+    builder = builder or PromptBuilder.from_config()
+    sizes = [builder.build(question).tokens for question in questions]
+    return {
+        'full_tokens': builder.full_tokens,
+        'min_tokens': min(sizes, default=0),
+        'max_tokens': max(sizes, default=0),
+        **builder.stats(),
+    }
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.WARNING)
+    # Вопросы из аргументов или вопросы примеров
+    questions = sys.argv[1:] or [example.question for example in EXAMPLES]
+    print(json.dumps(prompt_report(questions), ensure_ascii=False, indent=2))
@@ -1,9 +1,29 @@
-SQL_SCHEMA = """
+from typing import NamedTuple
+
+
+class PromptSection(NamedTuple):
+    """Часть системного промпта; required — включается в каждый запрос"""
+    name: str
+    text: str
+    required: bool = False
+    # Регулярное выражение: раздел правил включается, если вопрос с ним совпадает
+    keywords: str = ''
+
+
+class PromptExample(NamedTuple):
+    """Пример преобразования вопроса в SQL"""
+    question: str
+    sql: str
+
+
+HEADER = PromptSection('header', """
 # Схема базы данных для аналитики видео
+""", required=True)
 
+VIDEOS_TABLE = PromptSection('videos', """
 ## ТАБЛИЦЫ:
 
-1. Таблица videos (итоговая статистика по ролику):
+Таблица videos (итоговая статистика по ролику):
 - id (текст) — идентификатор видео
 - creator_id (текст) — идентификатор креатора
 - video_created_at (дата-время) — дата и время публикации видео
@@ -12,39 +32,84 @@ SQL_SCHEMA = """
 - comments_count (число) — финальное количество комментариев
 - reports_count (число) — финальное количество жалоб
 - created_at, updated_at (дата-время) — служебные поля
+""", required=True)
 
-2. Таблица video_snapshots (почасовые замеры по ролику):
+SNAPSHOTS_TABLE = PromptSection('video_snapshots', """
+Таблица video_snapshots (почасовые замеры по ролику):
 - id (текст) — идентификатор снапшота
 - video_id (текст) — ссылка на видео
 - views_count, likes_count, comments_count, reports_count (число) — текущие значения на момент замера
 - delta_views_count, delta_likes_count, delta_comments_count, delta_reports_count (число) — приращение с прошлого замера
 - created_at (дата-время) — время замера (раз в час)
+""", required=True)
 
+DATE_RULES = PromptSection('dates', """
 ## ПРАВИЛА ПРЕОБРАЗОВАНИЯ В SQL:
 
-1. Даты:
+Даты:
 - "28 ноября 2025" → DATE '2025-11-28'
 - "с 1 по 5 ноября 2025" → BETWEEN '2025-11-01' AND '2025-11-05'
 - "с 1 ноября 2025 по 5 ноября 2025 включительно" → BETWEEN '2025-11-01' AND '2025-11-05'
 - "27 ноября 2025" → DATE '2025-11-27'
+""", keywords=r'\d{4}|январ|феврал|март|апрел|\bма[йяе]\b|июн|июл|август|сентябр|октябр|ноябр|декабр'
+              r'|дат|дн[еяи]|день|числ|недел|месяц|год|час|сегодня|вчера|период')
 
-2. Агрегатные функции:
+AGGREGATE_RULES = PromptSection('aggregates', """
+Агрегатные функции:
 - "сколько всего" → COUNT(*)
 - "сумма просмотров" → SUM(views_count)
 - "сколько видео" → COUNT(DISTINCT video_id) или COUNT(*)
 - "прирост просмотров" → SUM(delta_views_count)
 - "на сколько просмотров" → SUM(delta_views_count)
 - "больше 100000" → > 100000
+""")
 
-3. Особые случаи:
+SPECIAL_RULES = PromptSection('special', """
+Особые случаи:
 - "сколько разных видео получали новые просмотры" → COUNT(DISTINCT video_id) WHERE delta_views_count > 0
 - "на сколько просмотров выросли" → SUM(delta_views_count)
 - "сколько видео у креатора" → COUNT(*) WHERE creator_id = '...'
+""")
 
-ВОЗВРАЩАЙ ТОЛЬКО SQL ЗАПРОС, БЕЗ ОБЪЯСНЕНИЙ!
+INSTRUCTION = PromptSection('instruction', """
+ВОЗВРАЩАЙ ТОЛЬКО SQL ЗАПРОС, БЕЗ ОБЪЯСНЕНИЙ! Заканчивай запрос точкой с запятой.
 Примеры преобразования:
-Вход: "Сколько всего видео есть в системе?" → SELECT COUNT(*) FROM videos
-Вход: "Сколько видео набрало больше 100000 просмотров за всё время?" → SELECT COUNT(*) FROM videos WHERE views_count > 100000
-Вход: "На сколько просмотров в сумме выросли все видео 28 ноября 2025?" → SELECT SUM(delta_views_count) FROM video_snapshots WHERE DATE(created_at) = '2025-11-28'
-Вход: "Сколько разных видео получали новые просмотры 27 ноября 2025?" → SELECT COUNT(DISTINCT video_id) FROM video_snapshots WHERE DATE(created_at) = '2025-11-27' AND delta_views_count > 0
-"""
\ No newline at end of file
+""", required=True)
+
+# Порядок разделов в промпте
+SECTIONS = [HEADER, VIDEOS_TABLE, SNAPSHOTS_TABLE, DATE_RULES, AGGREGATE_RULES, SPECIAL_RULES, INSTRUCTION]
+
+EXAMPLES = [
+    PromptExample("Сколько всего видео есть в системе?",
+                  "SELECT COUNT(*) FROM videos"),
+    PromptExample("Сколько видео набрало больше 100000 просмотров за всё время?",
+                  "SELECT COUNT(*) FROM videos WHERE views_count > 100000"),
+    PromptExample("На сколько просмотров в сумме выросли все видео 28 ноября 2025?",
+                  "SELECT SUM(delta_views_count) FROM video_snapshots WHERE DATE(created_at) = '2025-11-28'"),
+    PromptExample("Сколько разных видео получали новые просмотры 27 ноября 2025?",
+                  "SELECT COUNT(DISTINCT video_id) FROM video_snapshots "
+                  "WHERE DATE(created_at) = '2025-11-27' AND delta_views_count > 0"),
+    PromptExample("Сколько видео у креатора с id abc123 вышло с 1 по 5 ноября 2025?",
+                  "SELECT COUNT(*) FROM videos WHERE creator_id = 'abc123' "
+                  "AND DATE(video_created_at) BETWEEN '2025-11-01' AND '2025-11-05'"),
+    PromptExample("Сколько лайков в сумме у всех видео?",
+                  "SELECT SUM(likes_count) FROM videos"),
+    PromptExample("На сколько выросло число жалоб с 1 по 3 ноября 2025?",
+                  "SELECT SUM(delta_reports_count) FROM video_snapshots "
+                  "WHERE DATE(created_at) BETWEEN '2025-11-01' AND '2025-11-03'"),
+    PromptExample("Сколько видео опубликовал креатор с id abc123?",
+                  "SELECT COUNT(*) FROM videos WHERE creator_id = 'abc123'"),
+]
+
+
+def format_example(example: PromptExample) -> str:
+    return f'Вход: "{example.question}" → {example.sql};'
+
+
+def render_prompt(sections: list, examples: list) -> str:
+    """Системный промпт из разделов и примеров"""
+    return ''.join(section.text for section in sections) + '\n'.join(format_example(example) for example in examples) + '\n'
+
+
+# Полный промпт со всеми разделами и примерами
+SQL_SCHEMA = render_prompt(SECTIONS, EXAMPLES)
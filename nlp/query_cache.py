@@ -0,0 +1,170 @@
+from collections import OrderedDict
+from typing import Optional
+import asyncio
+import json
+import logging
+import os
+import time
+
+from nlp.normalize import normalize_question
+from monitoring.metrics import cache_lookups_total
+
+
+logger = logging.getLogger(__name__)
+
+# Пространство имен кэша вопросов в общем хранилище
+SHARED_NAMESPACE = 'questions'
+
+# Файл кэша перезаписывается после стольких новых записей (и при остановке бота)
+SAVE_EVERY = 20
+
+
+class QuestionCache:
+    """Кэш «вопрос -> SQL» с вытеснением LRU и временем жизни записей
+
+    Ключ — нормализованная форма вопроса (normalize_question). Если задан
+    path, кэш сохраняется в JSON-файл и переживает перезапуск бота. Если задан
+    store (общее хранилище KVStore), промахи локального кэша проверяются в нем,
+    а новые записи попадают туда для остальных экземпляров бота.
+    Файл пишется не на каждую запись, а каждые SAVE_EVERY записей и в flush()
+    при остановке — в отдельном потоке, чтобы не останавливать цикл событий.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 86400, path: Optional[str] = None, store=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path or None
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        # Записи, добавленные после последнего сохранения файла
+        self.unsaved = 0
+        self._saving = False
+        # ключ -> (sql, время истечения)
+        self._entries = OrderedDict()
+        if self.path:
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, question: str) -> Optional[str]:
+        """Возвращает SQL для вопроса или None"""
+        key = normalize_question(question)
+        entry = self._entries.get(key)
+        if entry is not None:
+            sql, expires_at = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return sql
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, question: str, sql: str):
+        """Сохраняет SQL для вопроса (в файл — при следующем flush)"""
+        self._put_key(normalize_question(question), sql)
+        self.unsaved += 1
+
+    def _put_key(self, key: str, sql: str):
+        self._entries[key] = (sql, time.time() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def lookup(self, question: str) -> Optional[str]:
+        """Как get, но при промахе проверяет общее хранилище"""
+        sql = self.get(question)
+        if sql is not None or self.store is None:
+            cache_lookups_total.inc(cache='question', result='hit' if sql is not None else 'miss')
+            return sql
+
+        key = normalize_question(question)
+        sql = await self.store.get(SHARED_NAMESPACE, key)
+        if sql:
+            self._put_key(key, sql)
+            self.misses -= 1
+            self.hits += 1
+            self.shared_hits += 1
+            cache_lookups_total.inc(cache='question', result='shared_hit')
+            return sql
+        cache_lookups_total.inc(cache='question', result='miss')
+        return None
+
+    async def remember(self, question: str, sql: str):
+        """Как put, но запись попадает и в общее хранилище"""
+        self.put(question, sql)
+        if self.unsaved >= SAVE_EVERY:
+            await self.flush()
+        if self.store is not None:
+            await self.store.set(SHARED_NAMESPACE, normalize_question(question), sql, ttl=self.ttl)
+
+    def clear(self):
+        self._entries.clear()
+        if self.path:
+            self.save()
+
+    def stats(self) -> dict:
+        """Счетчики попаданий и промахов"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'shared_hits': self.shared_hits,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    def load(self):
+        """Загружает непросроченные записи из файла"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось загрузить кэш вопросов из {self.path}: {e}")
+            return
+
+        now = time.time()
+        for key, sql, expires_at in data:
+            if expires_at > now:
+                self._entries[key] = (sql, expires_at)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        logger.info(f"Загружено {len(self._entries)} записей кэша вопросов")
+
+    async def flush(self):
+        """Сохраняет несохраненные записи в файл в отдельном потоке"""
+        if not self.path or not self.unsaved or self._saving:
+            return
+        self._saving = True
+        data = self._dump()
+        self.unsaved = 0
+        try:
+            await asyncio.to_thread(self._write, data)
+        finally:
+            self._saving = False
+
+    def save(self):
+        """Атомарно сохраняет кэш в файл"""
+        self.unsaved = 0
+        self._write(self._dump())
+
+    def _dump(self) -> list:
+        return [[key, sql, expires_at] for key, (sql, expires_at) in self._entries.items()]
+
+    def _write(self, data: list):
+        # Временный файл у каждого процесса свой: воркеры вебхука пишут один кэш
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить кэш вопросов в {self.path}: {e}")
@@ -1,38 +1,135 @@
-from openai import AsyncOpenAI
+from collections import Counter
+from typing import NamedTuple, Optional
 import logging
+import time
 from decouple import config
-from nlp.prompt_templates import SQL_SCHEMA
+from nlp.prompt_builder import PromptBuilder
+from nlp.query_cache import QuestionCache
+from nlp.fast_path import match_fast_path
+from nlp.llm_client import LLMClient, LLM_ATTEMPT_TIMEOUT
+from monitoring.metrics import llm_seconds, parse_seconds, parse_total
 
 logger = logging.getLogger(__name__)
 
 OPENAI_API_KEY=config('OPENAI_API_KEY')
 
-client = AsyncOpenAI(
-  base_url="https://openrouter.ai/api/v1",
-  api_key=OPENAI_API_KEY,
+# Кэш сгенерированного SQL по нормализованному вопросу
+question_cache = QuestionCache(
+    maxsize=config('QUESTION_CACHE_SIZE', default=1024, cast=int),
+    ttl=config('QUESTION_CACHE_TTL', default=86400, cast=float),
+    path=config('QUESTION_CACHE_PATH', default=''),
 )
 
-async def parse_with_openai(query: str) -> str:
+
+def set_shared_store(store):
+    """Подключает общее хранилище к кэшу вопросов (только если его видят другие процессы)"""
+    question_cache.store = store if store is not None and store.shared else None
+
+
+LLM_BASE_URL = config('LLM_BASE_URL', default="https://openrouter.ai/api/v1")
+
+# Клиент модели создается при первом вопросе, которому нужна модель:
+# импорт openai заметно удлиняет запуск бота
+client = None
+llm_client = None
+
+
+def get_llm_client():
+    """Клиент модели (создается при первом обращении)"""
+    global client, llm_client
+    if llm_client is None:
+        from openai import AsyncOpenAI
+
+        # Повторы и сроки — на стороне LLMClient, поэтому собственные повторы SDK выключены
+        client = AsyncOpenAI(
+          base_url=LLM_BASE_URL,
+          api_key=OPENAI_API_KEY,
+          max_retries=0,
+          timeout=LLM_ATTEMPT_TIMEOUT,
+        )
+        llm_client = LLMClient(client)
+    return llm_client
+
+
+def set_llm_backend(backend):
+    """Подменяет источник SQL: объект с async complete_sql(messages) -> Optional[str]
+
+    Используется прогоном корпуса вопросов (tools/qa_bench.py) для записи
+    и воспроизведения ответов модели без сети.
+    """
+    global llm_client
+    llm_client = backend
+
+
+# Промпт из релевантных вопросу примеров и разделов схемы
+prompt_builder = PromptBuilder.from_config()
+
+async def parse_with_openai(query: str) -> Optional[str]:
         """Использование OpenAI для парсинга"""
-        try:
-            completion = await client.chat.completions.create(
-                model="nex-agi/deepseek-v3.1-nex-n1:free",
-                messages=
-                    [
-                            {"role": "system", "content": SQL_SCHEMA},
-                            {"role": "user", "content": f"Вход: {query}"}
-                        ],
-            )
-            sql = completion.choices[0].message.content.strip()
-            # Убираем возможные кавычки
-            sql = sql.replace('```sql', '').replace('```', '').strip()
-            logger.info(f'sql: {sql}')
-            return sql
-        
-        except Exception as e:
-            logger.error(f"Ошибка OpenAI: {e}")
-
-
-            
-    
-    
\ No newline at end of file
+        prompt = prompt_builder.build(query)
+        started = time.perf_counter()
+        sql = await get_llm_client().complete_sql(
+            [
+                {"role": "system", "content": prompt.text},
+                {"role": "user", "content": f"Вход: {query}"}
+            ],
+        )
+        llm_seconds.observe(time.perf_counter() - started, outcome='ok' if sql else 'empty')
+        logger.info(f'sql: {sql}')
+        return sql
+
+
+# Источники ответа
+PATH_FAST = 'fast_path'
+PATH_CACHE = 'cache'
+PATH_LLM = 'llm'
+
+# Сколько вопросов разобрано каждым путем
+path_counters = Counter()
+
+
+class ParsedQuestion(NamedTuple):
+    """SQL для вопроса и путь, которым он получен"""
+    sql: str
+    params: dict
+    path: str
+    template: Optional[str] = None
+
+
+def path_stats() -> dict:
+    """Счетчики путей разбора и доля вопросов без обращения к модели"""
+    total = sum(path_counters.values())
+    return {
+        **{path: path_counters[path] for path in (PATH_FAST, PATH_CACHE, PATH_LLM)},
+        'llm_saved_rate': (total - path_counters[PATH_LLM]) / total if total else 0.0,
+    }
+
+
+def _count_path(path: str, started: float):
+    path_counters[path] += 1
+    parse_total.inc(path=path)
+    parse_seconds.observe(time.perf_counter() - started, path=path)
+
+
+async def parse_question(query: str) -> Optional[ParsedQuestion]:
+    """Возвращает SQL для вопроса: локальным разбором, из кэша или через модель"""
+    started = time.perf_counter()
+    fast = match_fast_path(query)
+    if fast is not None:
+        _count_path(PATH_FAST, started)
+        logger.info(f"Вопрос разобран локально по шаблону {fast.template}: {path_stats()}")
+        return ParsedQuestion(fast.sql, fast.params, PATH_FAST, fast.template)
+
+    sql = await question_cache.lookup(query)
+    if sql:
+        _count_path(PATH_CACHE, started)
+        logger.info(f"SQL взят из кэша вопросов: {question_cache.stats()}, {path_stats()}")
+        return ParsedQuestion(sql, {}, PATH_CACHE)
+
+    sql = await parse_with_openai(query)
+    if not sql:
+        return None
+    _count_path(PATH_LLM, started)
+    await question_cache.remember(query, sql)
+    logger.info(f"SQL сгенерирован моделью: {path_stats()}")
+    return ParsedQuestion(sql, {}, PATH_LLM)
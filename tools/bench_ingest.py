@@ -0,0 +1,173 @@
+"""Замер импорта: main_db на локальном Postgres (настройки БД из .env)
+
+    python -m tools.bench_ingest --generate 10000 --snapshots 240 --reset --repeat 2
+    python -m tools.bench_ingest --file data/bench.json --workers 4 --json bench.json
+
+Для каждого прогона выводятся время, записей/с, строк/с (видео + снимки,
+реально добавленные в БД), пиковый RSS процесса и воркеров, время по фазам
+импорта. Второй прогон того же файла показывает инкрементальный путь.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.gen_dataset import DatasetGenerator, generate
+
+
+logger = logging.getLogger(__name__)
+
+TRUNCATE_SQL = """
+    TRUNCATE daily_totals, daily_creator_stats, daily_video_stats,
+             video_import_state, video_snapshots, videos
+"""
+
+
+def peak_rss_mb() -> tuple:
+    """Пиковый RSS (МБ) этого процесса и завершившихся дочерних (воркеров конвейера)"""
+    # ru_maxrss в Linux — килобайты, в macOS — байты
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return round(own, 1), round(children, 1)
+
+
+async def table_counts(engine) -> tuple:
+    from sqlalchemy import text
+
+    async with engine.connect() as conn:
+        videos = await conn.scalar(text('SELECT COUNT(*) FROM videos'))
+        snapshots = await conn.scalar(text('SELECT COUNT(*) FROM video_snapshots'))
+    return videos, snapshots
+
+
+async def run_benchmark(args) -> list:
+    # Настройки импорта читаются при импорте модулей, поэтому задаются до него
+    os.environ['JSON_FILE_PATH'] = args.file
+    if args.batch_size:
+        os.environ['IMPORT_BATCH_SIZE'] = str(args.batch_size)
+
+    from sqlalchemy import text
+    from database.init_db import main_db
+    from database.migrations import ensure_schema
+    from database.models import engine
+    from database.timing import import_phases
+
+    if args.quiet:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    async with engine.begin() as conn:
+        await ensure_schema(conn)
+        if args.reset:
+            await conn.execute(text(TRUNCATE_SQL))
+            logger.warning("Таблицы импорта очищены")
+
+    results = []
+    try:
+        for run in range(1, args.repeat + 1):
+            videos_before, snapshots_before = await table_counts(engine)
+            import_phases.reset()
+
+            started = time.perf_counter()
+            inserted, updated, skipped, errors = await main_db(workers=args.workers, writers=args.writers)
+            elapsed = time.perf_counter() - started
+
+            videos_after, snapshots_after = await table_counts(engine)
+            records = inserted + updated + skipped + errors
+            rows = (videos_after - videos_before) + (snapshots_after - snapshots_before)
+            own_rss, children_rss = peak_rss_mb()
+            results.append({
+                'run': run,
+                'seconds': round(elapsed, 3),
+                'records': records,
+                'inserted': inserted,
+                'updated': updated,
+                'skipped': skipped,
+                'errors': errors,
+                'records_per_second': round(records / elapsed, 1) if elapsed else 0.0,
+                'rows_added': rows,
+                'rows_per_second': round(rows / elapsed, 1) if elapsed else 0.0,
+                'peak_rss_mb': own_rss,
+                'workers_peak_rss_mb': children_rss,
+                'phases': import_phases.summary(),
+            })
+    finally:
+        await engine.dispose()
+    return results
+
+
+def print_results(results: list):
+    for result in results:
+        print(
+            f"Прогон {result['run']}: {result['seconds']:.2f} с, "
+            f"{result['records']} записей ({result['records_per_second']:.0f}/с), "
+            f"+{result['rows_added']} строк ({result['rows_per_second']:.0f} строк/с), "
+            f"пиковый RSS {result['peak_rss_mb']} МБ (воркеры {result['workers_peak_rss_mb']} МБ)"
+        )
+        print(
+            f"  добавлено {result['inserted']}, обновлено {result['updated']}, "
+            f"без изменений {result['skipped']}, ошибок {result['errors']}"
+        )
+        for phase, timing in result['phases'].items():
+            share = timing['seconds'] / result['seconds'] * 100 if result['seconds'] else 0.0
+            print(f"  {phase:<16} {timing['seconds']:>9.3f} с  {share:5.1f}%  ({timing['calls']} раз)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер импорта videos.json")
+    parser.add_argument('--file', help="готовый файл данных")
+    parser.add_argument('--generate', type=int, default=0, metavar='VIDEOS',
+                        help="сгенерировать файл с таким числом видео во временный каталог")
+    parser.add_argument('--creators', type=int, default=100)
+    parser.add_argument('--snapshots', type=int, default=24, help="снимков на видео при генерации")
+    parser.add_argument('--duplicate-ratio', type=float, default=0.0)
+    parser.add_argument('--update-ratio', type=float, default=0.0)
+    parser.add_argument('--workers', type=int, default=1, help="как в init_db.py --workers")
+    parser.add_argument('--writers', type=int, default=0, help="как в init_db.py --writers")
+    parser.add_argument('--batch-size', type=int, default=0, help="IMPORT_BATCH_SIZE для замера")
+    parser.add_argument('--repeat', type=int, default=1, help="число прогонов одного файла")
+    parser.add_argument('--reset', action='store_true', help="очистить таблицы импорта перед замером")
+    parser.add_argument('--quiet', action='store_true', help="не выводить лог импорта")
+    parser.add_argument('--json', help="записать результаты в JSON-файл")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    temp_path = None
+    if args.generate:
+        temp_path = os.path.join(tempfile.mkdtemp(prefix='bench_ingest_'), 'videos.json')
+        generator = DatasetGenerator(
+            creators=args.creators, snapshots=args.snapshots, snapshots_jitter=0,
+            start=datetime(2025, 11, 1, tzinfo=timezone.utc), seed=1,
+        )
+        started = time.perf_counter()
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            stats = generate(f, args.generate, generator, args.duplicate_ratio, args.update_ratio)
+        logger.info(f"Данные сгенерированы за {time.perf_counter() - started:.1f} с: {stats}")
+        args.file = temp_path
+    elif not args.file:
+        parser.error("нужен --file или --generate")
+
+    try:
+        results = asyncio.run(run_benchmark(args))
+    finally:
+        if temp_path:
+            os.remove(temp_path)
+            os.rmdir(os.path.dirname(temp_path))
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
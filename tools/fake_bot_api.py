@@ -0,0 +1,164 @@
+"""Локальный сервер, имитирующий Telegram Bot API
+
+Нужен для проверки бота без Telegram, в том числе режима webhook с
+несколькими воркерами. Запуск:
+
+    python -m tools.fake_bot_api --port 8081
+
+В .env бота: TELEGRAM_API_URL=http://localhost:8081, для webhook —
+WEBHOOK_URL=http://localhost:8080. Вопросы отправляются так:
+
+    curl -X POST localhost:8081/_send -d '{"text": "Сколько всего видео есть в системе?", "count": 1000, "concurrency": 50}'
+
+Ответ содержит число доставленных обновлений, полученных ответов бота и скорость.
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import time
+
+from aiohttp import ClientSession, web
+
+
+logger = logging.getLogger(__name__)
+
+
+class FakeBotAPI:
+    def __init__(self):
+        self.webhook_url = ''
+        self.webhook_secret = ''
+        self.updates = asyncio.Queue()
+        self.sent_messages = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._replies = asyncio.Condition()
+
+    def make_update(self, text: str, user_id: int) -> dict:
+        update_id = next(self._update_ids)
+        return {
+            'update_id': update_id,
+            'message': {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'},
+                'text': text,
+            },
+        }
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = dict(await request.post()) if request.can_read_body else {}
+        params.update(request.query)
+
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}
+        elif method == 'setWebhook':
+            self.webhook_url = params.get('url', '')
+            self.webhook_secret = params.get('secret_token', '')
+            logger.info(f"Webhook: {self.webhook_url}")
+            result = True
+        elif method == 'deleteWebhook':
+            self.webhook_url = ''
+            result = True
+        elif method == 'getUpdates':
+            result = await self._get_updates(float(params.get('timeout', 0) or 0))
+        elif method == 'sendMessage':
+            result = await self._send_message(params)
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _get_updates(self, timeout: float) -> list:
+        updates = []
+        try:
+            updates.append(await asyncio.wait_for(self.updates.get(), timeout=max(timeout, 0.1)))
+        except asyncio.TimeoutError:
+            return updates
+        while not self.updates.empty():
+            updates.append(self.updates.get_nowait())
+        return updates
+
+    async def _send_message(self, params: dict) -> dict:
+        chat_id = int(params.get('chat_id', 0))
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': params.get('text', ''),
+        }
+        async with self._replies:
+            self.sent_messages.append(message)
+            self._replies.notify_all()
+        return message
+
+    async def _deliver(self, session: ClientSession, update: dict):
+        if not self.webhook_url:
+            await self.updates.put(update)
+            return
+        headers = {'X-Telegram-Bot-Api-Secret-Token': self.webhook_secret} if self.webhook_secret else {}
+        async with session.post(self.webhook_url, json=update, headers=headers) as response:
+            response.raise_for_status()
+
+    async def handle_send(self, request: web.Request) -> web.Response:
+        """Отправляет боту count вопросов и ждет ответов"""
+        body = await request.json()
+        text = body.get('text', 'Сколько всего видео есть в системе?')
+        count = int(body.get('count', 1))
+        concurrency = int(body.get('concurrency', 10))
+        users = int(body.get('users', count))
+        timeout = float(body.get('timeout', 60))
+
+        replies_before = len(self.sent_messages)
+        semaphore = asyncio.Semaphore(concurrency)
+        started = time.perf_counter()
+
+        async with ClientSession() as session:
+            async def send(idx):
+                async with semaphore:
+                    await self._deliver(session, self.make_update(text, 1000 + idx % users))
+
+            results = await asyncio.gather(*(send(idx) for idx in range(count)), return_exceptions=True)
+        delivered = sum(1 for result in results if not isinstance(result, Exception))
+        delivered_at = time.perf_counter()
+
+        async with self._replies:
+            try:
+                await asyncio.wait_for(
+                    self._replies.wait_for(lambda: len(self.sent_messages) - replies_before >= delivered),
+                    timeout,
+                )
+            except asyncio.TimeoutError:
+                pass
+        finished = time.perf_counter()
+        replies = len(self.sent_messages) - replies_before
+
+        return web.json_response({
+            'delivered': delivered,
+            'failed': count - delivered,
+            'replies': replies,
+            'delivery_seconds': round(delivered_at - started, 3),
+            'total_seconds': round(finished - started, 3),
+            'updates_per_second': round(replies / (finished - started), 1) if finished > started else 0,
+        })
+
+    async def handle_messages(self, request: web.Request) -> web.Response:
+        return web.json_response(self.sent_messages[-int(request.query.get('last', 100)):])
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{method}', self.handle_method)
+        app.router.add_post('/_send', self.handle_send)
+        app.router.add_get('/_messages', self.handle_messages)
+        return app
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Имитация Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+
+    web.run_app(FakeBotAPI().app(), host=args.host, port=args.port)
@@ -0,0 +1,165 @@
+"""Генератор синтетического videos.json для проверки и замеров импорта
+
+Файл пишется потоково, поэтому объем ограничен только диском:
+
+    python -m tools.gen_dataset --videos 100000 --snapshots 240 --output data/bench.json
+
+Формат совпадает с тем, что читает database.init_db.load_json_data: список
+видео (--layout list) или объект с ключом videos/data. Повторы (--duplicate-ratio)
+выдают видео, уже встречавшееся в файле, без изменений; обновления
+(--update-ratio) — то же видео с дополнительными снимками.
+"""
+from datetime import datetime, timedelta, timezone
+import argparse
+import json
+import logging
+import random
+import sys
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних видео помнить как кандидатов для повторов
+RECENT_WINDOW = 1000
+
+
+def _isoformat(moment: datetime) -> str:
+    return moment.isoformat()
+
+
+class DatasetGenerator:
+    """Детерминированные видео и снимки: одно и то же (seed, номер) дает ту же запись"""
+
+    def __init__(self, creators: int, snapshots: int, snapshots_jitter: int, start: datetime, seed: int):
+        self.creators = creators
+        self.snapshots = snapshots
+        self.snapshots_jitter = snapshots_jitter
+        self.start = start
+        self.seed = seed
+
+    def video(self, number: int, extra_snapshots: int = 0) -> dict:
+        rng = random.Random(self.seed * 1_000_003 + number)
+        video_id = f'{rng.getrandbits(128):032x}'
+        creator_id = f'{random.Random(self.seed + rng.randrange(self.creators)).getrandbits(128):032x}'
+        published = self.start + timedelta(minutes=rng.randrange(60 * 24 * 30))
+        count = max(0, self.snapshots + rng.randint(-self.snapshots_jitter, self.snapshots_jitter)) + extra_snapshots
+
+        # Популярность видео: небольшая доля роликов набирает основную часть просмотров
+        popularity = rng.paretovariate(1.2)
+        totals = {'views_count': 0, 'likes_count': 0, 'comments_count': 0, 'reports_count': 0}
+        snapshots = []
+        first_snapshot = published.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        for hour in range(count):
+            moment = first_snapshot + timedelta(hours=hour)
+            deltas = {
+                'views_count': int(rng.expovariate(1.0) * 50 * popularity),
+                'likes_count': int(rng.expovariate(1.0) * 3 * popularity),
+                'comments_count': int(rng.expovariate(1.0) * 0.5 * popularity),
+                'reports_count': 1 if rng.random() < 0.01 else 0,
+            }
+            for key, delta in deltas.items():
+                totals[key] += delta
+            snapshot = {
+                'id': f'{rng.getrandbits(128):032x}',
+                'video_id': video_id,
+                **totals,
+                **{f'delta_{key}': delta for key, delta in deltas.items()},
+                'created_at': _isoformat(moment),
+                'updated_at': _isoformat(moment),
+            }
+            snapshots.append(snapshot)
+
+        last = datetime.fromisoformat(snapshots[-1]['created_at']) if snapshots else published
+        return {
+            'id': video_id,
+            'creator_id': creator_id,
+            'video_created_at': _isoformat(published),
+            **totals,
+            'created_at': _isoformat(published),
+            'updated_at': _isoformat(last),
+            'snapshots': snapshots,
+        }
+
+
+def generate(output, videos: int, generator: DatasetGenerator, duplicate_ratio: float = 0.0,
+             update_ratio: float = 0.0, layout: str = 'list', seed: int = 0) -> dict:
+    """Пишет набор данных в открытый файл output и возвращает статистику"""
+    rng = random.Random(seed)
+    recent = []
+    stats = {'videos': 0, 'unique_videos': 0, 'duplicates': 0, 'updates': 0, 'snapshots': 0}
+
+    if layout == 'list':
+        output.write('[\n')
+    else:
+        output.write(f'{{"source": "gen_dataset", "{layout}": [\n')
+
+    number = 0
+    for position in range(videos):
+        roll = rng.random()
+        if recent and roll < duplicate_ratio:
+            video = generator.video(rng.choice(recent))
+            stats['duplicates'] += 1
+        elif recent and roll < duplicate_ratio + update_ratio:
+            video = generator.video(rng.choice(recent), extra_snapshots=rng.randint(1, 3))
+            stats['updates'] += 1
+        else:
+            video = generator.video(number)
+            recent.append(number)
+            if len(recent) > RECENT_WINDOW:
+                recent.pop(rng.randrange(len(recent)))
+            number += 1
+            stats['unique_videos'] += 1
+
+        if position:
+            output.write(',\n')
+        json.dump(video, output, ensure_ascii=False, separators=(',', ':'))
+        stats['videos'] += 1
+        stats['snapshots'] += len(video['snapshots'])
+
+        if stats['videos'] % 10000 == 0:
+            logger.info(f"Сгенерировано {stats['videos']} видео, {stats['snapshots']} снимков")
+
+    output.write('\n]' if layout == 'list' else '\n]}')
+    output.write('\n')
+    return stats
+
+
+def main(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description="Генератор синтетического videos.json")
+    parser.add_argument('--videos', type=int, default=1000, help="количество видео в файле (с повторами)")
+    parser.add_argument('--creators', type=int, default=100, help="количество креаторов")
+    parser.add_argument('--snapshots', type=int, default=24, help="среднее число почасовых снимков на видео")
+    parser.add_argument('--snapshots-jitter', type=int, default=0, help="разброс числа снимков (±)")
+    parser.add_argument('--duplicate-ratio', type=float, default=0.0, help="доля точных повторов видео")
+    parser.add_argument('--update-ratio', type=float, default=0.0, help="доля повторов с новыми снимками")
+    parser.add_argument('--layout', choices=('list', 'videos', 'data'), default='list',
+                        help="список в корне или объект с ключом videos/data")
+    parser.add_argument('--start', default='2025-11-01', help="дата, с которой публикуются видео")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='-', help="путь к файлу ('-' — stdout)")
+    args = parser.parse_args(argv)
+
+    generator = DatasetGenerator(
+        creators=args.creators,
+        snapshots=args.snapshots,
+        snapshots_jitter=args.snapshots_jitter,
+        start=datetime.fromisoformat(args.start).replace(tzinfo=timezone.utc),
+        seed=args.seed,
+    )
+
+    started = time.perf_counter()
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    try:
+        stats = generate(output, args.videos, generator, args.duplicate_ratio, args.update_ratio,
+                         args.layout, args.seed)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    logger.info(f"Готово за {time.perf_counter() - started:.1f} с: {stats}")
+    return stats
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    main()
@@ -0,0 +1,161 @@
+"""Локальная имитация OpenAI-совместимого API для проверки LLMClient
+
+Отвечает на POST /v1/chat/completions (обычный и потоковый ответ) с
+настраиваемыми задержками и ошибками. Запуск:
+
+    python -m tools.llm_stub --port 8090 --delay 0.5 --slow-rate 0.1 --slow-delay 8 --fail-rate 0.05
+
+В .env бота: LLM_BASE_URL=http://localhost:8090/v1. Поведение можно задать
+отдельно для модели: --model-delay fallback-model=0.2. Статистика запросов —
+GET /_stats.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import re
+import time
+import uuid
+from collections import Counter
+
+from aiohttp import web
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SQL = 'SELECT COUNT(*) FROM videos;'
+
+# Пояснение, которое модель часто пишет после запроса — его не нужно дочитывать
+TRAILING_TEXT = (
+    '\n\nЭтот запрос считает количество строк в таблице videos. '
+    'Если нужно учитывать только определенный период, добавьте условие по дате.'
+)
+
+_QUESTION_RE = re.compile(r'Вход:\s*(.*)', re.DOTALL)
+
+
+class LLMStub:
+    def __init__(self, args):
+        self.delay = args.delay
+        self.jitter = args.jitter
+        self.slow_rate = args.slow_rate
+        self.slow_delay = args.slow_delay
+        self.fail_rate = args.fail_rate
+        self.token_delay = args.token_delay
+        self.trailing = not args.no_trailing
+        self.model_delays = dict(self._parse_model_delay(item) for item in args.model_delay)
+        self.answers = {}
+        if args.answers:
+            with open(args.answers, 'r', encoding='utf-8') as f:
+                self.answers = json.load(f)
+        self.counters = Counter()
+
+    @staticmethod
+    def _parse_model_delay(item: str):
+        model, _, seconds = item.partition('=')
+        return model, float(seconds)
+
+    def _answer(self, messages: list) -> str:
+        """SQL для вопроса из файла ответов или запрос по умолчанию"""
+        question = ''
+        for message in messages:
+            if message.get('role') == 'user':
+                match = _QUESTION_RE.search(message.get('content', ''))
+                question = (match[1] if match else message.get('content', '')).strip()
+        sql = self.answers.get(question, DEFAULT_SQL)
+        if not sql.rstrip().endswith(';'):
+            sql = sql.rstrip() + ';'
+        return sql + (TRAILING_TEXT if self.trailing else '')
+
+    async def _latency(self, model: str):
+        delay = self.model_delays.get(model, self.delay) + random.uniform(0, self.jitter)
+        if random.random() < self.slow_rate:
+            self.counters['slow'] += 1
+            delay = self.slow_delay
+        await asyncio.sleep(delay)
+
+    async def handle_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        model = body.get('model', 'stub')
+        self.counters['requests'] += 1
+        self.counters[f'model:{model}'] += 1
+
+        if random.random() < self.fail_rate:
+            self.counters['failed'] += 1
+            status = random.choice((429, 500, 503))
+            return web.json_response({'error': {'message': 'stub failure', 'code': status}}, status=status)
+
+        await self._latency(model)
+        content = self._answer(body.get('messages', []))
+        completion_id = f'chatcmpl-{uuid.uuid4().hex[:12]}'
+        created = int(time.time())
+
+        if not body.get('stream'):
+            return web.json_response({
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': created,
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': content},
+                    'finish_reason': 'stop',
+                }],
+            })
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        # Ответ отдается кусками по несколько символов, как токены модели
+        tokens = re.findall(r'\S+\s*|\s+', content)
+        sent = 0
+        try:
+            for token in tokens:
+                chunk = {
+                    'id': completion_id,
+                    'object': 'chat.completion.chunk',
+                    'created': created,
+                    'model': model,
+                    'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}],
+                }
+                await response.write(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode('utf-8'))
+                sent += 1
+                await asyncio.sleep(self.token_delay)
+            await response.write(b'data: [DONE]\n\n')
+            await response.write_eof()
+        except (ConnectionResetError, asyncio.CancelledError):
+            # Клиент прочитал законченный SQL и закрыл поток
+            self.counters['stopped_early'] += 1
+            self.counters['tokens_saved'] += len(tokens) - sent
+            raise
+        return response
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(self.counters))
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self.handle_completions)
+        app.router.add_post('/chat/completions', self.handle_completions)
+        app.router.add_get('/_stats', self.handle_stats)
+        return app
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Имитация OpenAI-совместимого API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--delay', type=float, default=0.5, help="задержка до первого токена, с")
+    parser.add_argument('--jitter', type=float, default=0.2, help="случайная добавка к задержке, с")
+    parser.add_argument('--slow-rate', type=float, default=0.0, help="доля очень медленных ответов")
+    parser.add_argument('--slow-delay', type=float, default=10.0, help="задержка медленного ответа, с")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="доля ответов 429/5xx")
+    parser.add_argument('--token-delay', type=float, default=0.02, help="пауза между токенами потока, с")
+    parser.add_argument('--no-trailing', action='store_true', help="не добавлять пояснение после SQL")
+    parser.add_argument('--model-delay', action='append', default=[], metavar='MODEL=SECONDS',
+                        help="своя задержка для модели")
+    parser.add_argument('--answers', help="JSON-файл {вопрос: SQL}")
+    args = parser.parse_args()
+
+    web.run_app(LLMStub(args).app(), host=args.host, port=args.port)
@@ -0,0 +1,344 @@
+"""Прогон корпуса вопросов через тот же конвейер, что и бот
+
+    python -m tools.qa_bench --llm oracle --passes 2
+    python -m tools.qa_bench --llm live --record data/qa_recordings.json
+    python -m tools.qa_bench --llm replay --recordings data/qa_recordings.json --json qa.json
+
+Вопросы (tools/qa_corpus.json) проходят parse_question и execute_query, как
+в обработчике generating. Ожидаемый ответ — результат эталонного SQL на
+загруженных данных (например, сгенерированных tools/gen_dataset.py), выполненного
+напрямую, без агрегатов и кэшей. Плейсхолдер {creator} заменяется креатором
+с наибольшим числом видео.
+
+Источник SQL для вопросов, не разобранных локально (--llm):
+    live   — модель из настроек (LLM_BASE_URL, LLM_MODEL); --record сохраняет ответы
+    replay — записанные ответы из --recordings, без сети
+    oracle — эталонный SQL корпуса: проверка конвейера без ошибок модели
+
+Выводятся p50/p95/p99 по стадиям (разбор, выполнение, всего), попадания
+в кэш вопросов и результатов, пути разбора и доля правильных ответов.
+"""
+from collections import Counter, defaultdict
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+logger = logging.getLogger(__name__)
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qa_corpus.json')
+
+TOP_CREATOR_SQL = """
+    SELECT creator_id FROM videos
+    GROUP BY creator_id
+    ORDER BY COUNT(*) DESC, creator_id
+    LIMIT 1
+"""
+
+STAGES = ('parse', 'execute', 'total')
+PERCENTILES = (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))
+
+
+def question_from_messages(messages: list) -> str:
+    """Текст вопроса из сообщения пользователя ("Вход: ...")"""
+    for message in reversed(messages):
+        if message['role'] == 'user':
+            return message['content'].removeprefix('Вход:').strip()
+    return ''
+
+
+class ReplayLLM:
+    """Отдает записанный SQL по тексту вопроса вместо обращения к модели"""
+
+    def __init__(self, recordings: dict, delay: float = 0.0):
+        self.recordings = recordings
+        self.delay = delay
+        self.counters = Counter()
+
+    async def complete_sql(self, messages: list) -> Optional[str]:
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        sql = self.recordings.get(question_from_messages(messages))
+        self.counters['replayed' if sql else 'missing'] += 1
+        return sql
+
+    def stats(self) -> dict:
+        return dict(self.counters)
+
+
+class RecordingLLM:
+    """Обертка над клиентом модели, запоминающая ответы для ReplayLLM"""
+
+    def __init__(self, inner, recordings: Optional[dict] = None):
+        self.inner = inner
+        self.recordings = recordings if recordings is not None else {}
+
+    async def complete_sql(self, messages: list) -> Optional[str]:
+        sql = await self.inner.complete_sql(messages)
+        if sql:
+            self.recordings[question_from_messages(messages)] = sql
+        return sql
+
+    def stats(self) -> dict:
+        return {**self.inner.stats(), 'recorded': len(self.recordings)}
+
+
+def load_json(path: str, default):
+    if not path or not os.path.exists(path):
+        return default
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def percentile(values: list, share: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+def latency_summary(values: list) -> dict:
+    """Перцентили задержки в миллисекундах"""
+    return {
+        'count': len(values),
+        **{name: round(percentile(values, share) * 1000, 2) for name, share in PERCENTILES},
+        'max': round(max(values, default=0.0) * 1000, 2),
+    }
+
+
+def to_number(answer: str) -> Optional[float]:
+    try:
+        return float(answer)
+    except (TypeError, ValueError):
+        return None
+
+
+def same_answer(actual: str, expected: str, tolerance: float = 0.0) -> bool:
+    """Ответы совпадают: числа — с допуском tolerance, остальное — как строки"""
+    actual_number, expected_number = to_number(actual), to_number(expected)
+    if actual_number is None or expected_number is None:
+        return actual == expected
+    return abs(actual_number - expected_number) <= max(tolerance, 1e-9 * max(1.0, abs(expected_number)))
+
+
+async def resolve_corpus(engine, corpus: list) -> list:
+    """Подставляет креатора в вопросы и считает ожидаемые ответы эталонным SQL"""
+    from sqlalchemy import text
+    from bot.handlers import format_result
+
+    async with engine.connect() as conn:
+        creator = await conn.scalar(text(TOP_CREATOR_SQL))
+        if creator is None:
+            raise RuntimeError("Таблица videos пуста: загрузите данные (init_db.py или tools/bench_ingest.py)")
+
+        cases = []
+        for item in corpus:
+            sql = item['expected_sql'].replace('{creator}', creator)
+            value = (await conn.execute(text(sql))).scalar()
+            cases.append({
+                'question': item['question'].replace('{creator}', creator),
+                'expected_sql': sql,
+                'expected': format_result(value),
+                'tolerance': item.get('tolerance', 0.0),
+                'tags': item.get('tags', []),
+            })
+    return cases
+
+
+async def answer_case(case: dict, db_operations) -> dict:
+    """Вопрос через parse_question и execute_query с замером стадий"""
+    from bot.handlers import format_result
+    from database.query_policy import QueryRejected
+    from nlp.query_parser import parse_question
+
+    started = time.perf_counter()
+    parsed = await parse_question(case['question'])
+    parsed_at = time.perf_counter()
+
+    outcome = {'question': case['question'], 'parse': parsed_at - started, 'execute': 0.0}
+    if parsed is None:
+        outcome.update(path=None, sql=None, answer=None, error='no_sql')
+    else:
+        outcome.update(path=parsed.path, sql=parsed.sql)
+        try:
+            result = await db_operations.execute_query(parsed.sql, parsed.params)
+            outcome['answer'] = format_result(result)
+            outcome['error'] = None if result is not None else 'execute_failed'
+        except QueryRejected as e:
+            outcome.update(answer=None, error=f'rejected:{e.reason}')
+        outcome['execute'] = time.perf_counter() - parsed_at
+
+    outcome['total'] = time.perf_counter() - started
+    outcome['correct'] = outcome['error'] is None and same_answer(
+        outcome['answer'], case['expected'], case['tolerance'])
+    return outcome
+
+
+async def run_corpus(args) -> dict:
+    from database.db_handlers import DatabaseOperations
+    from nlp import query_parser
+
+    recordings = load_json(args.recordings, {})
+    corpus = load_json(args.corpus, None)
+    if corpus is None:
+        raise RuntimeError(f"Корпус не найден: {args.corpus}")
+    if args.tags:
+        wanted = set(args.tags.split(','))
+        corpus = [item for item in corpus if wanted & set(item.get('tags', []))]
+
+    db_operations = DatabaseOperations()
+    try:
+        cases = await resolve_corpus(db_operations.engine, corpus)
+
+        if args.llm == 'oracle':
+            backend = ReplayLLM({case['question']: case['expected_sql'] for case in cases}, args.llm_delay)
+        elif args.llm == 'replay':
+            backend = ReplayLLM(recordings, args.llm_delay)
+        else:
+            live = query_parser.get_llm_client()
+            backend = RecordingLLM(live, recordings) if args.record else live
+        query_parser.set_llm_backend(backend)
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def limited(case):
+            async with semaphore:
+                return await answer_case(case, db_operations)
+
+        outcomes = []
+        started = time.perf_counter()
+        for run in range(1, args.passes + 1):
+            for case, outcome in zip(cases, await asyncio.gather(*(limited(case) for case in cases))):
+                outcome.update(run=run, expected=case['expected'], tags=case['tags'])
+                outcomes.append(outcome)
+        elapsed = time.perf_counter() - started
+
+        if args.record:
+            with open(args.record, 'w', encoding='utf-8') as f:
+                json.dump(recordings, f, ensure_ascii=False, indent=2)
+
+        result_cache = db_operations.result_cache
+        return {
+            'questions': len(cases),
+            'passes': args.passes,
+            'seconds': round(elapsed, 3),
+            'llm': args.llm,
+            'report': build_report(outcomes),
+            'paths': query_parser.path_stats(),
+            'question_cache': query_parser.question_cache.stats(),
+            'result_cache': result_cache.stats() if result_cache is not None else None,
+            'prompt': query_parser.prompt_builder.stats(),
+            'llm_stats': backend.stats() if hasattr(backend, 'stats') else None,
+            'policy': db_operations.policy_stats(),
+            'columnar': db_operations.columnar_stats(),
+            'fingerprints': db_operations.fingerprint_stats(5),
+            'outcomes': outcomes,
+        }
+    finally:
+        await db_operations.close()
+
+
+def build_report(outcomes: list) -> dict:
+    """Перцентили по стадиям (всего, по путям разбора и прогонам) и точность"""
+    latency = {stage: latency_summary([item[stage] for item in outcomes]) for stage in STAGES}
+
+    by_path = defaultdict(list)
+    by_run = defaultdict(list)
+    for item in outcomes:
+        by_path[item['path'] or 'none'].append(item['total'])
+        by_run[item['run']].append(item['total'])
+
+    tags = defaultdict(Counter)
+    for item in outcomes:
+        for tag in item['tags']:
+            tags[tag]['total'] += 1
+            tags[tag]['correct'] += item['correct']
+
+    correct = sum(item['correct'] for item in outcomes)
+    return {
+        'latency_ms': latency,
+        'total_by_path_ms': {path: latency_summary(values) for path, values in by_path.items()},
+        'total_by_pass_ms': {run: latency_summary(values) for run, values in by_run.items()},
+        'accuracy': correct / len(outcomes) if outcomes else 0.0,
+        'accuracy_by_tag': {tag: counts['correct'] / counts['total'] for tag, counts in sorted(tags.items())},
+        'errors': dict(Counter(item['error'] for item in outcomes if item['error'])),
+        'wrong': [
+            {key: item[key] for key in ('run', 'question', 'path', 'sql', 'answer', 'expected', 'error')}
+            for item in outcomes if not item['correct']
+        ],
+    }
+
+
+def print_results(results: dict):
+    report = results['report']
+    print(
+        f"{results['questions']} вопросов × {results['passes']} прогонов за {results['seconds']:.2f} с, "
+        f"источник SQL: {results['llm']}, правильных ответов: {report['accuracy']:.1%}"
+    )
+    print(f"  {'стадия':<22} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}  мс")
+    rows = [(stage, report['latency_ms'][stage]) for stage in STAGES]
+    rows += [(f'total/{path}', summary) for path, summary in report['total_by_path_ms'].items()]
+    rows += [(f'total/прогон {run}', summary) for run, summary in report['total_by_pass_ms'].items()]
+    for name, summary in rows:
+        print(f"  {name:<22} {summary['p50']:>9.2f} {summary['p95']:>9.2f} {summary['p99']:>9.2f} {summary['max']:>9.2f}")
+
+    print(f"  пути разбора: {results['paths']}")
+    print(f"  кэш вопросов: {results['question_cache']}")
+    print(f"  кэш результатов: {results['result_cache']}")
+    print(f"  промпт: {results['prompt']}")
+    if results['columnar'] is not None:
+        print(f"  колоночный движок: {results['columnar']}")
+    if results['llm_stats'] is not None:
+        print(f"  модель: {results['llm_stats']}")
+    for item in results['fingerprints']:
+        print(f"  форма {item['fingerprint']}: {item['count']} раз, p50 {item['p50_ms']:.2f} мс, "
+              f"p95 {item['p95_ms']:.2f} мс, всего {item['total_ms']:.0f} мс: {item['sql']}")
+    print(f"  точность по тегам: " + ', '.join(
+        f"{tag} {share:.0%}" for tag, share in report['accuracy_by_tag'].items()))
+    if report['errors']:
+        print(f"  ошибки: {report['errors']}")
+    for item in report['wrong']:
+        print(f"  ✗ [{item['run']}] {item['question']}")
+        print(f"      путь {item['path']}, ответ {item['answer']}, ожидалось {item['expected']}, SQL: {item['sql']}")
+
+
+def main(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description="Прогон корпуса вопросов: задержки, кэши, точность")
+    parser.add_argument('--corpus', default=CORPUS_PATH, help="JSON-список {question, expected_sql, tags}")
+    parser.add_argument('--llm', choices=('live', 'replay', 'oracle'), default='replay',
+                        help="источник SQL для вопросов, не разобранных локально")
+    parser.add_argument('--recordings', default='', help="записанные ответы модели {вопрос: SQL}")
+    parser.add_argument('--record', default='', help="(--llm live) сохранить ответы модели в файл")
+    parser.add_argument('--llm-delay', type=float, default=0.0,
+                        help="(replay/oracle) имитируемая задержка модели, с")
+    parser.add_argument('--passes', type=int, default=2, help="прогонов корпуса (второй — с теплыми кэшами)")
+    parser.add_argument('--concurrency', type=int, default=1, help="одновременных вопросов")
+    parser.add_argument('--tags', default='', help="только вопросы с этими тегами (через запятую)")
+    parser.add_argument('--quiet', action='store_true', help="не выводить лог бота")
+    parser.add_argument('--json', help="записать результаты в JSON-файл")
+    args = parser.parse_args(argv)
+
+    if args.record and args.llm != 'live':
+        parser.error("--record используется только с --llm live")
+    if args.llm == 'replay' and not args.recordings:
+        parser.error("для --llm replay нужен --recordings")
+
+    logging.basicConfig(level=logging.WARNING if args.quiet else logging.INFO)
+
+    results = asyncio.run(run_corpus(args))
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2, default=str)
+    return results
+
+
+if __name__ == '__main__':
+    main()